@@ -45,9 +45,11 @@ INSTALLED_APPS = [
     "users.apps.UsersConfig",
     "stats.apps.StatsConfig",
     "product.apps.ProductConfig",
+    "perf.apps.PerfConfig",
 ]
 
 MIDDLEWARE = [
+    'perf.middleware.PerfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -127,6 +129,30 @@ REST_FRAMEWORK = {
     )
 }
 
+# In-process LRU cache of the barcode (prod_code) lookup used by the scanners
+PRODUCT_CODE_CACHE_SIZE = 4096
+PRODUCT_CODE_CACHE_TIMEOUT = 30  # seconds, bounds staleness across worker processes
+# In-process prefix index of product names and codes for autocomplete
+PRODUCT_AUTOCOMPLETE_TIMEOUT = 300  # seconds before it is reloaded from the database
+
+# In-process cache of encoded reports, invalidated by new movements and edits
+REPORT_CACHE_SIZE = 32
+REPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Seconds a report request waits for an identical one already being computed
+REPORT_COALESCE_TIMEOUT = 60
+# Processes computing a report in parallel shards, 1 computes it in the request
+REPORT_WORKERS = 1
+REPORT_SHARD_MIN_PRODUCTS = 1000  # smallest shard worth a process
+
+# Requests over either budget are logged by perf.middleware.PerfMiddleware
+PERF_QUERY_BUDGET = 50
+PERF_TIME_BUDGET = 1.0  # seconds
+# Opt-in log of the SQL statements slower than this many seconds with their EXPLAIN plans,
+# exported with `manage.py export_slow_queries`; None disables it
+PERF_SLOW_QUERY_THRESHOLD = None
+PERF_SLOW_QUERY_LOG_SIZE = 200  # statements kept per process
+PERF_SLOW_QUERY_DIR = BASE_DIR / 'slow_queries'
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=5),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=10),
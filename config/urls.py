@@ -25,4 +25,5 @@ urlpatterns = [
     path('user/', include('users.urls')),
     path('', include("product.urls")),
     path('stats/', include("stats.urls")),
+    path('perf/', include("perf.urls")),
 ]
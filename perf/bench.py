@@ -0,0 +1,150 @@
+import math
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.test import Client
+from django.utils.timezone import localdate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from product.cache import product_code_cache
+from product.models import Product
+from stats.cache import report_cache
+from users.models import User
+from .middleware import QueryRecorder
+
+
+class Benchmark:
+    """An endpoint called with the (path, data) returned by `request(sample)`, after `before` if given."""
+
+    def __init__(self, name, method, request, before=None):
+        self.name = name
+        self.method = method
+        self.request = request
+        self.before = before
+
+
+class Sample:
+    """Request parameters drawn from the products of the database."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.products = list(Product.objects.filter(is_deleted=False).values_list('pk', 'prod_code', 'quantity'))
+        if not self.products:
+            raise ValueError("There are no products to benchmark")
+        self.in_stock = [pk for pk, _, quantity in self.products if quantity >= 1] or [self.products[0][0]]
+        today = localdate()
+        self.month = {'start_date': f'{today - timedelta(days=30):%Y-%m-%d}', 'end_date': f'{today:%Y-%m-%d}'}
+        self.year = {'start_date': f'{today - timedelta(days=365):%Y-%m-%d}', 'end_date': f'{today:%Y-%m-%d}'}
+
+    def product(self):
+        return self.rng.choice(self.products)
+
+
+BENCHMARKS = [
+    Benchmark('products page', 'get', lambda sample: ('/products/', {'page_size': 50})),
+    Benchmark('products list', 'get', lambda sample: ('/products/', {})),
+    # Cleared so that the lookups reach the database, as for scanned codes not seen lately
+    Benchmark('barcode lookup', 'get', lambda sample: ('/products/', {'prod_code': sample.product()[1]}),
+              before=product_code_cache.clear),
+    Benchmark('input post', 'post', lambda sample: ('/input/', {'product': sample.product()[0],
+                                                                'input_quantity': '5'})),
+    Benchmark('output post', 'post', lambda sample: ('/output/', {'product': sample.rng.choice(sample.in_stock),
+                                                                  'output_quantity': '0.01'})),
+    Benchmark('inputs page', 'get', lambda sample: ('/stats/inputs/', {'page_size': 50, **sample.month})),
+    Benchmark('outputs page', 'get', lambda sample: ('/stats/outputs/', {'page_size': 50, **sample.month})),
+    # Cleared so that every report is computed rather than read from the cache
+    Benchmark('report month', 'get', lambda sample: ('/stats/report/', sample.month), before=report_cache.clear),
+    Benchmark('report year', 'get', lambda sample: ('/stats/report/', sample.year), before=report_cache.clear),
+]
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted `values`."""
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def call(client, method, path, data):
+    """The response of a request, its streamed body read like a client would."""
+    options = {} if method == 'get' else {'content_type': 'application/json'}
+    response = getattr(client, method)(path, data, **options)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def _call(client, benchmark, sample):
+    return call(client, benchmark.method, *benchmark.request(sample))
+
+
+def measure(client, benchmark, sample, repeat=20, warmup=2):
+    """Latency percentiles (ms), SQL queries and peak Python memory (KB) of a request of the benchmark."""
+    for _ in range(warmup):
+        _call(client, benchmark, sample)
+
+    latencies, queries, errors = [], 0, 0
+    for _ in range(repeat):
+        if benchmark.before:
+            benchmark.before()
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder.install():
+            response = _call(client, benchmark, sample)
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries = max(queries, recorder.queries)
+        errors += response.status_code >= 400
+
+    # Measured apart, tracing allocations slows every request down
+    if benchmark.before:
+        benchmark.before()
+    tracemalloc.start()
+    try:
+        _call(client, benchmark, sample)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'p50': round(percentile(latencies, 50), 3),
+        'p90': round(percentile(latencies, 90), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'max': round(latencies[-1], 3),
+        'queries': queries,
+        'peak_kb': round(peak / 1024, 1),
+        'errors': errors,
+    }
+
+
+def benchmark_client():
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'position': 0})
+    return Client(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+
+def run_benchmarks(repeat=20, warmup=2, names=None, seed=None):
+    """{benchmark name: measure()} of every benchmark (or those in `names`) on the current database."""
+    sample = Sample(random.Random(seed))
+    client = benchmark_client()
+    return {benchmark.name: measure(client, benchmark, sample, repeat, warmup)
+            for benchmark in BENCHMARKS if not names or benchmark.name in names}
+
+
+def compare(results, baseline, tolerance=0.25, min_change=2.0):
+    """
+    (size, name, p50 change, query change, regressed) of every benchmark also in `baseline`.
+    A median slower by more than `tolerance` and `min_change` ms, or any extra query, is a
+    regression; the absolute floor keeps the noise of millisecond requests out.
+    """
+    changes = []
+    for size, measured in results.items():
+        for name, result in measured.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            slower = result['p50'] - before['p50']
+            p50 = slower / before['p50'] if before['p50'] else 0
+            queries = result['queries'] - before['queries']
+            changes.append((size, name, p50, queries, (p50 > tolerance and slower > min_change) or queries > 0))
+    return changes
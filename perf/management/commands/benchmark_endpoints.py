@@ -0,0 +1,102 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from perf.bench import BENCHMARKS, compare, run_benchmarks
+from perf.seed import seed_warehouse
+from product.autocomplete import product_prefix_index
+from product.cache import product_code_cache
+from stats.cache import report_cache
+
+COLUMNS = ('p50', 'p90', 'p99', 'max', 'queries', 'peak_kb', 'errors')
+
+
+class Command(BaseCommand):
+    help = ("Time the main endpoints on seeded databases of several sizes, each created and destroyed "
+            "like a test database, or on the current database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="Products seeded")
+        parser.add_argument('--movements-per-product', type=int, default=20)
+        parser.add_argument('--years', type=float, default=1)
+        parser.add_argument('--current-db', action='store_true',
+                            help="Benchmark the data of the current database instead, in a transaction rolled "
+                                 "back at the end")
+        parser.add_argument('--only', action='append', choices=[benchmark.name for benchmark in BENCHMARKS],
+                            help="Only this benchmark, can be repeated")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-baseline', metavar='PATH', help="Save the results to compare later runs to")
+        parser.add_argument('--baseline', metavar='PATH', help="Compare to results saved with --save-baseline")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Median slowdown (0.25 is 25%%) above which a benchmark has regressed")
+        parser.add_argument('--min-change', type=float, default=2.0,
+                            help="Smallest median slowdown in ms counted as a regression")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)['results']
+
+        results = {}
+        # DEBUG would keep every query of the run in memory
+        with override_settings(DEBUG=False):
+            if options['current_db']:
+                results['current'] = self.run_current(options)
+            else:
+                for size in options['sizes']:
+                    results[str(size)] = self.run_seeded(size, options)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as file:
+                json.dump({'options': {key: options[key] for key in ('movements_per_product', 'years', 'repeat')},
+                           'results': results}, file, indent=2)
+        if baseline is not None:
+            self.report_changes(compare(results, baseline, options['tolerance'], options['min_change']))
+
+    def run_current(self, options):
+        with transaction.atomic():
+            self.stdout.write("Current database")
+            measured = self.run(options)
+            transaction.set_rollback(True)
+        return measured
+
+    def run_seeded(self, size, options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            _, movements = seed_warehouse(products=size, years=options['years'],
+                                          movements_per_product=options['movements_per_product'],
+                                          seed=options['seed'])
+            self.stdout.write(f"{size} products, {movements} movements "
+                              f"(seeded in {time.perf_counter() - started:.1f}s)")
+            return self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        for cache in (report_cache, product_code_cache, product_prefix_index):
+            cache.clear()
+        measured = run_benchmarks(options['repeat'], options['warmup'], options['only'], options['seed'])
+        self.stdout.write(f"  {'benchmark':<16}" + ''.join(f'{column:>10}' for column in COLUMNS))
+        for name, result in measured.items():
+            self.stdout.write(f"  {name:<16}" + ''.join(f'{result[column]:>10}' for column in COLUMNS))
+        return measured
+
+    def report_changes(self, changes):
+        regressions = 0
+        self.stdout.write("Compared to the baseline:")
+        for size, name, p50, queries, regressed in changes:
+            line = f"  {size:>8} {name:<16} p50 {p50:+.0%}, queries {queries:+d}"
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line + " REGRESSION"))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f"{regressions} benchmarks regressed")
@@ -0,0 +1,47 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from perf.slow_queries import clear_entries, load_entries
+
+
+class Command(BaseCommand):
+    help = "Export the slow SQL statements logged by the server processes (PERF_SLOW_QUERY_THRESHOLD)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['json', 'text'], default='json')
+        parser.add_argument('--output', help="File to write to instead of the standard output")
+        parser.add_argument('--slowest', action='store_true', help="Slowest first instead of oldest first")
+        parser.add_argument('--clear', action='store_true', help="Empty the log after exporting it")
+
+    def handle(self, *args, **options):
+        directory = getattr(settings, 'PERF_SLOW_QUERY_DIR', None)
+        if not directory:
+            raise CommandError("PERF_SLOW_QUERY_DIR is not set")
+
+        entries = load_entries(directory)
+        if options['slowest']:
+            entries.sort(key=lambda entry: entry['duration'], reverse=True)
+        if options['format'] == 'json':
+            content = json.dumps(entries, indent=2, default=str) + '\n'
+        else:
+            content = ''.join(self.format_entry(entry) for entry in entries)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(content)
+        else:
+            self.stdout.write(content, ending='')
+        if options['clear']:
+            clear_entries(directory)
+        self.stderr.write(f"{len(entries)} slow statements exported")
+
+    @staticmethod
+    def format_entry(entry):
+        plan = ''.join(f'    {line}\n' for line in entry['plan'].splitlines())
+        return (f"{entry['recorded_at']} {entry['duration'] * 1000:.1f}ms {entry['view'] or '-'} {entry['path']}\n"
+                f"  at {entry['location'] or '-'}\n"
+                f"  {entry['sql']}\n"
+                f"  params: {entry['params']}\n"
+                f"{plan}\n")
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from perf.seed import seed_warehouse
+
+
+class Command(BaseCommand):
+    help = "Add synthetic categories, units, products and their movement history to the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--units', type=int, default=5)
+        parser.add_argument('--years', type=float, default=1, help="Length of the history, ending now")
+        parser.add_argument('--movements-per-product', type=int, default=50)
+        parser.add_argument('--seed', type=int, help="Random seed, for a reproducible data set")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        product_ids, movements = seed_warehouse(
+            products=options['products'], categories=options['categories'], units=options['units'],
+            years=options['years'], movements_per_product=options['movements_per_product'], seed=options['seed'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(product_ids)} products and {movements} movements created "
+            f"in {time.perf_counter() - started:.1f}s"))
@@ -0,0 +1,79 @@
+import os
+import tempfile
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from perf.stress import create_hot_products, run_stress, verify_stock
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ("Post concurrent inputs and outputs of a few hot products from many threads and processes, "
+            "then check that no stock change was lost and every balance is right")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5, help="Hot products every request picks from")
+        parser.add_argument('--stock', type=Decimal, default=Decimal(100), help="Starting stock of each product")
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--threads', type=int, default=8, help="Threads of each process")
+        parser.add_argument('--requests', type=int, default=250, help="Requests of each thread")
+        parser.add_argument('--output-share', type=float, default=0.5, help="Share of the requests that are outputs")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--current-db', action='store_true',
+                            help="Run on the current database, the products and movements created are kept")
+
+    def handle(self, *args, **options):
+        # DEBUG would keep every query of the run in memory
+        with override_settings(DEBUG=False):
+            if options['current_db']:
+                self.stress(options)
+            else:
+                self.stress_test_db(options)
+
+    def stress_test_db(self, options):
+        test_settings = connection.settings_dict['TEST']
+        old_test_name = test_settings.get('NAME')
+        directory = None
+        if connection.vendor == 'sqlite' and not old_test_name:
+            # The in-memory test database can't be shared with other processes
+            directory = tempfile.TemporaryDirectory()
+            test_settings['NAME'] = os.path.join(directory.name, 'stress.sqlite3')
+        try:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.stress(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            test_settings['NAME'] = old_test_name
+            if directory is not None:
+                directory.cleanup()
+
+    def stress(self, options):
+        user, _ = User.objects.get_or_create(username='stress', defaults={'position': 1})
+        product_ids = create_hot_products(options['products'], options['stock'], user)
+        result = run_stress(product_ids, options['processes'], options['threads'], options['requests'],
+                            options['output_share'], options['seed'])
+
+        self.stdout.write(f"{result['requests']} requests in {result['seconds']}s, "
+                          f"{result['throughput']} requests/s")
+        self.stdout.write(f"  latency ms: p50 {result['p50']}, p90 {result['p90']}, p99 {result['p99']}, "
+                          f"max {result['max']}")
+        statuses = ', '.join(f'{code}: {count}' for code, count in sorted(result['statuses'].items()))
+        self.stdout.write(f"  statuses: {statuses}")
+        if result['locked']:
+            # Not a lost movement, the request was refused and rolled back
+            self.stdout.write(self.style.WARNING(f"  {result['locked']} requests timed out waiting for a lock"))
+        for failure in result['failures']:
+            self.stdout.write(self.style.ERROR(f'  {failure}'))
+
+        expected = {product_id: options['stock'] + change for product_id, change in result['accepted'].items()}
+        problems = verify_stock(expected)
+        for problem in problems:
+            self.stdout.write(self.style.ERROR(f'  {problem}'))
+        if problems or result['failures']:
+            raise CommandError(f"{len(problems)} stock problems, {len(result['failures'])} unexpected answers")
+        self.stdout.write(self.style.SUCCESS("Every quantity, balance and snapshot is right"))
@@ -0,0 +1,130 @@
+import threading
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets, the last bucket (+Inf) is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum, like a Prometheus histogram."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations up to it) of every bucket, ending with +Inf."""
+        total, result = 0, []
+        for bound, count in zip((*self.buckets, float('inf')), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'buckets': {_bound(bound): count for bound, count in self.cumulative()},
+        }
+
+
+class EndpointMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_time = 0
+        self.max_latency = 0
+        self.max_queries = 0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'requests': self.latency.count,
+            'errors': self.errors,
+            'latency': self.latency.as_dict(),
+            'max_latency': round(self.max_latency, 6),
+            'queries': self.queries.as_dict(),
+            'max_queries': self.max_queries,
+            'sql_time': round(self.sql_time, 6),
+        }
+
+
+class RequestMetrics:
+    """
+    Thread-safe per-endpoint request metrics of this process, keyed by URL route and method.
+    Each worker process keeps its own.
+    """
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, name, method, status_code, latency, queries, sql_time):
+        with self._lock:
+            endpoint = self._endpoints.get((route, method))
+            if endpoint is None:
+                endpoint = self._endpoints[route, method] = EndpointMetrics(name)
+            endpoint.latency.observe(latency)
+            endpoint.queries.observe(queries)
+            endpoint.sql_time += sql_time
+            endpoint.max_latency = max(endpoint.max_latency, latency)
+            endpoint.max_queries = max(endpoint.max_queries, queries)
+            if status_code >= 500:
+                endpoint.errors += 1
+
+    def metrics(self):
+        with self._lock:
+            return [{'route': route, 'method': method, **endpoint.as_dict()}
+                    for (route, method), endpoint in sorted(self._endpoints.items())]
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = []
+            for metric, kind, description, value in PROMETHEUS_METRICS:
+                lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {kind}']
+                for (route, method), endpoint in endpoints:
+                    labels = f'route="{_escape(route)}",name="{_escape(endpoint.name)}",method="{method}"'
+                    if kind == 'histogram':
+                        histogram = value(endpoint)
+                        for bound, count in histogram.cumulative():
+                            lines.append(f'{metric}_bucket{{{labels},le="{_bound(bound)}"}} {count}')
+                        lines.append(f'{metric}_sum{{{labels}}} {histogram.sum}')
+                        lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+                    else:
+                        lines.append(f'{metric}{{{labels}}} {value(endpoint)}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+PROMETHEUS_METRICS = (
+    ('http_request_duration_seconds', 'histogram', 'Request latency in seconds.', lambda e: e.latency),
+    ('http_request_queries', 'histogram', 'SQL queries per request.', lambda e: e.queries),
+    ('http_request_sql_seconds_total', 'counter', 'Time spent in SQL queries in seconds.', lambda e: e.sql_time),
+    ('http_request_errors_total', 'counter', 'Requests answered with a 5xx status.', lambda e: e.errors),
+)
+
+
+def _bound(bound):
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,94 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .metrics import request_metrics
+from .slow_queries import slow_query_log
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """
+    Execute wrapper counting the SQL queries of a request and the time spent in them,
+    the slow ones are added to `slow_query_log`.
+    """
+
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = 0
+        self.sql_time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            result = execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.sql_time += duration
+            self.queries += 1
+        if slow_query_log.is_slow(duration):
+            slow_query_log.record(context['connection'], sql, params, many, duration, self.request)
+        return result
+
+    def install(self):
+        """Wrap the connections of the current thread until the returned stack is closed."""
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+        return stack
+
+
+class PerfMiddleware:
+    """
+    Record the latency, SQL query count and SQL time of every request in `request_metrics`
+    and log the requests over PERF_QUERY_BUDGET queries or PERF_TIME_BUDGET seconds.
+    The body of a streaming response is produced after the request is recorded.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.query_budget = getattr(settings, 'PERF_QUERY_BUDGET', 50)
+        self.time_budget = getattr(settings, 'PERF_TIME_BUDGET', 1.0)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        recorder = QueryRecorder(request)
+        with recorder.install():
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        recorder = QueryRecorder(request)
+        # Connections belong to a thread: wrap those of the thread running the queries of
+        # this request, the one of its thread sensitive sync_to_async() calls
+        stack = await sync_to_async(recorder.install)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    def record(self, request, response, latency, recorder):
+        match = request.resolver_match
+        route, name = (match.route, match.view_name) if match else ('<unmatched>', '')
+        request_metrics.record(route, name, request.method, response.status_code, latency,
+                               recorder.queries, recorder.sql_time)
+        if recorder.queries > self.query_budget or latency > self.time_budget:
+            logger.warning('%s %s took %.3fs with %d queries (%.3fs in SQL), status %s',
+                           request.method, request.get_full_path(), latency, recorder.queries,
+                           recorder.sql_time, response.status_code)
@@ -0,0 +1,125 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from product.models import Category, Product, StockMovement, Unit
+from product.search import index_products
+from stats.snapshots import rebuild_snapshots
+from users.models import User
+
+UNIT_NAMES = ['dona', 'kg', 'litr', 'metr', 'quti', 'paket', 'juft', 'tonna']
+WORDS = ['olma', 'non', 'sut', 'guruch', 'shakar', 'un', 'yog', 'choy', 'tuz', 'makaron', 'sovun', 'qog\'oz',
+         'mix', 'bolt', 'kabel', 'lampa', 'bo\'yoq', 'gips', 'sement', 'quvur']
+ADJECTIVES = ['qizil', 'oq', 'katta', 'kichik', 'premium', 'arzon', 'yangi', 'import', 'mahalliy', 'ekstra']
+SEED_PREFIX = '20'  # EAN-13 codes starting with 2 are for in-store use
+
+
+def ean13(first_12_digits):
+    odd_sum = sum(int(digit) for digit in first_12_digits[::2])
+    even_sum = sum(int(digit) for digit in first_12_digits[1::2]) * 3
+    return first_12_digits + str((10 - (odd_sum + even_sum) % 10) % 10)
+
+
+def _named(model, names):
+    existing = set(model.objects.filter(name__in=names).values_list('name', flat=True))
+    model.objects.bulk_create([model(name=name) for name in names if name not in existing])
+    return list(model.objects.filter(name__in=names).values_list('pk', flat=True))
+
+
+def seed_products(count, category_ids, unit_ids, rng, batch_size=2000):
+    """Create `count` products with free in-store barcodes and return their ids."""
+    taken = set(Product.objects.filter(prod_code__startswith=SEED_PREFIX).values_list('prod_code', flat=True))
+    start = Product.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    products, number = [], start
+    while len(products) < count:
+        number += 1
+        code = ean13(f'{SEED_PREFIX}{number:010d}')
+        if code in taken:
+            continue
+        name = f'{rng.choice(ADJECTIVES).capitalize()} {rng.choice(WORDS)} {number}'
+        products.append(Product(name=name, prod_code=code, price=Decimal(rng.randrange(500, 500000, 500)),
+                                category_id=rng.choice(category_ids), unit_id=rng.choice(unit_ids)))
+    created = []
+    for offset in range(0, count, batch_size):
+        created += Product.objects.bulk_create(products[offset:offset + batch_size])
+    return [product.pk for product in created]
+
+
+def movement_times(count, start, end, rng):
+    span = (end - start).total_seconds()
+    return sorted(start + timedelta(seconds=rng.random() * span) for _ in range(count))
+
+
+def seed_movements(product_ids, movements_per_product, start, end, user_ids, rng, batch_size=5000):
+    """
+    Post a history of inputs and outputs between `start` and `end`, every output taken from
+    the stock at hand so the all_quantity running balances never go negative.
+    Returns {product_id: final balance}.
+    """
+    balances = {product_id: Decimal(0) for product_id in product_ids}
+    timeline = []
+    for product_id in product_ids:
+        timeline += [(moved_at, product_id) for moved_at in
+                     movement_times(movements_per_product, start, end, rng)]
+    timeline.sort()
+
+    ops = connection.ops
+    batch = []
+    for moved_at, product_id in timeline:
+        balance = balances[product_id]
+        if balance > 0 and rng.random() < 0.6:
+            quantity = -min(balance, Decimal(rng.randint(1, 50)))
+            movement_type = StockMovement.OUTPUT
+        else:
+            quantity = Decimal(rng.randint(10, 200))
+            movement_type = StockMovement.INPUT
+        balance = balances[product_id] = balance + quantity
+        batch.append((product_id, movement_type, ops.adapt_decimalfield_value(quantity, 8, 2),
+                      ops.adapt_decimalfield_value(balance, 8, 2), ops.adapt_datetimefield_value(moved_at),
+                      rng.choice(user_ids)))
+        if len(batch) >= batch_size:
+            _insert_movements(batch)
+            batch = []
+    _insert_movements(batch)
+    return balances
+
+
+def _insert_movements(rows):
+    # Plain INSERTs, bulk_create spends most of the seeding time preparing each field value
+    fields = ['product', 'type', 'quantity', 'all_quantity', 'created_at', 'user_id']
+    columns = ', '.join(connection.ops.quote_name(StockMovement._meta.get_field(field).column) for field in fields)
+    sql = (f'INSERT INTO {connection.ops.quote_name(StockMovement._meta.db_table)} ({columns}) '
+           f'VALUES ({", ".join(["%s"] * len(fields))})')
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def seed_warehouse(products=1000, categories=20, units=5, years=1, movements_per_product=50, seed=None):
+    """
+    Add a synthetic warehouse: categories, units, products and `years` of movements ending now,
+    with consistent running balances, product quantities, snapshots and search index.
+    Returns (product ids, movements created).
+    """
+    rng = random.Random(seed)
+    with transaction.atomic():
+        user_ids = [User.objects.get_or_create(username=f'seed-omborchi-{i}', defaults={'position': 1})[0].pk
+                    for i in range(3)]
+        category_ids = _named(Category, [f'Kategoriya {i + 1}' for i in range(categories)])
+        unit_ids = _named(Unit, [UNIT_NAMES[i] if i < len(UNIT_NAMES) else f"O'lchov {i + 1}"
+                                 for i in range(units)])
+        product_ids = seed_products(products, category_ids, unit_ids, rng)
+
+        end = timezone.now()
+        start = end - timedelta(days=round(365 * years))
+        balances = seed_movements(product_ids, movements_per_product, start, end, user_ids, rng)
+        Product.objects.bulk_update([Product(pk=pk, quantity=quantity) for pk, quantity in balances.items()],
+                                    ['quantity'], batch_size=2000)
+        # bulk_create skips the signals keeping the search index up to date
+        for offset in range(0, len(product_ids), 500):
+            index_products(product_ids[offset:offset + 500])
+    for offset in range(0, len(product_ids), 500):
+        rebuild_snapshots(product_ids[offset:offset + 500])
+    return product_ids, len(product_ids) * movements_per_product
@@ -0,0 +1,132 @@
+import json
+import os
+import re
+import threading
+import traceback
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+# Only reads are explained, EXPLAIN of a write is not always side effect free
+EXPLAINED = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+PERF_DIR = Path(__file__).resolve().parent
+
+
+def explain(connection, sql, params):
+    """The query plan of a statement, read with a cursor of its own outside the execute wrappers."""
+    if not EXPLAINED.match(sql):
+        return ''
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+    except Exception as error:
+        return f'EXPLAIN failed: {error!r}'
+    finally:
+        cursor.close()
+
+
+def caller():
+    """
+    'path:line in function' of the innermost frame of the project apps that ran the
+    statement, leaving out entry points like manage.py.
+    """
+    base_dir = Path(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        path = Path(frame.filename)
+        if not path.is_relative_to(base_dir) or path.is_relative_to(PERF_DIR) or 'site-packages' in path.parts:
+            continue
+        relative = path.relative_to(base_dir)
+        if len(relative.parts) > 1:
+            return f'{relative}:{frame.lineno} in {frame.name}'
+    return ''
+
+
+def view_name(request):
+    match = request.resolver_match if request is not None else None
+    if match is None:
+        return ''
+    view = getattr(match.func, 'view_class', match.func)
+    return view.__name__
+
+
+class SlowQueryLog:
+    """
+    Ring buffer of the last `maxsize` statements of this process slower than `threshold`
+    seconds, None disables it.
+    Each process mirrors its buffer to a JSON file of `directory`, which the
+    export_slow_queries command reads. Slow statements are rare, so rewriting it is cheap.
+    """
+
+    def __init__(self, threshold=None, maxsize=200, directory=None):
+        self.threshold = threshold
+        self.directory = Path(directory) if directory else None
+        self._entries = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+
+    def is_slow(self, duration):
+        return self.threshold is not None and duration > self.threshold
+
+    def record(self, connection, sql, params, many, duration, request=None):
+        entry = {
+            'recorded_at': timezone.now().isoformat(),
+            'pid': os.getpid(),
+            'database': connection.alias,
+            'duration': round(duration, 6),
+            'view': view_name(request),
+            'path': request.get_full_path() if request is not None else '',
+            'location': caller(),
+            'sql': sql,
+            'params': None if many else list(params or ()),
+            'plan': '' if many else explain(connection, sql, params),
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self._save()
+        return entry
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def _path(self):
+        return self.directory / f'slow-queries-{os.getpid()}.json'
+
+    def _save(self):
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path()
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(list(self._entries), default=str))
+        os.replace(temporary, path)
+
+
+def load_entries(directory):
+    """Every entry saved by the processes logging into `directory`, oldest first."""
+    entries = []
+    for path in sorted(Path(directory).glob('slow-queries-*.json')):
+        try:
+            entries += json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue  # removed or being replaced meanwhile
+    return sorted(entries, key=lambda entry: entry['recorded_at'])
+
+
+def clear_entries(directory):
+    for path in Path(directory).glob('slow-queries-*.json'):
+        path.unlink(missing_ok=True)
+
+
+slow_query_log = SlowQueryLog(
+    threshold=getattr(settings, 'PERF_SLOW_QUERY_THRESHOLD', None),
+    maxsize=getattr(settings, 'PERF_SLOW_QUERY_LOG_SIZE', 200),
+    directory=getattr(settings, 'PERF_SLOW_QUERY_DIR', None),
+)
@@ -0,0 +1,176 @@
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+from django.db import OperationalError, connections
+from django.db.models import Sum
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+from product.models import Product, StockMovement
+from product.services import add_input
+from stats.balances import rebuild_balances
+from stats.models import DailyStock
+from stats.snapshots import daily_snapshots, movement_history
+from users.models import User
+from .bench import percentile
+
+STRESS_PREFIX = 'Stress'
+
+
+def create_hot_products(count, stock, user):
+    """`count` new products, each received `stock` with an input so their ledger starts consistent."""
+    start = Product.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    product_ids = []
+    for number in range(start + 1, start + count + 1):
+        product = Product.objects.create(name=f'{STRESS_PREFIX} {number}', prod_code=f'STRESS{number}', price=1000)
+        if stock:
+            add_input(product.pk, stock, user)
+        product_ids.append(product.pk)
+    return product_ids
+
+
+def stress_worker(token, product_ids, requests, output_share, seed):
+    """
+    POST `requests` inputs and outputs of random quantities of the products, an output with
+    probability `output_share`. Returns the latencies (ms), the response statuses, the stock
+    change of the accepted movements per product, the requests that timed out waiting for a
+    database lock and a few unexpected answers.
+    """
+    client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Bearer {token}')
+    rng = random.Random(seed)
+    latencies, statuses, failures, locked = [], Counter(), [], 0
+    accepted = {product_id: Decimal(0) for product_id in product_ids}
+    for _ in range(requests):
+        product_id = rng.choice(product_ids)
+        quantity = Decimal(rng.randint(1, 2000)) / 100
+        sign, path, field = (-1, '/output/', 'output_quantity') if rng.random() < output_share else \
+            (1, '/input/', 'input_quantity')
+        started = time.perf_counter()
+        response = client.post(path, {'product': product_id, field: str(quantity)})
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[response.status_code] += 1
+        if response.status_code == 201:
+            accepted[product_id] += sign * quantity
+            continue
+        # An output larger than the stock is refused
+        if (sign, response.status_code) == (-1, 400):
+            continue
+        error = response.exc_info[1] if getattr(response, 'exc_info', None) else response.content[:200]
+        # The database gave up waiting for a lock ("database is locked", lock timeout, deadlock):
+        # the load is over what it can serve, the movement was rolled back
+        if isinstance(error, OperationalError):
+            locked += 1
+        elif len(failures) < 5:
+            failures.append(f'{path} {response.status_code}: {error!r}')
+    return {'latencies': latencies, 'statuses': statuses, 'accepted': accepted, 'locked': locked,
+            'failures': failures}
+
+
+def _thread_worker(*args):
+    try:
+        return stress_worker(*args)
+    finally:
+        # Each thread opened connections of its own
+        connections.close_all()
+
+
+def run_threads(token, product_ids, threads, requests, output_share, seed):
+    """stress_worker() results of `threads` threads, each sending `requests` requests."""
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [executor.submit(_thread_worker, token, product_ids, requests, output_share, f'{seed}-{i}')
+                   for i in range(threads)]
+        return [future.result() for future in futures]
+
+
+def _process_worker(database, token, product_ids, threads, requests, output_share, seed):
+    settings.DEBUG = False
+    # The database of the parent process, which may have created it for the run
+    connections['default'].settings_dict['NAME'] = database
+    return run_threads(token, product_ids, threads, requests, output_share, seed)
+
+
+def run_stress(product_ids, processes=1, threads=8, requests=100, output_share=0.5, seed=None):
+    """
+    Send `requests` input and output POSTs of the products from each of `threads` threads of
+    each of `processes` processes and return the throughput, the latency percentiles (ms),
+    the response statuses, the requests that timed out on a lock and the expected stock
+    change of every product.
+    """
+    user, _ = User.objects.get_or_create(username='stress', defaults={'position': 1})
+    token = str(AccessToken.for_user(user))
+    args = (token, product_ids, threads, requests, output_share)
+
+    started = time.perf_counter()
+    if processes == 1:
+        results = run_threads(*args, seed)
+    else:
+        database = connections['default'].settings_dict['NAME']
+        # Spawned rather than forked, like the report pool
+        with ProcessPoolExecutor(processes, mp_context=get_context('spawn'), initializer=django.setup) as executor:
+            futures = [executor.submit(_process_worker, str(database), *args, f'{seed}-p{i}')
+                       for i in range(processes)]
+            results = [result for future in futures for result in future.result()]
+    seconds = time.perf_counter() - started
+
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    statuses, accepted = Counter(), {product_id: Decimal(0) for product_id in product_ids}
+    for result in results:
+        statuses.update(result['statuses'])
+        for product_id, change in result['accepted'].items():
+            accepted[product_id] += change
+    return {
+        'requests': len(latencies),
+        'seconds': round(seconds, 3),
+        'throughput': round(len(latencies) / seconds, 1) if seconds else 0,
+        'p50': round(percentile(latencies, 50), 3),
+        'p90': round(percentile(latencies, 90), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'max': round(latencies[-1], 3),
+        'statuses': dict(statuses),
+        'accepted': accepted,
+        'locked': sum(result['locked'] for result in results),
+        'failures': [failure for result in results for failure in result['failures']],
+    }
+
+
+def verify_stock(expected):
+    """
+    Problems found in the stock of the products of `expected` ({product_id: quantity}):
+    a quantity other than expected or than the sum of its movements, a broken all_quantity
+    chain, a negative balance or snapshots that differ from the movements.
+    """
+    product_ids = list(expected)
+    problems = []
+    quantities = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'quantity'))
+    sums = dict(StockMovement.objects.filter(product_id__in=product_ids).values('product_id')
+                .annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+    for product_id, quantity in expected.items():
+        if quantities[product_id] != quantity:
+            problems.append(f'Product {product_id}: quantity {quantities[product_id]}, expected {quantity}')
+        total = Decimal(sums.get(product_id) or 0).quantize(Decimal('0.01'))
+        if total != quantities[product_id]:
+            problems.append(f'Product {product_id}: quantity {quantities[product_id]}, movements sum to {total}')
+        if quantities[product_id] < 0:
+            problems.append(f'Product {product_id}: negative quantity {quantities[product_id]}')
+
+    _, _, balances_fixed, quantities_fixed = rebuild_balances(product_ids, dry_run=True)
+    if balances_fixed or quantities_fixed:
+        problems.append(f'{balances_fixed} movements with a wrong all_quantity, '
+                        f'{quantities_fixed} quantities other than the last balance')
+    negative = StockMovement.objects.filter(product_id__in=product_ids, all_quantity__lt=0).count()
+    if negative:
+        problems.append(f'{negative} movements leave a negative balance')
+
+    fields = ('product_id', 'date', 'opening_quantity', 'input_quantity', 'output_quantity', 'closing_quantity')
+    stored = set(DailyStock.objects.filter(product_id__in=product_ids).values_list(*fields))
+    rebuilt = {tuple(getattr(snapshot, field) for field in fields)
+               for snapshot in daily_snapshots(movement_history(product_ids))}
+    if stored != rebuilt:
+        problems.append(f'{len(stored ^ rebuilt)} snapshots differ from the movements')
+    return problems
@@ -0,0 +1,325 @@
+import json
+import random
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from product.autocomplete import product_prefix_index
+from product.cache import product_code_cache
+from product.models import Category, Product, ProductInput, ProductOutput, StockMovement, Unit
+from product.search import ranked_products
+from stats.balances import rebuild_balances
+from stats.cache import report_cache
+from stats.models import DailyStock, ReportJob
+from users.models import User
+from .bench import BENCHMARKS, Benchmark, Sample, benchmark_client, call, compare, run_benchmarks
+from .metrics import request_metrics
+from .seed import seed_warehouse
+from .slow_queries import load_entries, slow_query_log
+from .stress import create_hot_products, stress_worker, verify_stock
+
+
+class RequestMetricsTests(APITestCase):
+    """PerfMiddleware records every request per route and method."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('bugalter', password='secret', position=0)
+        Product.objects.create(name='Olma', price=1000, prod_code='4780000000001')
+
+    def setUp(self):
+        request_metrics.clear()
+        self.client.force_authenticate(self.user)
+
+    def endpoint(self, route, method='GET'):
+        return next(m for m in request_metrics.metrics() if m['route'] == route and m['method'] == method)
+
+    def test_records_requests(self):
+        self.client.get(reverse('products-search'), {'q': 'olma'})
+        self.client.get(reverse('products-search'), {'q': 'nok'})
+        self.client.get('/missing/')
+
+        search = self.endpoint('products/search/')
+        self.assertEqual(search['name'], 'products-search')
+        self.assertEqual(search['requests'], 2)
+        self.assertEqual(search['latency']['buckets']['+Inf'], 2)
+        self.assertGreaterEqual(search['queries']['sum'], 2)
+        self.assertEqual(self.endpoint('<unmatched>')['requests'], 1)
+
+        response = self.client.get(reverse('perf-prometheus'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{route="products/search/",name="products-search",'
+                      'method="GET"} 2', response.content.decode())
+
+        self.assertEqual(self.client.delete(reverse('perf-metrics')).status_code, 204)
+        # Only the reset itself was recorded since
+        self.assertEqual([(m['route'], m['method']) for m in self.client.get(reverse('perf-metrics')).data],
+                         [('perf/', 'DELETE')])
+
+    @override_settings(PERF_QUERY_BUDGET=0)
+    def test_logs_requests_over_budget(self):
+        with self.assertLogs('perf.middleware', 'WARNING') as logs:
+            self.client.get(reverse('products-search'), {'q': 'olma'})
+        self.assertIn('GET /products/search/?q=olma took', logs.output[0])
+
+    def test_staff_only(self):
+        self.client.force_authenticate(User.objects.create_user('reporter', password='secret', position=2))
+        self.assertEqual(self.client.get(reverse('perf-metrics')).status_code, 403)
+
+
+class SlowQueryLogTests(APITestCase):
+    """Statements over the threshold are kept with their origin and plan and can be exported."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        Product.objects.create(name='Olma', price=1000, prod_code='4780000000001')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for name, value in (('threshold', 0), ('directory', Path(self.directory))):
+            patcher = mock.patch.object(slow_query_log, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        slow_query_log.clear()
+        self.addCleanup(slow_query_log.clear)
+        self.client.force_authenticate(self.user)
+
+    def test_records_and_exports(self):
+        self.client.get(reverse('products-search'), {'q': 'olma'})
+        search = [entry for entry in slow_query_log.entries() if 'product_search' in entry['sql']]
+        self.assertTrue(search)
+        self.assertEqual(search[0]['view'], 'ProductSearchAPIView')
+        self.assertEqual(search[0]['path'], '/products/search/?q=olma')
+        self.assertTrue(search[0]['location'].startswith('product/search.py:'))
+        self.assertTrue(search[0]['plan'])
+        statements = [entry['sql'] for entry in slow_query_log.entries()]
+        self.assertEqual([entry['sql'] for entry in load_entries(self.directory)], statements)
+
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            with override_settings(PERF_SLOW_QUERY_DIR=self.directory):
+                call_command('export_slow_queries', output=output.name, clear=True, stderr=mock.Mock())
+            self.assertEqual([entry['sql'] for entry in json.load(output)], statements)
+        self.assertEqual(load_entries(self.directory), [])
+
+
+class SeedAndBenchmarkTests(APITestCase):
+    """Seeded data is consistent and the endpoint benchmarks run on it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product_ids, cls.movements = seed_warehouse(products=8, categories=2, units=2, years=0.1,
+                                                        movements_per_product=15, seed=1)
+
+    def test_seeded_data_is_consistent(self):
+        self.assertEqual(self.movements, 120)
+        self.assertEqual(StockMovement.objects.filter(product_id__in=self.product_ids).count(), 120)
+        self.assertFalse(StockMovement.objects.filter(all_quantity__lt=0).exists())
+        # Nothing for the ledger rebuild to fix
+        self.assertEqual(rebuild_balances(dry_run=True)[2:], (0, 0))
+        self.assertTrue(DailyStock.objects.filter(product_id__in=self.product_ids).exists())
+        product = Product.objects.get(pk=self.product_ids[0])
+        self.assertIn(product, ranked_products(product.name))
+
+    def test_benchmarks(self):
+        results = run_benchmarks(repeat=2, warmup=0, names=['barcode lookup', 'input post', 'report month'], seed=1)
+        self.assertEqual(list(results), ['barcode lookup', 'input post', 'report month'])
+        for result in results.values():
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['queries'], 0)
+            self.assertLessEqual(result['p50'], result['max'])
+
+    def test_compare(self):
+        baseline = {'1000': {'report': {'p50': 100, 'queries': 3}, 'lookup': {'p50': 1, 'queries': 2}}}
+        results = {'1000': {'report': {'p50': 150, 'queries': 3}, 'lookup': {'p50': 1.5, 'queries': 3},
+                            'new': {'p50': 1, 'queries': 1}}}
+        self.assertEqual(compare(results, baseline), [('1000', 'report', 0.5, 0, True),
+                                                      ('1000', 'lookup', 0.5, 1, True)])
+        results['1000']['lookup']['queries'] = 2
+        self.assertFalse(compare(results, baseline)[1][4])
+
+
+def _latest(model):
+    return model.objects.order_by('-pk').values_list('pk', flat=True).first()
+
+
+def _name(sample, prefix):
+    # Every call creates a new row, the names must not collide
+    return f'{prefix} {sample.rng.randrange(10 ** 9)}'
+
+
+def _product_data(sample):
+    return {'name': _name(sample, 'Mahsulot'), 'price': '1500', 'category': _latest(Category), 'unit': _latest(Unit)}
+
+
+# The benchmarked endpoints and the rest of the API, the writes followed by the deletes of what they created
+ENDPOINTS = BENCHMARKS + [
+    Benchmark('categories', 'get', lambda sample: ('/categories/', {})),
+    Benchmark('category post', 'post', lambda sample: ('/categories/', {'name': _name(sample, 'Kategoriya')})),
+    Benchmark('category', 'get', lambda sample: (f'/category/{_latest(Category)}', {})),
+    Benchmark('category put', 'put', lambda sample: (f'/category/{_latest(Category)}',
+                                                     {'name': _name(sample, 'Kategoriya')})),
+    Benchmark('units', 'get', lambda sample: ('/units/', {})),
+    Benchmark('unit post', 'post', lambda sample: ('/units/', {'name': _name(sample, "O'lchov")})),
+    Benchmark('unit', 'get', lambda sample: (f'/units/{_latest(Unit)}/', {})),
+    Benchmark('unit put', 'put', lambda sample: (f'/units/{_latest(Unit)}/', {'name': _name(sample, "O'lchov")})),
+    Benchmark('product post', 'post', lambda sample: ('/products/', _product_data(sample))),
+    Benchmark('product', 'get', lambda sample: (f'/product/{sample.product()[0]}', {})),
+    Benchmark('product put', 'put', lambda sample: (f'/product/{_latest(Product)}', _product_data(sample))),
+    Benchmark('product patch', 'patch', lambda sample: (f'/product/{_latest(Product)}', {'price': '1600'})),
+    Benchmark('product delete', 'delete', lambda sample: (f'/product/{_latest(Product)}', {})),
+    Benchmark('category delete', 'delete', lambda sample: (f'/category/{_latest(Category)}', {})),
+    Benchmark('unit delete', 'delete', lambda sample: (f'/units/{_latest(Unit)}/', {})),
+    Benchmark('products search', 'get', lambda sample: ('/products/search/', {'q': 'olma'})),
+    Benchmark('autocomplete', 'get', lambda sample: ('/products/autocomplete/', {'q': 'ol'})),
+    # Lines of distinct products, the queries grow with the lines of a delivery but not with the data
+    Benchmark('input bulk post', 'post', lambda sample: ('/input/bulk/', [
+        {'product': pk, 'input_quantity': '2'} for pk, _, _ in sample.rng.sample(sample.products, 3)])),
+    Benchmark('output bulk post', 'post', lambda sample: ('/output/bulk/', [
+        {'product': pk, 'output_quantity': '0.01'} for pk in sample.rng.sample(sample.in_stock, 3)])),
+    Benchmark('input backdate', 'post', lambda sample: ('/input/backdate/', {
+        'product': sample.product()[0], 'input_quantity': '1', 'created_at': sample.month['start_date']})),
+    Benchmark('output backdate', 'post', lambda sample: ('/output/backdate/', {
+        'product': sample.rng.choice(sample.in_stock), 'output_quantity': '0.01',
+        'created_at': sample.month['end_date']})),
+    Benchmark('input correction', 'patch', lambda sample: (f'/input/{_latest(ProductInput)}/',
+                                                           {'input_quantity': '300'})),
+    Benchmark('input delete', 'delete', lambda sample: (f'/input/{_latest(ProductInput)}/', {})),
+    Benchmark('output correction', 'patch', lambda sample: (f'/output/{_latest(ProductOutput)}/',
+                                                            {'output_quantity': '0.02'})),
+    Benchmark('output delete', 'delete', lambda sample: (f'/output/{_latest(ProductOutput)}/', {})),
+    Benchmark('inputs list', 'get', lambda sample: ('/stats/inputs/', sample.year)),
+    Benchmark('outputs list', 'get', lambda sample: ('/stats/outputs/', sample.year)),
+    Benchmark('outputs csv', 'get', lambda sample: ('/stats/outputs/', {'stream': 'csv', **sample.year})),
+    Benchmark('history page', 'get', lambda sample: ('/stats/history/', {'page_size': 50, **sample.year})),
+    Benchmark('report csv', 'get', lambda sample: ('/stats/report/', {'stream': 'csv', **sample.year})),
+    Benchmark('report cache', 'get', lambda sample: ('/stats/report/cache/', {})),
+    Benchmark('report job post', 'post', lambda sample: ('/stats/report/jobs/', sample.year)),
+    Benchmark('report jobs', 'get', lambda sample: ('/stats/report/jobs/', {})),
+    Benchmark('report job', 'get', lambda sample: (f'/stats/report/jobs/{_latest(ReportJob)}/', {})),
+    Benchmark('async inputs list', 'get', lambda sample: ('/stats/async/inputs/', sample.year)),
+    Benchmark('async outputs list', 'get', lambda sample: ('/stats/async/outputs/', sample.year)),
+    Benchmark('async history page', 'get', lambda sample: ('/stats/async/history/',
+                                                          {'page_size': 50, **sample.year})),
+    Benchmark('async report', 'get', lambda sample: ('/stats/async/report/', sample.year)),
+    Benchmark('omborchilar', 'get', lambda sample: ('/user/omborchilar/', {})),
+    Benchmark('omborchi post', 'post', lambda sample: ('/user/omborchi/new/', {
+        'username': _name(sample, 'omborchi').replace(' ', ''), 'password': 'secret'})),
+    Benchmark('omborchi', 'get', lambda sample: ('/user/omborchi/detail/', {'id': _latest(User)})),
+    Benchmark('omborchi patch', 'patch', lambda sample: (f'/user/omborchi/update/{_latest(User)}',
+                                                         {'first_name': 'Ali'})),
+    Benchmark('token', 'post', lambda sample: ('/user/token/', {
+        'username': User.objects.get(pk=_latest(User)).username, 'password': 'secret'})),
+    Benchmark('token refresh', 'post', lambda sample: ('/user/token/refresh/', {
+        'refresh': str(RefreshToken.for_user(User.objects.get(pk=_latest(User))))})),
+    Benchmark('report code put', 'put', lambda sample: ('/user/report-code/', {'password': 'kod123'})),
+    Benchmark('report code', 'get', lambda sample: ('/user/report-code/', {})),
+    Benchmark('reporter token', 'post', lambda sample: ('/user/reporter-token/', {'password': 'kod123'})),
+    Benchmark('perf metrics', 'get', lambda sample: ('/perf/', {})),
+    Benchmark('perf prometheus', 'get', lambda sample: ('/perf/metrics/', {})),
+    Benchmark('perf reset', 'delete', lambda sample: ('/perf/', {})),
+]
+# Sending these twice would create the same unique name twice
+NOT_REPEATED = {'category post', 'unit post', 'omborchi post'}
+# The most queries a request may make, counted with the user lookup of the JWT authentication
+# and the savepoints of the test transaction
+QUERY_BUDGETS = {
+    'products page': 2, 'products list': 2, 'barcode lookup': 2, 'product': 2, 'products search': 3,
+    'autocomplete': 2, 'categories': 2, 'category': 2, 'units': 2, 'unit': 2,
+    'category post': 4, 'category put': 7, 'category delete': 6, 'unit post': 4, 'unit put': 5, 'unit delete': 5,
+    'product post': 8, 'product put': 8, 'product patch': 6, 'product delete': 6,
+    'input post': 7, 'output post': 7, 'input bulk post': 9, 'output bulk post': 9,
+    'input backdate': 11, 'output backdate': 12, 'input correction': 19, 'input delete': 14,
+    'output correction': 19, 'output delete': 13,
+    'inputs page': 2, 'outputs page': 2, 'inputs list': 2, 'outputs list': 2, 'outputs csv': 2, 'history page': 2,
+    'report month': 3, 'report year': 3, 'report csv': 2, 'report cache': 1,
+    'report job post': 2, 'report jobs': 2, 'report job': 2,
+    'async inputs list': 2, 'async outputs list': 2, 'async history page': 2, 'async report': 3,
+    'omborchilar': 2, 'omborchi post': 3, 'omborchi': 2, 'omborchi patch': 3,
+    'token': 1, 'token refresh': 0, 'report code put': 3, 'report code': 2, 'reporter token': 3,
+    'perf metrics': 1, 'perf prometheus': 1, 'perf reset': 1,
+}
+
+
+class QueryBudgetTests(APITestCase):
+    """
+    The queries of a request don't grow with the data and stay within the budget of its endpoint,
+    so an N+1 query shows up as a failure rather than as a slow endpoint in production.
+    """
+
+    def query_counts(self):
+        sample = Sample(random.Random(1))
+        client = benchmark_client()
+        counts = {}
+        for endpoint in ENDPOINTS:
+            path, data = endpoint.request(sample)
+            if endpoint.method != 'delete' and endpoint.name not in NOT_REPEATED:
+                # The first movement of a product in a day also creates its snapshot row,
+                # whether one was already made depends on the sample
+                call(client, endpoint.method, path, data)
+            for cache in (report_cache, product_code_cache, product_prefix_index):
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = call(client, endpoint.method, path, data)
+            self.assertLess(response.status_code, 400, f'{endpoint.name}: {getattr(response, "data", "")}')
+            counts[endpoint.name] = len(queries)
+        return counts
+
+    def test_queries_do_not_grow_with_the_data(self):
+        # The account the report code logs in to
+        User.objects.create_user('reporter', position=2)
+        seed_warehouse(products=10, categories=2, units=2, movements_per_product=2, seed=1)
+        small = self.query_counts()
+        seed_warehouse(products=990, categories=2, units=2, movements_per_product=2, seed=2)
+        large = self.query_counts()
+        for endpoint in ENDPOINTS:
+            with self.subTest(endpoint.name):
+                self.assertEqual(large[endpoint.name], small[endpoint.name], "the queries grow with the data")
+                self.assertLessEqual(large[endpoint.name], QUERY_BUDGETS[endpoint.name], "over the budget")
+
+
+class StressTests(APITestCase):
+    """The stress harness keeps track of the accepted movements and finds a wrong stock."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        cls.product_ids = create_hot_products(2, Decimal(10), cls.user)
+
+    def test_stock_matches_accepted_movements(self):
+        result = stress_worker(str(AccessToken.for_user(self.user)), self.product_ids, 40, 0.6, 1)
+        self.assertEqual(len(result['latencies']), 40)
+        self.assertEqual(set(result['statuses']) - {201, 400}, set())
+        self.assertEqual((result['locked'], result['failures']), (0, []))
+        expected = {product_id: 10 + change for product_id, change in result['accepted'].items()}
+        self.assertEqual(verify_stock(expected), [])
+
+    def test_lock_timeouts_are_not_failures(self):
+        token = str(AccessToken.for_user(self.user))
+        with mock.patch('product.views.add_input', side_effect=OperationalError('database is locked')):
+            result = stress_worker(token, self.product_ids, 3, 0, 1)
+        self.assertEqual((result['statuses'], result['locked'], result['failures']), ({500: 3}, 3, []))
+        with mock.patch('product.views.add_input', side_effect=ValueError):
+            result = stress_worker(token, self.product_ids, 3, 0, 1)
+        self.assertEqual((result['locked'], len(result['failures'])), (0, 3))
+        self.assertEqual(verify_stock({product_id: 10 for product_id in self.product_ids}), [])
+
+    def test_finds_wrong_stock(self):
+        product_id = self.product_ids[0]
+        expected = {product_id: Decimal(10)}
+        Product.objects.filter(pk=product_id).update(quantity=9)
+        StockMovement.objects.filter(product_id=product_id).update(all_quantity=-1)
+        problems = verify_stock(expected)
+        self.assertEqual(len(problems), 5)
+        self.assertEqual(problems[0], f'Product {product_id}: quantity 9.00, expected 10')
@@ -0,0 +1,8 @@
+from django.urls import path
+from .views import *
+
+
+urlpatterns = [
+    path('', RequestMetricsAPIView.as_view(), name='perf-metrics'),
+    path('metrics/', PrometheusMetricsAPIView.as_view(), name='perf-prometheus'),
+]
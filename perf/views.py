@@ -0,0 +1,36 @@
+from django.http import HttpResponse
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from users.permissions import IsStaffUser
+from .metrics import request_metrics
+
+
+#### REQUEST METRICS ####
+class RequestMetricsAPIView(APIView):
+    """
+    Latency and SQL query histograms of every endpoint, recorded by PerfMiddleware
+    since this worker process started or the metrics were reset.
+    """
+    permission_classes = [IsAuthenticated, IsStaffUser]
+
+    @swagger_auto_schema(tags=['Performance'])
+    def get(self, request):
+        return Response(request_metrics.metrics())
+
+    @swagger_auto_schema(tags=['Performance'], responses={204: 'No Content'})
+    def delete(self, request):
+        request_metrics.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PrometheusMetricsAPIView(APIView):
+    """The same metrics in the Prometheus text format."""
+    permission_classes = [IsAuthenticated, IsStaffUser]
+
+    @swagger_auto_schema(tags=['Performance'])
+    def get(self, request):
+        return HttpResponse(request_metrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
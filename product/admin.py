@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Unit, Product, ProductInput, ProductOutput
+from .models import Category, Unit, Product, StockMovement
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -15,14 +15,19 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('category', 'unit',)
     search_fields = ('name', 'prod_code',)
 
-@admin.register(ProductInput)
-class ProductInputAdmin(admin.ModelAdmin):
-    list_display = ('product', 'input_quantity', 'created_at', 'user_id')
-    list_filter = ('created_at',)
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('product', 'type', 'quantity', 'all_quantity', 'created_at', 'user_id')
+    list_filter = ('type', 'created_at',)
     search_fields = ('product__name', 'user_id__username')
 
-@admin.register(ProductOutput)
-class ProductOutputAdmin(admin.ModelAdmin):
-    list_display = ('product', 'output_quantity', 'created_at', 'user_id')
-    list_filter = ('created_at',)
-    search_fields = ('product__name', 'user_id__username')
+    # Movements are posted, corrected and deleted through product.services, which also keep the
+    # product quantity, the later balances and the snapshots right
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
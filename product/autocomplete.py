@@ -0,0 +1,144 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+class PrefixIndex:
+    """
+    Thread-safe in-process autocomplete index of the products that are not deleted.
+    Keys are kept in sorted lists, so the products starting with a prefix are a
+    contiguous run found by binary search: the name and the prod_code in the first,
+    the name from each of its later words in the second, only searched after it.
+    The index is loaded on first use and kept up to date by product/signals.py; it is
+    reloaded after `timeout` seconds, which bounds how long a product changed by another
+    worker process can stay stale. A reload is built outside the lock, searches of a stale
+    index keep answering from it meanwhile, and the changes made during it are replayed.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._entries = ([], [])  # sorted (key, product id) per tier
+        self._products = {}  # product id -> (keys, {'id', 'name', 'prod_code'})
+        self._loaded_at = None
+        self._pending = None  # changes made while the index is being reloaded
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+
+    @staticmethod
+    def keys(name, prod_code):
+        """(tier, key) of a product."""
+        words = normalize(name).split(' ')
+        keys = {(0, ' '.join(words)), (0, normalize(prod_code))}
+        keys |= {(1, ' '.join(words[i:])) for i in range(1, len(words))}
+        return {(tier, key) for tier, key in keys if key}
+
+    def _build(self):
+        """New (entries, products) of the products in the database."""
+        from .models import Product
+        products = Product.objects.filter(is_deleted=False).values_list('pk', 'name', 'prod_code')
+        entries, found = ([], []), {}
+        for product_id, name, prod_code in products.iterator(chunk_size=2000):
+            keys = self.keys(name, prod_code)
+            found[product_id] = (keys, {'id': product_id, 'name': name, 'prod_code': prod_code})
+            for tier, key in keys:
+                entries[tier].append((key, product_id))
+        for tier_entries in entries:
+            tier_entries.sort()
+        return entries, found
+
+    def _load(self):
+        # Only the first search waits for the index, the others answer from the stale one
+        if not self._load_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            with self._lock:
+                if self._is_loaded():
+                    return
+                self._pending = []
+            entries, products = self._build()
+            with self._lock:
+                self._entries, self._products = entries, products
+                self._loaded_at = time.monotonic()
+                for change in self._pending:
+                    self._apply(*change)
+        finally:
+            with self._lock:
+                self._pending = None
+            self._load_lock.release()
+
+    def _add(self, product_id, name, prod_code):
+        keys = self.keys(name, prod_code)
+        self._products[product_id] = (keys, {'id': product_id, 'name': name, 'prod_code': prod_code})
+        return keys
+
+    def _remove(self, product_id):
+        keys, _ = self._products.pop(product_id, ((), None))
+        for tier, key in keys:
+            entries = self._entries[tier]
+            position = bisect_left(entries, (key, product_id))
+            if position < len(entries) and entries[position] == (key, product_id):
+                del entries[position]
+
+    def _is_loaded(self):
+        if self._loaded_at is None:
+            return False
+        return self.timeout is None or time.monotonic() - self._loaded_at <= self.timeout
+
+    def _apply(self, product_id, name=None, prod_code=None, is_deleted=True):
+        self._remove(product_id)
+        if not is_deleted:
+            for tier, key in self._add(product_id, name, prod_code):
+                insort(self._entries[tier], (key, product_id))
+
+    def update(self, product_id, name, prod_code, is_deleted=False):
+        """Reflect a saved product; a no-op until the index is loaded."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((product_id, name, prod_code, is_deleted))
+            if self._loaded_at is not None:
+                self._apply(product_id, name, prod_code, is_deleted)
+
+    def remove(self, product_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((product_id,))
+            self._remove(product_id)
+
+    def search(self, prefix, limit=10):
+        """Up to `limit` products with a key starting with `prefix`, by tier and key."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            loaded = self._is_loaded()
+        if not loaded:
+            self._load()
+        with self._lock:
+            found = {}
+            for entries in self._entries:
+                position = bisect_left(entries, (prefix,))
+                while len(found) < limit and position < len(entries):
+                    key, product_id = entries[position]
+                    if not key.startswith(prefix):
+                        break
+                    if product_id not in found:
+                        found[product_id] = dict(self._products[product_id][1])
+                    position += 1
+            return list(found.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries, self._products = ([], []), {}
+            self._loaded_at = None
+
+    def __len__(self):
+        return len(self._products)
+
+
+product_prefix_index = PrefixIndex(timeout=getattr(settings, 'PRODUCT_AUTOCOMPLETE_TIMEOUT', 300))
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process LRU cache with a per-entry timeout.
+    Entries older than `timeout` seconds are treated as missing, which bounds how long
+    a value changed by another worker process can stay stale.
+    """
+
+    def __init__(self, maxsize=1024, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, stored_at = entry
+            if self.timeout is not None and time.monotonic() - stored_at > self.timeout:
+                del self._data[key]
+                self._removed(key, value)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            replaced = self._data.get(key)
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            if replaced is not None:
+                self._removed(key, replaced[0])
+            while len(self._data) > self.maxsize:
+                evicted, (evicted_value, _) = self._data.popitem(last=False)
+                self._removed(evicted, evicted_value)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._removed(key, entry[0])
+
+    def _removed(self, key, value):
+        """Called with the lock held for every entry replaced, evicted, expired or deleted."""
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ProductCodeCache(LRUCache):
+    """
+    prod_code -> serialized product, which can also be invalidated by product id.
+    The codes of a product are only kept while their entries are, and a product whose
+    code changed can still have an entry under the old one until it is invalidated.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._codes = {}
+
+    def set(self, key, value):
+        with self._lock:
+            super().set(key, value)
+            self._codes.setdefault(value['id'], set()).add(key)
+
+    def _removed(self, key, value):
+        codes = self._codes.get(value['id'])
+        if codes is not None:
+            codes.discard(key)
+            if not codes:
+                del self._codes[value['id']]
+
+    def invalidate_products(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                for code in list(self._codes.get(product_id, ())):
+                    self.delete(code)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._codes.clear()
+
+
+product_code_cache = ProductCodeCache(
+    maxsize=getattr(settings, 'PRODUCT_CODE_CACHE_SIZE', 4096),
+    timeout=getattr(settings, 'PRODUCT_CODE_CACHE_TIMEOUT', 30),
+)
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:34
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_codes(apps, schema_editor):
+    """Stop before altering the column when codes are shared, rather than failing halfway."""
+    Product = apps.get_model('product', 'Product')
+    duplicates = Product.objects.values('prod_code').annotate(products=Count('id')).filter(products__gt=1) \
+        .order_by('prod_code')
+    if duplicates:
+        codes = ', '.join(f"{row['prod_code']!r} ({row['products']} products)" for row in duplicates[:20])
+        raise RuntimeError(
+            f"prod_code can't be made unique, {len(duplicates)} codes are used by several products: {codes}. "
+            f"Give those products distinct codes and run migrate again."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0013_product_is_deleted'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='prod_code',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+    ]
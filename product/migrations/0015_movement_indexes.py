@@ -0,0 +1,35 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0014_product_prod_code_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['id'], name='product_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinput',
+            index=models.Index(fields=['product', 'created_at'], name='productinput_product_created'),
+        ),
+        migrations.AddIndex(
+            model_name='productinput',
+            index=models.Index(fields=['created_at'], name='productinput_created'),
+        ),
+        migrations.AddIndex(
+            model_name='productoutput',
+            index=models.Index(fields=['product', 'created_at'], name='productoutput_product_created'),
+        ),
+        migrations.AddIndex(
+            model_name='productoutput',
+            index=models.Index(fields=['created_at'], name='productoutput_created'),
+        ),
+    ]
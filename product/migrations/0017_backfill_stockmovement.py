@@ -0,0 +1,51 @@
+from django.db import migrations
+
+
+def copy_to_ledger(apps, schema_editor):
+    """
+    Copy every input and output into the ledger in one statement, in the order they
+    happened so the ledger ids follow time (inputs first on equal timestamps).
+    """
+    quote = schema_editor.connection.ops.quote_name
+    ledger = quote(apps.get_model('product', 'StockMovement')._meta.db_table)
+    inputs = quote(apps.get_model('product', 'ProductInput')._meta.db_table)
+    outputs = quote(apps.get_model('product', 'ProductOutput')._meta.db_table)
+    schema_editor.execute(
+        f'INSERT INTO {ledger} (product_id, type, quantity, all_quantity, created_at, user_id_id) '
+        f'SELECT product_id, type, quantity, all_quantity, created_at, user_id_id FROM ('
+        f"SELECT id, product_id, 'input' AS type, input_quantity AS quantity, all_quantity, created_at, user_id_id "
+        f'FROM {inputs} '
+        f'UNION ALL '
+        f"SELECT id, product_id, 'output' AS type, -output_quantity AS quantity, all_quantity, created_at, user_id_id "
+        f'FROM {outputs}'
+        f') movements ORDER BY created_at, type, id'
+    )
+
+
+def copy_from_ledger(apps, schema_editor):
+    quote = schema_editor.connection.ops.quote_name
+    ledger = quote(apps.get_model('product', 'StockMovement')._meta.db_table)
+    inputs = quote(apps.get_model('product', 'ProductInput')._meta.db_table)
+    outputs = quote(apps.get_model('product', 'ProductOutput')._meta.db_table)
+    schema_editor.execute(
+        f'INSERT INTO {inputs} (product_id, input_quantity, all_quantity, created_at, user_id_id) '
+        f"SELECT product_id, quantity, all_quantity, created_at, user_id_id FROM {ledger} WHERE type = 'input' "
+        f'ORDER BY id'
+    )
+    schema_editor.execute(
+        f'INSERT INTO {outputs} (product_id, output_quantity, all_quantity, created_at, user_id_id) '
+        f"SELECT product_id, -quantity, all_quantity, created_at, user_id_id FROM {ledger} WHERE type = 'output' "
+        f'ORDER BY id'
+    )
+    schema_editor.execute(f'DELETE FROM {ledger}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0016_stockmovement'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_to_ledger, copy_from_ledger),
+    ]
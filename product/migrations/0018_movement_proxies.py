@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0017_backfill_stockmovement'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='ProductInput',
+        ),
+        migrations.DeleteModel(
+            name='ProductOutput',
+        ),
+        migrations.CreateModel(
+            name='ProductInput',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Kirim',
+                'verbose_name_plural': 'Kirimlar',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('product.stockmovement',),
+        ),
+        migrations.CreateModel(
+            name='ProductOutput',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Chiqim',
+                'verbose_name_plural': 'Chiqimlar',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('product.stockmovement',),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# SQLite: an FTS5 table of the searchable text of every product, indexed by trigrams
+# so that any part of a name or barcode is found, kept up to date by product/signals.py.
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE product_search USING fts5(name, prod_code, category, tokenize='trigram')",
+    "INSERT INTO product_search (rowid, name, prod_code, category) "
+    "SELECT p.id, p.name, p.prod_code, COALESCE(c.name, '') "
+    "FROM product_product p LEFT JOIN product_category c ON c.id = p.category_id",
+]
+SQLITE_DROP = ["DROP TABLE IF EXISTS product_search"]
+
+# PostgreSQL: trigram indexes on the columns themselves, which need no syncing.
+# UPPER() is what Django's icontains compares.
+POSTGRESQL_CREATE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX product_name_trgm ON product_product USING gin (UPPER(name) gin_trgm_ops)",
+    "CREATE INDEX product_code_trgm ON product_product USING gin (UPPER(prod_code) gin_trgm_ops)",
+    "CREATE INDEX category_name_trgm ON product_category USING gin (UPPER(name) gin_trgm_ops)",
+]
+POSTGRESQL_DROP = [
+    "DROP INDEX IF EXISTS product_name_trgm",
+    "DROP INDEX IF EXISTS product_code_trgm",
+    "DROP INDEX IF EXISTS category_name_trgm",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0018_movement_proxies'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+    ]
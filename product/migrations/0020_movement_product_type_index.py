@@ -0,0 +1,17 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0019_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product', 'type', 'created_at'], name='movement_product_type_created'),
+        ),
+    ]
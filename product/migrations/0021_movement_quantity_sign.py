@@ -0,0 +1,32 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:58
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def check_quantity_signs(apps, schema_editor):
+    """Stop before adding the constraint when movements contradict it, rather than failing halfway."""
+    StockMovement = apps.get_model('product', 'StockMovement')
+    wrong = StockMovement.objects.exclude(Q(type='input', quantity__gt=0) | Q(type='output', quantity__lt=0)) \
+        .order_by('pk').values_list('pk', flat=True)
+    if wrong:
+        ids = ', '.join(str(pk) for pk in wrong[:20])
+        raise RuntimeError(
+            f"{len(wrong)} stock movements have a quantity of the wrong sign for their type (ids {ids}). "
+            f"Correct or delete them and run migrate again."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0020_movement_product_type_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_quantity_signs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='stockmovement',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('quantity__gt', 0), ('type', 'input')), models.Q(('quantity__lt', 0), ('type', 'output')), _connector='OR'), name='movement_quantity_sign'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from users.models import User
 
 class Category(models.Model):
@@ -18,57 +19,113 @@ class Unit(models.Model):
         return self.name
 
 class Product(models.Model):
+    class Meta:
+        indexes = [
+            # Product list without the deleted ones
+            models.Index(fields=['id'], condition=models.Q(is_deleted=False), name='product_active_idx'),
+        ]
     name = models.CharField(max_length=100)
     description = models.TextField(null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, blank=True, null=True)
     price = models.DecimalField(max_digits=15, decimal_places=2)
     quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2, blank=True)
     unit = models.ForeignKey(Unit, on_delete=models.SET_NULL, null=True)
-    prod_code = models.CharField(max_length=20)
+    prod_code = models.CharField(max_length=20, unique=True)
     is_deleted = models.BooleanField(default=False)
-    
+
     def __str__(self):
         return self.name
 
-class ProductInput(models.Model):
+class StockMovement(models.Model):
+    """
+    Append-only stock ledger: every input (positive quantity) and output (negative
+    quantity) of a product, with the product balance right after it.
+    """
+    INPUT = 'input'
+    OUTPUT = 'output'
+    TYPES = ((INPUT, 'Kirim'), (OUTPUT, 'Chiqim'))
+
+    movement_type = None
+
     class Meta:
-        verbose_name = 'Kirim'
-        verbose_name_plural = 'Kirimlar'
+        verbose_name = 'Harakat'
+        verbose_name_plural = 'Harakatlar'
+        indexes = [
+            models.Index(fields=['product', 'created_at', 'id'], name='movement_product_created'),
+            models.Index(fields=['created_at', 'id'], name='movement_created'),
+            models.Index(fields=['type', 'created_at', 'id'], name='movement_type_created'),
+            # Whether a product has an input or an output in a range (report filter)
+            models.Index(fields=['product', 'type', 'created_at'], name='movement_product_type_created'),
+        ]
+        constraints = [
+            # The sign of the quantity is the direction of the movement
+            models.CheckConstraint(check=models.Q(type='input', quantity__gt=0) |
+                                   models.Q(type='output', quantity__lt=0), name='movement_quantity_sign'),
+        ]
 
-    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
-    input_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2)
-    all_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2) # chiqqandan keyingi qoldiq
-    created_at = models.DateTimeField(auto_now_add=True)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, related_name='movements')
+    type = models.CharField(max_length=6, choices=TYPES)
+    quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2)  # kirim +, chiqim -
+    all_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2)  # harakatdan keyingi qoldiq
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     user_id = models.ForeignKey(User,
                                 on_delete=models.SET_NULL,
                                 null=True,
-                                related_name='product_input')
+                                related_name='stock_movements')
 
     def save(self, *args, **kwargs):
+        if self.movement_type:
+            self.type = self.movement_type
         if self.pk is None:
-            self.all_quantity = self.product.quantity + self.input_quantity
-        super(ProductInput, self).save(*args, **kwargs)
-            
+            self.all_quantity = self.product.quantity + self.quantity
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.product.name if self.product else "default"
 
-class ProductOutput(models.Model):
+
+class MovementManager(models.Manager):
+    """Movements of one type, for the ProductInput/ProductOutput views of the ledger."""
+
+    def __init__(self, movement_type):
+        super().__init__()
+        self.movement_type = movement_type
+
+    def get_queryset(self):
+        return super().get_queryset().filter(type=self.movement_type)
+
+
+class ProductInput(StockMovement):
+    movement_type = StockMovement.INPUT
+    objects = MovementManager(StockMovement.INPUT)
+
+    class Meta:
+        proxy = True
+        verbose_name = 'Kirim'
+        verbose_name_plural = 'Kirimlar'
+
+    @property
+    def input_quantity(self):
+        return self.quantity
+
+    @input_quantity.setter
+    def input_quantity(self, value):
+        self.quantity = value
+
+
+class ProductOutput(StockMovement):
+    movement_type = StockMovement.OUTPUT
+    objects = MovementManager(StockMovement.OUTPUT)
+
     class Meta:
+        proxy = True
         verbose_name = 'Chiqim'
         verbose_name_plural = 'Chiqimlar'
-    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True,)
-    output_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2)
-    all_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2) # chiqqandan keyingi qoldiq
-    created_at = models.DateTimeField(auto_now_add=True)
-    user_id = models.ForeignKey(User,
-                                on_delete=models.SET_NULL,
-                                null=True,
-                                related_name='product_output')
-    def save(self, *args, **kwargs):
-        if self.pk is None:
-            self.all_quantity = self.product.quantity - self.output_quantity
-        super(ProductOutput, self).save(*args, **kwargs)
 
-    def __str__(self):
-        return self.product.name if self.product else "default"
+    @property
+    def output_quantity(self):
+        return -self.quantity
 
+    @output_quantity.setter
+    def output_quantity(self, value):
+        self.quantity = -value
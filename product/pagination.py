@@ -0,0 +1,157 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from drf_yasg import openapi
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opt-in keyset (cursor) pagination.
+    Pages continue from the ordering key of the last row seen, so each page costs
+    the same index range scan whatever its position and rows inserted meanwhile
+    never shift or repeat a page.
+    Lists are only paginated when `cursor` or `page_size` is in the query string, and only
+    in the ordering of the pagination: another order of the list is refused.
+    """
+    ordering = ('id',)
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+    invalid_ordering_message = "order_by can't be combined with cursor or page_size"
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_position(self, row):
+        position = [row[field] if isinstance(row, dict) else getattr(row, field) for field in self.ordering]
+        return [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+
+    def encode_cursor(self, row, reverse):
+        position = self.get_position(row)
+        cursor = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(cursor.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, model):
+        """(position, reverse) of the cursor, its values converted to those of the `model` ordering fields."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        invalid = ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = cursor['p'], bool(cursor['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise invalid
+        if not isinstance(position, list) or len(position) != len(self.ordering) or None in position:
+            raise invalid
+        try:
+            position = [model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, position)]
+        except (DjangoValidationError, ValueError, TypeError):
+            raise invalid
+        return position, reverse
+
+    def keyset_filter(self, position, reverse):
+        """Rows strictly after (or before, when reversed) `position` in the ordering."""
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            step = Q(**{f'{field}__{lookup}': position[i]})
+            for previous, value in zip(self.ordering[:i], position[:i]):
+                step &= Q(**{previous: value})
+            condition |= step
+        # Redundant with the above, but lets the database seek the index to the position
+        return Q(**{f'{self.ordering[0]}__{lookup}e': position[0]}) & condition
+
+    def page_queryset(self, queryset, position, reverse, limit):
+        """At most `limit` rows following `position`, in ordering (or reversed) order."""
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position, reverse))
+        if reverse:
+            queryset = queryset.order_by(*[f'-{field}' for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        return queryset[:limit]
+
+    def get_rows(self, queryset, position, reverse, limit):
+        return list(self.page_queryset(queryset, position, reverse, limit))
+
+    def check_ordering(self, queryset):
+        """Refuse a list ordered otherwise, its pages would silently come in the pagination's order."""
+        ordering = tuple(queryset.query.order_by)
+        if ordering and ordering != self.ordering:
+            raise ValidationError({'order_by': [self.invalid_ordering_message]})
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.check_ordering(queryset)
+        page_size, position, reverse = self.start_page(request, queryset.model)
+        rows = self.get_rows(queryset, position, reverse, page_size + 1)
+        return self.finish_page(rows, page_size, position, reverse)
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() for async views, reading the page with the async ORM."""
+        self.check_ordering(queryset)
+        page_size, position, reverse = self.start_page(request, queryset.model)
+        rows = [row async for row in self.page_queryset(queryset, position, reverse, page_size + 1)]
+        return self.finish_page(rows, page_size, position, reverse)
+
+    def start_page(self, request, model):
+        self.base_url = request.build_absolute_uri()
+        return (self.get_page_size(request), *self.decode_cursor(request, model))
+
+    def finish_page(self, rows, page_size, position, reverse):
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_link = self.encode_cursor(rows[-1], reverse=False) if rows and has_next else None
+        self.previous_link = self.encode_cursor(rows[0], reverse=True) if rows and has_previous else None
+        return rows
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.next_link,
+            'previous': self.previous_link,
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+
+class ProductPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class MovementPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
+
+
+pagination_parameters = [
+    openapi.Parameter('cursor', openapi.IN_QUERY, description="Cursor from the 'next'/'previous' links",
+                      type=openapi.TYPE_STRING),
+    openapi.Parameter('page_size', openapi.IN_QUERY,
+                      description="Paginate with this many rows per page, in the default order (not with order_by)",
+                      type=openapi.TYPE_INTEGER),
+]
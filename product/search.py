@@ -0,0 +1,159 @@
+from django.db import connection
+from django.db.models import Case, F, FloatField, Func, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+
+from .models import Product
+
+# The SQLite index (migration 0019): one row per product, rowid = product id.
+# Trigrams find any part of a name, barcode or category of at least 3 characters.
+SEARCH_TABLE = 'product_search'
+SEARCH_COLUMNS = ('name', 'prod_code', 'category')
+TRIGRAM = 3
+
+INDEX_SQL = (
+    f'INSERT INTO {SEARCH_TABLE} (rowid, name, prod_code, category) '
+    'SELECT p.id, p.name, p.prod_code, COALESCE(c.name, \'\') '
+    'FROM product_product p LEFT JOIN product_category c ON c.id = p.category_id '
+)
+
+
+def uses_index():
+    return connection.vendor == 'sqlite'
+
+
+#### INDEX ####
+def index_products(product_ids):
+    """Write the current name, code and category of the products to the search index."""
+    if not uses_index() or not product_ids:
+        return
+    product_ids = list(product_ids)
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+        cursor.execute(INDEX_SQL + f'WHERE p.id IN ({placeholders})', product_ids)
+
+
+def index_category(category_id):
+    """index_products() of every product of the category, e.g. after it was renamed."""
+    if not uses_index():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN '
+                       '(SELECT id FROM product_product WHERE category_id = %s)', [category_id])
+        cursor.execute(INDEX_SQL + 'WHERE p.category_id = %s', [category_id])
+
+
+def unindex_category(category_id):
+    """The products of a category about to be deleted lose their category."""
+    if not uses_index():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {SEARCH_TABLE} SET category = '' WHERE rowid IN "
+                       '(SELECT id FROM product_product WHERE category_id = %s)', [category_id])
+
+
+def unindex_products(product_ids):
+    if not uses_index() or not product_ids:
+        return
+    product_ids = list(product_ids)
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+
+
+#### SEARCH ####
+def _terms(query):
+    return (query or '').split()
+
+
+def _like(value, position='both'):
+    value = connection.ops.prep_for_like_query(value)
+    return f'{value}%' if position == 'prefix' else f'%{value}%'
+
+
+def _index_where(terms):
+    """
+    WHERE clause over the search table matching the products that contain every term.
+    Terms long enough for a trigram go to MATCH, shorter ones are compared with LIKE.
+    """
+    conditions, params = [], []
+    phrases = [term for term in terms if len(term) >= TRIGRAM]
+    if phrases:
+        conditions.append(f'{SEARCH_TABLE} MATCH %s')
+        params.append(' AND '.join('"%s"' % term.replace('"', '""') for term in phrases))
+    for term in terms:
+        if len(term) < TRIGRAM:
+            conditions.append('(%s)' % ' OR '.join(f"{SEARCH_TABLE}.{column} LIKE %s ESCAPE '\\'"
+                                                   for column in SEARCH_COLUMNS))
+            params += [_like(term)] * len(SEARCH_COLUMNS)
+    return ' AND '.join(conditions), params, bool(phrases)
+
+
+def search_filter(query):
+    """
+    Q of the products whose name, code or category contain every word of `query`,
+    case-insensitively. Served from the search index on SQLite and from the trigram
+    indexes of the columns on PostgreSQL.
+    """
+    terms = _terms(query)
+    if not terms:
+        return Q()
+    if uses_index():
+        where, params, _ = _index_where(terms)
+        return Q(pk__in=RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {where}', params))
+
+    condition = Q()
+    for term in terms:
+        condition &= (Q(prod_code__icontains=term) |
+                      Q(name__icontains=term) |
+                      Q(category__name__icontains=term))
+    return condition
+
+
+def ranked_products(query, limit=20):
+    """
+    Products that are not deleted matching `query` (see search_filter()), best first:
+    codes starting with the query, then names starting with it, then by relevance.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    query = ' '.join(terms)
+    if not uses_index():
+        return list(_ranked_queryset(query)[:limit])
+
+    where, params, matched = _index_where(terms)
+    relevance = f'bm25({SEARCH_TABLE}), ' if matched else ''
+    sql = (
+        f'SELECT {SEARCH_TABLE}.rowid FROM {SEARCH_TABLE} '
+        f'JOIN product_product p ON p.id = {SEARCH_TABLE}.rowid '
+        f'WHERE {where} AND NOT p.is_deleted '
+        f"ORDER BY CASE WHEN {SEARCH_TABLE}.prod_code LIKE %s ESCAPE '\\' THEN 0 "
+        f"WHEN {SEARCH_TABLE}.name LIKE %s ESCAPE '\\' THEN 1 ELSE 2 END, "
+        f'{relevance}{SEARCH_TABLE}.name, {SEARCH_TABLE}.rowid '
+        'LIMIT %s'
+    )
+    prefix = _like(query, 'prefix')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, prefix, prefix, limit])
+        product_ids = [row[0] for row in cursor.fetchall()]
+    products = Product.objects.in_bulk(product_ids)
+    return [products[pk] for pk in product_ids if pk in products]
+
+
+def _ranked_queryset(query):
+    products = Product.objects.filter(search_filter(query), is_deleted=False).annotate(
+        prefix=Case(When(prod_code__istartswith=query, then=0),
+                    When(name__istartswith=query, then=1),
+                    default=2, output_field=IntegerField()),
+    )
+    ordering = ['prefix']
+    if connection.vendor == 'postgresql':
+        # pg_trgm similarity, served by the same indexes as the filter
+        products = products.annotate(similarity=Greatest(
+            Func(F('name'), Value(query), function='SIMILARITY', output_field=FloatField()),
+            Func(F('prod_code'), Value(query), function='SIMILARITY', output_field=FloatField()),
+        ))
+        ordering.append('-similarity')
+    return products.order_by(*ordering, 'name', 'pk')
@@ -1,3 +1,6 @@
+from decimal import Decimal
+
+from django.utils import timezone
 from rest_framework import serializers
 from .models import *
 
@@ -44,10 +47,10 @@ class ProductDetailInputOutputSerializer(serializers.ModelSerializer):
         fields = ['name', 'prod_code', 'unit', 'category', 'price']
 
     def get_unit(self, obj):
-        return obj.unit.name
+        return obj.unit.name if obj.unit else None
 
     def get_category(self, obj):
-        return obj.category.name
+        return obj.category.name if obj.category else None
 
 
 class ProductReportSerializer(serializers.ModelSerializer):
@@ -59,16 +62,17 @@ class ProductReportSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'prod_code', 'unit', 'price', 'category']
 
     def get_unit(self, obj):
-        return obj.unit.name
+        return obj.unit.name if obj.unit else None
 
     def get_category(self, obj):
-        return obj.category.name
+        return obj.category.name if obj.category else None
 
 
 # INPUT
 
 
 class ProductInputSerializer(serializers.ModelSerializer):
+    input_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
     user_id = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
     class Meta:
@@ -86,20 +90,68 @@ class ProductInputSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class ProductInputLineSerializer(serializers.Serializer):
+    """One line of a bulk input; products are looked up for the whole batch at once."""
+    product = serializers.IntegerField()
+    input_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
+
+
+def not_in_future(value):
+    if value > timezone.now():
+        raise serializers.ValidationError("Sana kelajakda bo'lishi mumkin emas.")
+
+
+class MovementCorrectionSerializer(serializers.Serializer):
+    """Refuses a product: a posted movement stays on its product, it is deleted and posted again instead."""
+
+    def validate(self, attrs):
+        if 'product' in self.initial_data:
+            raise serializers.ValidationError({'product': ["Harakatning mahsulotini o'zgartirib bo'lmaydi."]})
+        return attrs
+
+
+class ProductInputBackdateSerializer(serializers.Serializer):
+    """An input posted at a past time."""
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+    input_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
+    created_at = serializers.DateTimeField(validators=[not_in_future])
+
+
+class ProductInputCorrectionSerializer(MovementCorrectionSerializer):
+    """With partial=True, the corrected quantity and/or time of a posted input."""
+    input_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
+    created_at = serializers.DateTimeField(validators=[not_in_future])
+
+
+MOVEMENT_RELATED = ['product', 'product__unit', 'product__category', 'user_id']
+MOVEMENT_PRODUCT_FIELDS = ['product__name', 'product__prod_code', 'product__price',
+                           'product__unit__name', 'product__category__name',
+                           'user_id__first_name', 'user_id__last_name']
+
+
 class ProductInputGetSerializer(serializers.ModelSerializer):
     product = ProductDetailInputOutputSerializer()
+    input_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
     user = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductInput
         fields = ['id', 'product', 'input_quantity', 'user', 'created_at']
 
+    @staticmethod
+    def setup_queryset(queryset):
+        """Join and load only what the serializer reads, so a list is a single query."""
+        return queryset.select_related(*MOVEMENT_RELATED).only(
+            'id', 'quantity', 'created_at', *MOVEMENT_RELATED, *MOVEMENT_PRODUCT_FIELDS)
+
     def get_product_name(self, obj):
         if obj.product:
             return obj.product.name
         return None
 
     def get_user(self, obj):
+        if obj.user_id is None:
+            return None
         return obj.user_id.first_name + ' ' + obj.user_id.last_name
         # return obj.user_id.username
 
@@ -108,6 +160,7 @@ class ProductInputGetSerializer(serializers.ModelSerializer):
 
 
 class ProductOutputSerializer(serializers.ModelSerializer):
+    output_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
     user_id = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
     class Meta:
@@ -125,23 +178,53 @@ class ProductOutputSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class ProductOutputLineSerializer(serializers.Serializer):
+    """One line of a bulk output; products are looked up for the whole batch at once."""
+    product = serializers.IntegerField()
+    output_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
+
+
+class ProductOutputBackdateSerializer(serializers.Serializer):
+    """An output posted at a past time."""
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+    output_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
+    created_at = serializers.DateTimeField(validators=[not_in_future])
+
+
+class ProductOutputCorrectionSerializer(MovementCorrectionSerializer):
+    """With partial=True, the corrected quantity and/or time of a posted output."""
+    output_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
+    created_at = serializers.DateTimeField(validators=[not_in_future])
+
+
 class ProductOutputGetSerializer(serializers.ModelSerializer):
     product = ProductDetailInputOutputSerializer()
+    output_quantity = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
     user = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductOutput
         fields = ['id', 'product', 'output_quantity', 'user', 'created_at']
 
+    @staticmethod
+    def setup_queryset(queryset):
+        """Join and load only what the serializer reads, so a list is a single query."""
+        return queryset.select_related(*MOVEMENT_RELATED).only(
+            'id', 'quantity', 'created_at', *MOVEMENT_RELATED, *MOVEMENT_PRODUCT_FIELDS)
+
     def get_user(self, obj):
+        if obj.user_id is None:
+            return None
         return obj.user_id.first_name + ' ' + obj.user_id.last_name
 
 
 class CombinedProductSerializer(serializers.Serializer):
+    """A row of the input/output history (see stats.history)."""
     id = serializers.IntegerField()
     type = serializers.CharField()
-    product = serializers.CharField(source='product.name', allow_null=True)
-    quantity = serializers.DecimalField(max_digits=8, decimal_places=2)
+    product_id = serializers.IntegerField(allow_null=True)
+    product = serializers.CharField(source='product_name', allow_null=True)
+    quantity = serializers.DecimalField(source='moved_quantity', max_digits=8, decimal_places=2)
     all_quantity = serializers.DecimalField(max_digits=8, decimal_places=2)
     created_at = serializers.DateTimeField()
-    user_id = serializers.PrimaryKeyRelatedField(read_only=True)
+    user_id = serializers.IntegerField(allow_null=True)
@@ -0,0 +1,228 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Round
+from django.utils.timezone import localdate
+
+from stats.snapshots import record_movement, shift_snapshots
+from stats.versions import bump_report_version
+from .cache import product_code_cache
+from .models import Product, ProductInput, ProductOutput, StockMovement
+
+QUANTITY_STEP = Decimal('0.01')
+
+
+class OutOfStockError(Exception):
+    """The product does not have enough quantity for the output."""
+
+    def __init__(self, product_ids=()):
+        super().__init__(product_ids)
+        self.product_ids = set(product_ids)
+
+
+def apply_stock_deltas(deltas, allow_negative=True):
+    """
+    Add each delta of `deltas` ({product_id: delta}) to the product quantity with a
+    single UPDATE ... RETURNING and return {product_id: new quantity} of the updated
+    products. Missing products and, unless `allow_negative`, products whose stock
+    would drop below zero are left out.
+    The check and the write happen in the same statement, so concurrent
+    movements of the same product can neither lose updates nor oversell.
+    """
+    table = connection.ops.quote_name(Product._meta.db_table)
+    change = 'CASE id %s END' % ' '.join(['WHEN %s THEN %s'] * len(deltas))
+    change_params = [value for item in deltas.items() for value in item]
+    ids = ', '.join(['%s'] * len(deltas))
+
+    # ROUND keeps SQLite's floating point arithmetic on exact cents
+    sql = f'UPDATE {table} SET quantity = ROUND(quantity + {change}, 2) WHERE id IN ({ids})'
+    params = change_params + list(deltas)
+    if not allow_negative:
+        sql += f' AND ROUND(quantity + {change}, 2) >= 0'
+        params += change_params
+    with connection.cursor() as cursor:
+        cursor.execute(sql + ' RETURNING id, quantity', params)
+        rows = cursor.fetchall()
+    return {product_id: Decimal(str(quantity)).quantize(QUANTITY_STEP) for product_id, quantity in rows}
+
+
+def _record_snapshots(movements, quantity_field):
+    """Add the movements to the snapshots, one update per product and day."""
+    days = {}
+    for movement in movements:
+        key = (movement.product_id, localdate(movement.created_at))
+        moved, _ = days.get(key, (0, None))
+        days[key] = (moved + abs(movement.quantity), movement)
+    for (product_id, _), (moved, last) in days.items():
+        record_movement(product_id, last.created_at, last.all_quantity, **{quantity_field: moved})
+
+
+def _post_movements(model, quantity_field, lines, user, sign):
+    """Post the (product_id, quantity) lines as `model` movements, `sign` giving their direction."""
+    if any(quantity <= 0 for _, quantity in lines):
+        # A negative input would be an output that skips the stock check
+        raise ValueError("Movement quantities must be positive")
+    deltas = {}
+    for product_id, quantity in lines:
+        deltas[product_id] = deltas.get(product_id, 0) + sign * quantity
+
+    quantities = apply_stock_deltas(deltas, allow_negative=sign > 0)
+    if len(quantities) < len(deltas):
+        if sign > 0:
+            raise Product.DoesNotExist
+        raise OutOfStockError(set(deltas) - set(quantities))
+
+    transaction.on_commit(lambda: product_code_cache.invalidate_products(deltas))
+
+    # Replay the lines from the balance before the batch to get each running balance
+    balances = {product_id: quantities[product_id] - delta for product_id, delta in deltas.items()}
+    movements = []
+    for product_id, quantity in lines:
+        balances[product_id] += sign * quantity
+        movements.append(model(product_id=product_id, type=model.movement_type, quantity=sign * quantity,
+                               all_quantity=balances[product_id], user_id=user))
+
+    # bulk_create skips Model.save(), which would derive all_quantity from a stale product row
+    movements = model.objects.bulk_create(movements, batch_size=500)
+    _record_snapshots(movements, quantity_field)
+    return movements
+
+
+@transaction.atomic
+def add_inputs(lines, user):
+    """
+    Receive every (product_id, input_quantity) of `lines` in one transaction and
+    return the saved ProductInputs in the same order.
+    """
+    return _post_movements(ProductInput, 'input_quantity', lines, user, 1)
+
+
+@transaction.atomic
+def add_outputs(lines, user):
+    """
+    Ship every (product_id, output_quantity) of `lines` in one transaction and
+    return the saved ProductOutputs in the same order.
+    Raises OutOfStockError, with the ids of the short products, when any stock is not enough;
+    nothing is saved in that case.
+    """
+    return _post_movements(ProductOutput, 'output_quantity', lines, user, -1)
+
+
+def add_input(product_id, input_quantity, user):
+    """Receive `input_quantity` of the product and return the saved ProductInput."""
+    return add_inputs([(product_id, input_quantity)], user)[0]
+
+
+def add_output(product_id, output_quantity, user):
+    """
+    Ship `output_quantity` of the product and return the saved ProductOutput.
+    Raises OutOfStockError when the stock is not enough.
+    """
+    return add_outputs([(product_id, output_quantity)], user)[0]
+
+
+#### CORRECTIONS ####
+def _after(moved_at, pk):
+    """Movements following the position (moved_at, pk) in ledger order."""
+    return Q(created_at__gt=moved_at) | Q(created_at=moved_at, pk__gt=pk)
+
+
+def _carry(movement, sign):
+    """
+    Add (`sign` 1) or take back (-1) the quantity of the movement on the balances of the
+    product's later movements, with a single UPDATE, and on the snapshots.
+    """
+    delta = sign * movement.quantity
+    StockMovement.objects.filter(_after(movement.created_at, movement.pk), product_id=movement.product_id) \
+        .update(all_quantity=Round(F('all_quantity') + delta, 2))
+    moved = 'input_quantity' if movement.quantity > 0 else 'output_quantity'
+    shift_snapshots(movement.product_id, movement.created_at, movement.all_quantity,
+                    **{moved: sign * abs(movement.quantity)})
+
+
+def _place(movement):
+    """Set the balance of the movement from the one of the movement before it."""
+    before = StockMovement.objects.filter(product_id=movement.product_id) \
+        .exclude(_after(movement.created_at, movement.pk)).exclude(pk=movement.pk) \
+        .order_by('-created_at', '-pk').values_list('all_quantity', flat=True).first()
+    movement.all_quantity = (before or 0) + movement.quantity
+    StockMovement.objects.filter(pk=movement.pk).update(all_quantity=movement.all_quantity)
+
+
+def _check_stock(product_id, moved_at, pk):
+    """Raise OutOfStockError if any balance from the position (moved_at, pk) on is negative."""
+    since = _after(moved_at, pk) | Q(pk=pk)
+    if StockMovement.objects.filter(since, product_id=product_id, all_quantity__lt=0).exists():
+        raise OutOfStockError([product_id])
+
+
+def _change_quantity(product_id, delta):
+    """
+    Apply `delta` to the product quantity. The updated row also keeps other movements
+    of the product waiting until the transaction ends.
+    """
+    if product_id is None or not apply_stock_deltas({product_id: delta}):
+        raise Product.DoesNotExist
+    transaction.on_commit(lambda: product_code_cache.invalidate_products([product_id]))
+
+
+def _lock_movement(movement):
+    """Lock the product of the movement and reload it, another request may have changed it meanwhile."""
+    _change_quantity(movement.product_id, 0)
+    movement.refresh_from_db()
+
+
+@transaction.atomic
+def backdate_movement(model, product_id, quantity, moved_at, user):
+    """
+    Post a `model` movement of `quantity` at `moved_at`, before movements already posted,
+    and return it. Raises OutOfStockError when any later balance would become negative.
+    """
+    sign = 1 if model.movement_type == StockMovement.INPUT else -1
+    _change_quantity(product_id, sign * quantity)
+    # bulk_create skips Model.save(), which would derive all_quantity from the current product quantity
+    movement, = model.objects.bulk_create([model(product_id=product_id, type=model.movement_type,
+                                                 quantity=sign * quantity, created_at=moved_at, user_id=user)])
+    _place(movement)
+    _carry(movement, 1)
+    if sign < 0:
+        _check_stock(product_id, movement.created_at, movement.pk)
+    return movement
+
+
+@transaction.atomic
+def correct_movement(movement, quantity=None, moved_at=None):
+    """
+    Change the quantity and/or the time of a posted movement and return it, repairing only
+    the balances after its old and new positions.
+    Raises OutOfStockError when any balance would become negative.
+    """
+    _lock_movement(movement)
+    sign = 1 if movement.quantity > 0 else -1
+    new_quantity = sign * quantity if quantity is not None else movement.quantity
+    _change_quantity(movement.product_id, new_quantity - movement.quantity)
+
+    old_position = (movement.created_at, movement.pk)
+    _carry(movement, -1)
+    movement.quantity = new_quantity
+    movement.created_at = moved_at or movement.created_at
+    StockMovement.objects.filter(pk=movement.pk).update(quantity=movement.quantity, created_at=movement.created_at)
+    _place(movement)
+    _carry(movement, 1)
+
+    _check_stock(movement.product_id, *min(old_position, (movement.created_at, movement.pk)))
+    bump_report_version()
+    return movement
+
+
+@transaction.atomic
+def delete_movement(movement):
+    """Delete a posted movement, repairing the balances after it."""
+    _lock_movement(movement)
+    _change_quantity(movement.product_id, -movement.quantity)
+    _carry(movement, -1)
+    position = (movement.created_at, movement.pk)
+    movement.delete()
+    if movement.quantity > 0:
+        _check_stock(movement.product_id, *position)
@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+from .autocomplete import product_prefix_index
+from .cache import product_code_cache
+from .models import Category, Product, Unit
+from .search import index_category, index_products, unindex_category, unindex_products
+
+
+# Kept in the same transaction as the change, so a rolled back save leaves the index as it was
+def index_product(sender, instance, **kwargs):
+    index_products([instance.pk])
+
+
+def unindex_product(sender, instance, **kwargs):
+    unindex_products([instance.pk])
+
+
+# The in-process autocomplete index only learns about committed changes
+def update_autocomplete(sender, instance, **kwargs):
+    product = (instance.pk, instance.name, instance.prod_code, instance.is_deleted)
+    transaction.on_commit(lambda: product_prefix_index.update(*product))
+
+
+def remove_autocomplete(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: product_prefix_index.remove(product_id))
+
+
+# Every change of a product, from the API or the admin, drops its cached barcode lookups
+def invalidate_product_code(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: product_code_cache.invalidate_products([product_id]))
+
+
+# Deleting a category or unit sets the products' foreign key to NULL without saving them
+def clear_product_codes(sender, instance, **kwargs):
+    transaction.on_commit(product_code_cache.clear)
+
+
+def reindex_category(sender, instance, created=False, **kwargs):
+    if not created:
+        index_category(instance.pk)
+
+
+def clear_category(sender, instance, **kwargs):
+    unindex_category(instance.pk)
+
+
+def connect():
+    post_save.connect(index_product, sender=Product, dispatch_uid='search-save-product')
+    post_delete.connect(unindex_product, sender=Product, dispatch_uid='search-delete-product')
+    post_save.connect(update_autocomplete, sender=Product, dispatch_uid='autocomplete-save-product')
+    post_delete.connect(remove_autocomplete, sender=Product, dispatch_uid='autocomplete-delete-product')
+    post_save.connect(invalidate_product_code, sender=Product, dispatch_uid='code-cache-save-product')
+    post_delete.connect(invalidate_product_code, sender=Product, dispatch_uid='code-cache-delete-product')
+    post_delete.connect(clear_product_codes, sender=Category, dispatch_uid='code-cache-delete-category')
+    post_delete.connect(clear_product_codes, sender=Unit, dispatch_uid='code-cache-delete-unit')
+    post_save.connect(reindex_category, sender=Category, dispatch_uid='search-save-category')
+    pre_delete.connect(clear_category, sender=Category, dispatch_uid='search-delete-category')
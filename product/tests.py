@@ -1,3 +1,389 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import IntegrityError, transaction
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from stats.models import DailyStock
+from users.models import User
+from .autocomplete import product_prefix_index
+from .cache import ProductCodeCache, product_code_cache
+from .models import Category, Product, ProductInput, ProductOutput, StockMovement, Unit
+from .services import OutOfStockError, add_input, add_inputs, add_output, add_outputs, apply_stock_deltas
+
+
+class StockServiceTests(TestCase):
+    """Movements change the product quantity in one statement and chain the running balances."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        cls.product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+        cls.other = Product.objects.create(name='Boshqa', price=1000, prod_code='4780000000002')
+
+    def test_balances_chain(self):
+        add_input(self.product.pk, 10, self.user)
+        add_output(self.product.pk, Decimal('2.5'), self.user)
+        add_inputs([(self.product.pk, 4), (self.other.pk, 1), (self.product.pk, 1)], self.user)
+        add_outputs([(self.product.pk, Decimal('12.5'))], self.user)
+        balances = StockMovement.objects.filter(product=self.product).order_by('pk') \
+            .values_list('quantity', 'all_quantity')
+        self.assertEqual(list(balances), [(10, 10), (Decimal('-2.5'), Decimal('7.5')), (4, Decimal('11.5')),
+                                          (1, Decimal('12.5')), (Decimal('-12.5'), 0)])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 0)
+
+    def test_out_of_stock(self):
+        add_input(self.product.pk, 3, self.user)
+        add_input(self.other.pk, 3, self.user)
+        with self.assertRaises(OutOfStockError) as error:
+            add_outputs([(self.other.pk, 1), (self.product.pk, 2), (self.product.pk, 2)], self.user)
+        self.assertEqual(error.exception.product_ids, {self.product.pk})
+        # Nothing of the refused batch was saved
+        self.assertEqual(StockMovement.objects.count(), 2)
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('quantity', flat=True)), [3, 3])
+        self.assertEqual(apply_stock_deltas({self.product.pk: -4}, allow_negative=False), {})
+
+    def test_missing_product(self):
+        with self.assertRaises(Product.DoesNotExist):
+            add_input(self.other.pk + 100, 3, self.user)
+        with self.assertRaises(OutOfStockError):
+            add_output(self.other.pk + 100, 3, self.user)
+        self.assertEqual(apply_stock_deltas({self.product.pk: 2, self.other.pk + 100: 2}),
+                         {self.product.pk: 2})
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_non_positive_quantity(self):
+        add_input(self.product.pk, 3, self.user)
+        for quantity in (0, -5):
+            with self.assertRaises(ValueError):
+                add_input(self.product.pk, quantity, self.user)
+            with self.assertRaises(ValueError):
+                add_outputs([(self.other.pk, quantity)], self.user)
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('quantity', flat=True)), [3, 0])
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+    def test_quantity_sign_constraint(self):
+        for movement_type, quantity in ((StockMovement.INPUT, -1), (StockMovement.OUTPUT, 1), (StockMovement.INPUT, 0)):
+            with self.subTest(movement_type, quantity=quantity), self.assertRaises(IntegrityError), \
+                    transaction.atomic():
+                StockMovement.objects.create(product=self.product, type=movement_type, quantity=quantity)
+
+    def test_admin_is_read_only(self):
+        movement = add_input(self.product.pk, 3, self.user)
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        change_url = reverse('admin:product_stockmovement_change', args=[movement.pk])
+        self.assertEqual(self.client.get(reverse('admin:product_stockmovement_add')).status_code, 403)
+        self.assertEqual(self.client.post(change_url, {'quantity': '-3'}).status_code, 403)
+        self.assertEqual(self.client.post(reverse('admin:product_stockmovement_delete', args=[movement.pk]),
+                                          {'post': 'yes'}).status_code, 403)
+        self.assertEqual(StockMovement.objects.get().quantity, 3)
+
+
+class ProductCodeCacheTests(APITestCase):
+    """Barcode lookups are cached until the product changes or loses its category or unit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        cls.unit = Unit.objects.create(name='dona')
+        cls.product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001', unit=cls.unit)
+
+    def setUp(self):
+        product_code_cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def lookup(self):
+        return self.client.get('/products/', {'prod_code': '4780000000001'}).data
+
+    def test_changes_invalidate(self):
+        self.assertEqual(self.lookup()['name'], 'Mahsulot')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).get().save()
+        self.assertIsNone(product_code_cache.get('4780000000001'))
+
+        # Like an edit in the admin, without the API views
+        self.lookup()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Yangi nom'
+            self.product.save()
+        self.assertEqual(self.lookup()['name'], 'Yangi nom')
+        self.assertEqual(self.lookup()['unit'], self.unit.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.unit.delete()
+        self.assertIsNone(self.lookup()['unit'])
+
+    def test_reverse_map_follows_entries(self):
+        cache = ProductCodeCache(maxsize=2, timeout=None)
+        for product_id in range(5):
+            cache.set(f'code-{product_id}', {'id': product_id})
+        self.assertEqual(sorted(cache._codes), [3, 4])
+        cache.set('code-4', {'id': 5})
+        cache.delete('code-3')
+        self.assertEqual(cache._codes, {5: {'code-4'}})
+        cache.set('other-code-5', {'id': 5})
+        cache.invalidate_products([5])
+        self.assertEqual((len(cache), cache._codes), (0, {}))
+
+
+class BulkMovementTests(APITestCase):
+    """A bulk input or output saves every line or, with any wrong line, none of them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        cls.product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+        cls.other = Product.objects.create(name='Boshqa', price=1000, prod_code='4780000000002')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def post(self, url_name, lines):
+        return self.client.post(reverse(url_name), lines, format='json')
+
+    def quantities(self):
+        return list(Product.objects.order_by('pk').values_list('quantity', flat=True))
+
+    def test_bulk_movements(self):
+        response = self.post('input-bulk-create', [{'product': self.product.pk, 'input_quantity': '5'},
+                                                   {'product': self.other.pk, 'input_quantity': '2'},
+                                                   {'product': self.product.pk, 'input_quantity': '1.5'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([line['input_quantity'] for line in response.data], ['5.00', '2.00', '1.50'])
+        response = self.post('output-bulk-create', [{'product': self.product.pk, 'output_quantity': '6'},
+                                                    {'product': self.other.pk, 'output_quantity': '2'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.quantities(), [Decimal('0.5'), 0])
+        self.assertEqual(DailyStock.objects.get(product=self.product).closing_quantity, Decimal('0.5'))
+
+    def test_line_errors_save_nothing(self):
+        add_input(self.product.pk, 3, self.user)
+        add_input(self.other.pk, 1, self.user)
+        response = self.post('input-bulk-create', [{'product': self.product.pk, 'input_quantity': '5'},
+                                                   {'product': self.other.pk, 'input_quantity': '-50'},
+                                                   {'product': self.other.pk, 'input_quantity': '0'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('input_quantity', response.data[1])
+        self.assertIn('input_quantity', response.data[2])
+
+        response = self.post('input-bulk-create', [{'product': self.product.pk, 'input_quantity': '5'},
+                                                   {'product': self.other.pk + 100, 'input_quantity': '1'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, [{}, {'product': ["Mahsulot topilmadi."]}])
+
+        response = self.post('output-bulk-create', [{'product': self.product.pk, 'output_quantity': '-5'}])
+        self.assertEqual(response.status_code, 400)
+        response = self.post('output-bulk-create', [{'product': self.other.pk, 'output_quantity': '1'},
+                                                    {'product': self.product.pk, 'output_quantity': '2'},
+                                                    {'product': self.product.pk, 'output_quantity': '2'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, [{}, {"Xabar": "Noto'g'ri miqdor!"}, {"Xabar": "Noto'g'ri miqdor!"}])
+
+        self.assertEqual(self.quantities(), [3, 1])
+        self.assertEqual(StockMovement.objects.count(), 2)
+        self.assertEqual(DailyStock.objects.get(product=self.product).input_quantity, 3)
+
+    def test_line_limit(self):
+        lines = [{'product': self.product.pk, 'input_quantity': '1'}] * 3
+        with mock.patch('product.views.BULK_MAX_LINES', 2):
+            self.assertEqual(self.post('input-bulk-create', lines).status_code, 400)
+            self.assertEqual(self.post('input-bulk-create', lines[:2]).status_code, 201)
+        self.assertEqual(self.post('input-bulk-create', []).status_code, 400)
+        self.assertEqual(self.quantities(), [2, 0])
+
+
+class SingleMovementTests(APITestCase):
+    """A single input or output needs a positive quantity."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        cls.product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        add_input(self.product.pk, 3, self.user)
+
+    def test_non_positive_quantity(self):
+        for quantity in ('0', '-50'):
+            response = self.client.post('/input/', {'product': self.product.pk, 'input_quantity': quantity})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('input_quantity', response.data)
+            response = self.client.post('/output/', {'product': self.product.pk, 'output_quantity': quantity})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('output_quantity', response.data)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 3)
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+        response = self.client.post('/output/', {'product': self.product.pk, 'output_quantity': '1'})
+        self.assertEqual(response.status_code, 201)
+
+
+class MovementCorrectionTests(APITestCase):
+    """Backdated, corrected and deleted movements repair the later balances and snapshots."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        cls.product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        self.input = add_input(self.product.pk, 10, self.user)
+        self.output = add_output(self.product.pk, 4, self.user)
+
+    def assert_balances(self, expected):
+        balances = StockMovement.objects.order_by('created_at', 'pk').values_list('all_quantity', flat=True)
+        self.assertEqual(list(balances), expected)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, expected[-1] if expected else 0)
+
+    def test_backdated_input(self):
+        created_at = timezone.now() - timedelta(days=3)
+        response = self.client.post(reverse('input-backdate'), {
+            'product': self.product.pk, 'input_quantity': '5', 'created_at': created_at.isoformat()})
+        self.assertEqual(response.status_code, 201)
+        self.assert_balances([5, 15, 11])
+        snapshots = DailyStock.objects.order_by('date').values_list('opening_quantity', 'closing_quantity')
+        self.assertEqual(list(snapshots), [(0, 5), (5, 11)])
+
+    def test_backdated_output_can_not_oversell(self):
+        created_at = timezone.now() - timedelta(days=3)
+        response = self.client.post(reverse('output-backdate'), {
+            'product': self.product.pk, 'output_quantity': '1', 'created_at': created_at.isoformat()})
+        self.assertEqual(response.status_code, 400)
+        self.assert_balances([10, 6])
+
+    def test_corrected_quantity_and_time(self):
+        response = self.client.patch(reverse('input-correct-delete', args=[self.input.pk]), {'input_quantity': '7'})
+        self.assertEqual(response.status_code, 200)
+        self.assert_balances([7, 3])
+
+        # Moving the input after the output would oversell
+        response = self.client.patch(reverse('input-correct-delete', args=[self.input.pk]),
+                                     {'created_at': timezone.now().isoformat()})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ProductInput.objects.get().created_at, self.input.created_at)
+        self.assert_balances([7, 3])
+
+    def test_product_can_not_change(self):
+        other = Product.objects.create(name='Boshqa', price=1000, prod_code='4780000000002')
+        response = self.client.patch(reverse('output-correct-delete', args=[self.output.pk]),
+                                     {'product': other.pk, 'output_quantity': '3'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product', response.data)
+        self.assertEqual(ProductOutput.objects.get().product, self.product)
+        self.assert_balances([10, 6])
+
+    def test_deleted_output(self):
+        response = self.client.delete(reverse('output-correct-delete', args=[self.output.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assert_balances([10])
+        self.assertEqual(DailyStock.objects.get().output_quantity, 0)
+
+        response = self.client.delete(reverse('input-correct-delete', args=[self.input.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assert_balances([])
+        self.assertFalse(DailyStock.objects.exists())
+
+
+class ProductSearchTests(APITestCase):
+    """The search index follows the products and categories, prefix matches come first."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        cls.category = Category.objects.create(name='Mevalar')
+        for code, name in (('4780000000001', 'Qizil olma'), ('4780000000002', 'Olma sharbati'),
+                           ('4780000000003', 'Сут 1л')):
+            Product.objects.create(name=name, price=1000, prod_code=code, category=cls.category)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('products-search'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data]
+
+    def test_ranking_and_limit(self):
+        self.assertEqual(self.search('olma'), ['Olma sharbati', 'Qizil olma'])
+        self.assertEqual(self.search('OLMA qiz'), ['Qizil olma'])
+        self.assertEqual(self.search('сут'), ['Сут 1л'])
+        self.assertEqual(self.search('1л'), ['Сут 1л'])
+        self.assertEqual(self.search('4780000000003'), ['Сут 1л'])
+        self.assertEqual(len(self.search('meva', limit=2)), 2)
+        self.assertEqual(self.search(''), [])
+
+    def test_index_follows_changes(self):
+        product = Product.objects.get(name='Qizil olma')
+        product.name = 'Nok'
+        product.save()
+        self.assertEqual(self.search('olma'), ['Olma sharbati'])
+        product.is_deleted = True
+        product.save()
+        self.assertEqual(self.search('nok'), [])
+
+        self.category.name = 'Ichimliklar'
+        self.category.save()
+        self.assertCountEqual(self.search('ichimlik'), ['Olma sharbati', 'Сут 1л'])
+        self.category.delete()
+        self.assertEqual(self.search('ichimlik'), [])
+
+
+class ProductAutocompleteTests(APITestCase):
+    """Autocomplete is answered from the prefix index, which follows committed product changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', position=1)
+        cls.apple = Product.objects.create(name='Qizil olma', price=1000, prod_code='4780000000001')
+        Product.objects.create(name='Olma sharbati', price=1000, prod_code='4780000000002')
+
+    def setUp(self):
+        product_prefix_index.clear()
+        self.client.force_authenticate(self.user)
+
+    def complete(self, q, **params):
+        response = self.client.get(reverse('products-autocomplete'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data]
+
+    def test_prefixes(self):
+        self.assertEqual(self.complete('OL'), ['Olma sharbati', 'Qizil olma'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.complete('qizil  o'), ['Qizil olma'])
+            self.assertEqual(self.complete('4780000000001'), ['Qizil olma'])
+            self.assertEqual(self.complete('47', limit=1), ['Qizil olma'])
+            self.assertEqual(self.complete('nok'), [])
+
+    def test_follows_changes(self):
+        self.complete('ol')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.name = 'Nok'
+            self.apple.save()
+        self.assertEqual(self.complete('ol'), ['Olma sharbati'])
+        self.assertEqual(self.complete('nok'), ['Nok'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.is_deleted = True
+            self.apple.save()
+        self.assertEqual(self.complete('nok'), [])
+
+    def test_changes_during_reload(self):
+        build = product_prefix_index._build
+
+        def build_while_renamed():
+            built = build()
+            # Saved while the index was being built from the database, without holding its lock
+            product_prefix_index.update(self.apple.pk, 'Nok', self.apple.prod_code)
+            return built
 
-# Create your tests here.
+        with mock.patch.object(product_prefix_index, '_build', build_while_renamed):
+            self.assertEqual(self.complete('ol'), ['Olma sharbati'])
+        self.assertEqual(self.complete('nok'), ['Nok'])
@@ -12,12 +12,20 @@ urlpatterns = [
     path('units/<int:u>/', UnitAPIView.as_view(), name='unit-detail-put-patch-delete'),
     # products
     path('products/', ProductsAPIView.as_view(), name='products-list-create'),
+    path('products/search/', ProductSearchAPIView.as_view(), name='products-search'),
+    path('products/autocomplete/', ProductAutocompleteAPIView.as_view(), name='products-autocomplete'),
     path('product/<int:p>', ProductAPIView.as_view(), name='product-detail-put-patch-delete'),
     # path('product-code/<str:prod_code>', ProductByCode.as_view()),
     # Input
     path('input/', ProductInputsAPIView.as_view(), name='products-list-create'),
+    path('input/bulk/', ProductInputsBulkAPIView.as_view(), name='input-bulk-create'),
+    path('input/backdate/', ProductInputBackdateAPIView.as_view(), name='input-backdate'),
+    path('input/<int:pk>/', ProductInputCorrectionAPIView.as_view(), name='input-correct-delete'),
     # path('input/<int:pk>/', ProductInputDetail.as_view(), name='input-detail'), # returns one input by ID
     # Output
     path('output/', ProductOutputAPIView.as_view(), name='products-list-create'),
+    path('output/bulk/', ProductOutputsBulkAPIView.as_view(), name='output-bulk-create'),
+    path('output/backdate/', ProductOutputBackdateAPIView.as_view(), name='output-backdate'),
+    path('output/<int:pk>/', ProductOutputCorrectionAPIView.as_view(), name='output-correct-delete'),
     # path('output/<int:pk>/', ProductOutputtDetail.as_view(), name='output-detail'), # returns one output by ID | Updates
 ]
\ No newline at end of file
@@ -17,7 +17,16 @@ import random
 from .serializers import (CategorySerializer, UnitSerializer,
                           ProductSerializer, ProductOutputSerializer,
                           ProductInputSerializer, ProductInputGetSerializer,
-                          ProductOutputGetSerializer, ProductCreateSerializer)
+                          ProductOutputGetSerializer, ProductCreateSerializer,
+                          ProductInputLineSerializer, ProductOutputLineSerializer,
+                          ProductInputBackdateSerializer, ProductOutputBackdateSerializer,
+                          ProductInputCorrectionSerializer, ProductOutputCorrectionSerializer)
+from .autocomplete import product_prefix_index
+from .cache import product_code_cache
+from .pagination import ProductPagination, pagination_parameters
+from .search import ranked_products
+from .services import (OutOfStockError, add_input, add_inputs, add_output, add_outputs, backdate_movement,
+                       correct_movement, delete_movement)
 
 
 #### CATEGORY ####
@@ -158,6 +167,7 @@ class ProductsAPIView(APIView):
             openapi.Parameter('is_deleted', openapi.IN_QUERY, description="O'chirilgan mahsulotlarni ham qabul qilish",
                               type=openapi.TYPE_BOOLEAN),
             # openapi.Parameter('prod_id', openapi.IN_QUERY, description="Product ID", type=openapi.TYPE_INTEGER)
+            *pagination_parameters,
         ]
     )
     def get(self, request):
@@ -165,15 +175,24 @@ class ProductsAPIView(APIView):
         is_deleted = request.query_params.get('is_deleted')
 
         if prod_code:
-            product = get_object_or_404(Product, prod_code=prod_code)
-            serializer = ProductSerializer(product)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            data = product_code_cache.get(prod_code)
+            if data is None:
+                product = get_object_or_404(Product, prod_code=prod_code)
+                data = dict(ProductSerializer(product).data)
+                product_code_cache.set(prod_code, data)
+            return Response(data, status=status.HTTP_200_OK)
 
         if is_deleted:
             products = Product.objects.all()
         else:
             products = Product.objects.filter(is_deleted=False)
 
+        paginator = ProductPagination()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(products, request, view=self)
+            serializer = ProductSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
         serializer = ProductSerializer(products, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -188,11 +207,14 @@ class ProductsAPIView(APIView):
             return Response(serializer.data)
         return Response(serializer.errors)
 
-    def generate_unique_ean13_barcode_number(self, max_attempts=100):
-        for _ in range(max_attempts):
-            barcode_number = self.generate_ean13_barcode_number()
-            if not Product.objects.filter(prod_code=barcode_number).exists():
-                return str(barcode_number)
+    def generate_unique_ean13_barcode_number(self, max_attempts=100, batch_size=10):
+        # Candidates are checked a batch at a time against the unique prod_code index
+        for _ in range(0, max_attempts, batch_size):
+            candidates = {self.generate_ean13_barcode_number() for _ in range(batch_size)}
+            taken = set(Product.objects.filter(prod_code__in=candidates).values_list('prod_code', flat=True))
+            free = candidates - taken
+            if free:
+                return str(free.pop())
         raise Exception("Failed to generate a unique EAN-13 barcode number after max attempts")
 
     def generate_ean13_barcode_number(self):
@@ -255,7 +277,68 @@ class ProductAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def query_limit(request, default, maximum):
+    """The `limit` query parameter, `default` when missing or not a number, clamped to 1..`maximum`."""
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except ValueError:
+        limit = default
+    return min(max(limit, 1), maximum)
+
+
+class ProductSearchAPIView(APIView):
+    """
+    Products whose name, code or category contain every word of `q`, best matches first:
+    codes starting with `q`, then names starting with it. Deleted products are left out.
+    """
+    permission_classes = [IsStaffUser]
+    default_limit = 20
+    max_limit = 100
+
+    @swagger_auto_schema(
+        tags=['Products'],
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description="Qidiruv so'zi", type=openapi.TYPE_STRING,
+                              required=True),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Natijalar soni (ko'pi bilan 100)",
+                              type=openapi.TYPE_INTEGER),
+        ]
+    )
+    def get(self, request):
+        limit = query_limit(request, self.default_limit, self.max_limit)
+        products = ranked_products(request.query_params.get('q', ''), limit)
+        serializer = ProductSerializer(products, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ProductAutocompleteAPIView(APIView):
+    """
+    Products (id, name and prod_code) whose name, a word of the name or code starts with `q`,
+    answered from the in-process prefix index without a database query.
+    """
+    permission_classes = [IsStaffUser]
+    default_limit = 10
+    max_limit = 50
+
+    @swagger_auto_schema(
+        tags=['Products'],
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description="Nom yoki shtrix-kod boshi", type=openapi.TYPE_STRING,
+                              required=True),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Natijalar soni (ko'pi bilan 50)",
+                              type=openapi.TYPE_INTEGER),
+        ]
+    )
+    def get(self, request):
+        limit = query_limit(request, self.default_limit, self.max_limit)
+        products = product_prefix_index.search(request.query_params.get('q', ''), limit)
+        return Response(products, status=status.HTTP_200_OK)
+
+
 #### INPUT OUTPUT ####
+BULK_MAX_LINES = 1000
+
+
 class ProductInputsAPIView(APIView):
     """
     List all product inputs or create a new one.
@@ -268,15 +351,8 @@ class ProductInputsAPIView(APIView):
         if serializer.is_valid():
             product_id = serializer.validated_data['product'].id
             input_quantity = serializer.validated_data['input_quantity']
-            user_id = request.user.id
-            if input_quantity:
-                product_input = serializer.save(user_id=user_id)
-                product = Product.objects.get(pk=product_id)
-                product.quantity += input_quantity
-
-                product.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            return Response({"Xabar": "Noto'g'ri miqdor!"}, status=status.HTTP_400_BAD_REQUEST)
+            product_input = add_input(product_id, input_quantity, request.user)
+            return Response(ProductInputSerializer(product_input).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -292,14 +368,186 @@ class ProductOutputAPIView(APIView):
         if serializer.is_valid():
             product_id = serializer.validated_data['product'].id
             output_quantity = serializer.validated_data['output_quantity']
-            user_id = request.user.id
-
-            # Create the ProductInput instance
-            if output_quantity <= Product.objects.get(pk=product_id).quantity:
-                product_output = serializer.save(user_id=user_id)
-                product = Product.objects.get(pk=product_id)
-                product.quantity -= output_quantity
-                product.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            return Response({"Xabar": "Noto'g'ri miqdor!"}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                product_output = add_output(product_id, output_quantity, request.user)
+            except OutOfStockError:
+                return Response({"Xabar": "Noto'g'ri miqdor!"}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(ProductOutputSerializer(product_output).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def bulk_line_errors(lines):
+    """
+    Per-line errors of a bulk movement, empty dicts for valid lines.
+    Every product of the batch is checked with a single query.
+    """
+    product_ids = {product_id for product_id, _ in lines}
+    existing = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+    return [{} if product_id in existing else {'product': ["Mahsulot topilmadi."]} for product_id, _ in lines]
+
+
+class ProductInputsBulkAPIView(APIView):
+    """
+    Create many product inputs at once, e.g. a whole delivery.
+    Either every line is saved or none of them is.
+    """
+    permission_classes = [IsStaffUser]
+
+    @swagger_auto_schema(tags=['Product-Input-Output'], request_body=ProductInputLineSerializer(many=True))
+    def post(self, request):
+        serializer = ProductInputLineSerializer(data=request.data, many=True, allow_empty=False,
+                                                max_length=BULK_MAX_LINES)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = [(line['product'], line['input_quantity']) for line in serializer.validated_data]
+        errors = bulk_line_errors(lines)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        product_inputs = add_inputs(lines, request.user)
+        return Response(ProductInputSerializer(product_inputs, many=True).data, status=status.HTTP_201_CREATED)
+
+
+class ProductOutputsBulkAPIView(APIView):
+    """
+    Create many product outputs at once.
+    Either every line is saved or none of them is.
+    """
+    permission_classes = [IsStaffUser]
+
+    @swagger_auto_schema(tags=['Product-Input-Output'], request_body=ProductOutputLineSerializer(many=True))
+    def post(self, request):
+        serializer = ProductOutputLineSerializer(data=request.data, many=True, allow_empty=False,
+                                                 max_length=BULK_MAX_LINES)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = [(line['product'], line['output_quantity']) for line in serializer.validated_data]
+        errors = bulk_line_errors(lines)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            product_outputs = add_outputs(lines, request.user)
+        except OutOfStockError as e:
+            errors = [{"Xabar": "Noto'g'ri miqdor!"} if product_id in e.product_ids else {}
+                      for product_id, _ in lines]
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(ProductOutputSerializer(product_outputs, many=True).data, status=status.HTTP_201_CREATED)
+
+
+#### CORRECTIONS ####
+class MovementBackdateAPIView(APIView):
+    """
+    Post a movement at a past time, e.g. a delivery entered late.
+    Only the balances of the product's later movements are repaired.
+    """
+    permission_classes = [IsStaffUser]
+    model = None
+    serializer_class = None
+    response_serializer_class = None
+    quantity_field = None
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        try:
+            movement = backdate_movement(self.model, data['product'].pk, data[self.quantity_field],
+                                         data['created_at'], request.user)
+        except OutOfStockError:
+            return Response({"Xabar": "Noto'g'ri miqdor!"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.response_serializer_class(movement).data, status=status.HTTP_201_CREATED)
+
+
+class MovementCorrectionAPIView(APIView):
+    """
+    Correct the quantity and/or the time of a posted movement, or delete it.
+    Only the balances of the product's movements after it are repaired.
+    """
+    permission_classes = [IsStaffUser]
+    model = None
+    serializer_class = None
+    response_serializer_class = None
+    quantity_field = None
+
+    def get_object(self, pk):
+        return get_object_or_404(self.model.objects.all(), pk=pk)
+
+    def patch(self, request, pk):
+        movement = self.get_object(pk)
+        serializer = self.serializer_class(data=request.data, partial=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        try:
+            movement = correct_movement(movement, data.get(self.quantity_field), data.get('created_at'))
+        except OutOfStockError:
+            return Response({"Xabar": "Noto'g'ri miqdor!"}, status=status.HTTP_400_BAD_REQUEST)
+        except Product.DoesNotExist:
+            return Response({"Xabar": "Mahsulot topilmadi."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.response_serializer_class(movement).data)
+
+    def delete(self, request, pk):
+        movement = self.get_object(pk)
+        try:
+            delete_movement(movement)
+        except OutOfStockError:
+            return Response({"Xabar": "Noto'g'ri miqdor!"}, status=status.HTTP_400_BAD_REQUEST)
+        except Product.DoesNotExist:
+            return Response({"Xabar": "Mahsulot topilmadi."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ProductInputBackdateAPIView(MovementBackdateAPIView):
+    model = ProductInput
+    serializer_class = ProductInputBackdateSerializer
+    response_serializer_class = ProductInputSerializer
+    quantity_field = 'input_quantity'
+
+    @swagger_auto_schema(tags=['Product-Input-Output'], request_body=ProductInputBackdateSerializer)
+    def post(self, request):
+        return super().post(request)
+
+
+class ProductInputCorrectionAPIView(MovementCorrectionAPIView):
+    model = ProductInput
+    serializer_class = ProductInputCorrectionSerializer
+    response_serializer_class = ProductInputSerializer
+    quantity_field = 'input_quantity'
+
+    @swagger_auto_schema(tags=['Product-Input-Output'], request_body=ProductInputCorrectionSerializer)
+    def patch(self, request, pk):
+        return super().patch(request, pk)
+
+    @swagger_auto_schema(tags=['Product-Input-Output'])
+    def delete(self, request, pk):
+        return super().delete(request, pk)
+
+
+class ProductOutputBackdateAPIView(MovementBackdateAPIView):
+    model = ProductOutput
+    serializer_class = ProductOutputBackdateSerializer
+    response_serializer_class = ProductOutputSerializer
+    quantity_field = 'output_quantity'
+
+    @swagger_auto_schema(tags=['Product-Input-Output'], request_body=ProductOutputBackdateSerializer)
+    def post(self, request):
+        return super().post(request)
+
+
+class ProductOutputCorrectionAPIView(MovementCorrectionAPIView):
+    model = ProductOutput
+    serializer_class = ProductOutputCorrectionSerializer
+    response_serializer_class = ProductOutputSerializer
+    quantity_field = 'output_quantity'
+
+    @swagger_auto_schema(tags=['Product-Input-Output'], request_body=ProductOutputCorrectionSerializer)
+    def patch(self, request, pk):
+        return super().patch(request, pk)
+
+    @swagger_auto_schema(tags=['Product-Input-Output'])
+    def delete(self, request, pk):
+        return super().delete(request, pk)
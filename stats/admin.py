@@ -1,3 +1,17 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import DailyStock, ReportJob
+
+
+@admin.register(DailyStock)
+class DailyStockAdmin(admin.ModelAdmin):
+    list_display = ('product', 'date', 'opening_quantity', 'input_quantity', 'output_quantity', 'closing_quantity')
+    list_filter = ('date',)
+    search_fields = ('product__name', 'product__prod_code')
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'processed', 'total', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    exclude = ('result',)
@@ -0,0 +1,135 @@
+"""
+Async versions of the stats endpoints, for serving through config.asgi.application.
+They are plain Django async views: the database is read with the async ORM and the
+report is computed off the event loop, so the worker keeps serving other requests
+while a long report is in flight.
+"""
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from product.models import ProductInput, ProductOutput
+from product.pagination import MovementPagination
+from product.serializers import CombinedProductSerializer, ProductInputGetSerializer, ProductOutputGetSerializer
+from .cache import report_content, report_key
+from .history import history_queryset
+from .params import InvalidParams, filter_movements, parse_date_range, parse_history_dates, report_movement_range
+from .report import aiter_report, filter_products
+from .streaming import STREAM_FORMATS, aiter_serialized, streaming_response
+from .versions import ledger_version
+
+
+def _error(message, status_code=status.HTTP_400_BAD_REQUEST):
+    return JsonResponse({'error': message}, status=status_code)
+
+
+class AsyncStatsView(View):
+    """Authenticates the JWT like the DRF views and only lets authenticated users in."""
+    http_method_names = ['get', 'options']
+    authentication = JWTAuthentication()
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            result = await sync_to_async(self.authentication.authenticate)(request)
+            if result is None:
+                return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                                    status=status.HTTP_401_UNAUTHORIZED)
+            request.user = result[0]
+            # DRF request for the query_params the shared helpers read
+            return await super().dispatch(Request(request), *args, **kwargs)
+        except APIException as error:
+            # Same body as DRF's exception handler, e.g. an invalid token or cursor
+            detail = error.detail if isinstance(error.detail, dict) else {'detail': error.detail}
+            return JsonResponse(detail, status=error.status_code)
+
+
+class AsyncMovementListView(AsyncStatsView):
+    model = None
+    serializer_class = None
+    filename = None
+
+    async def get(self, request):
+        movements = self.serializer_class.setup_queryset(self.model.objects.all())
+        try:
+            movements = filter_movements(movements, request.query_params)
+        except InvalidParams as error:
+            return _error(str(error))
+
+        stream_format = request.query_params.get('stream')
+        if stream_format in STREAM_FORMATS:
+            return streaming_response(aiter_serialized(movements, self.serializer_class), stream_format,
+                                      self.filename)
+
+        serializer = self.serializer_class()
+        paginator = MovementPagination()
+        if paginator.is_requested(request):
+            page = await paginator.apaginate_queryset(movements, request)
+            data = [serializer.to_representation(movement) for movement in page]
+            return JsonResponse(paginator.get_paginated_data(data), encoder=DjangoJSONEncoder)
+
+        data = [serializer.to_representation(movement) async for movement in movements]
+        return JsonResponse(data, encoder=DjangoJSONEncoder, safe=False)
+
+
+class AsyncProductInputsListView(AsyncMovementListView):
+    model = ProductInput
+    serializer_class = ProductInputGetSerializer
+    filename = 'inputs'
+
+
+class AsyncProductOutputsListView(AsyncMovementListView):
+    model = ProductOutput
+    serializer_class = ProductOutputGetSerializer
+    filename = 'outputs'
+
+
+class AsyncCombinedProductListView(AsyncStatsView):
+
+    async def get(self, request):
+        product_id = request.query_params.get('product_id')
+        try:
+            start_date, end_date = parse_history_dates(request.query_params)
+        except InvalidParams as error:
+            return _error(str(error))
+
+        movements = history_queryset(product_id, start_date, end_date)
+
+        stream_format = request.query_params.get('stream')
+        if stream_format in STREAM_FORMATS:
+            return streaming_response(aiter_serialized(movements, CombinedProductSerializer), stream_format,
+                                      'history')
+
+        paginator = MovementPagination()
+        page = await paginator.apaginate_queryset(movements, request)
+        serializer = CombinedProductSerializer(page, many=True)
+        return JsonResponse(paginator.get_paginated_data(serializer.data), encoder=DjangoJSONEncoder)
+
+
+class AsyncReportView(AsyncStatsView):
+
+    async def get(self, request):
+        category_id = request.query_params.get('category')
+        order_by = request.query_params.get('order_by')
+        search_query = request.query_params.get('search')
+        try:
+            dates = parse_date_range(request.query_params)
+        except InvalidParams as error:
+            return _error(str(error))
+        movement_range = report_movement_range(dates)
+
+        products = filter_products(category_id=category_id, order_by=order_by, search=search_query,
+                                   movement_range=movement_range)
+        stream_format = request.query_params.get('stream')
+        if stream_format in STREAM_FORMATS:
+            return streaming_response(aiter_report(products, dates.start, dates.end), stream_format, 'report')
+
+        cache_key = (report_key(dates.start, None if dates.up_to_now else dates.end, movement_range,
+                                category_id, order_by, search_query), await sync_to_async(ledger_version)())
+        # Building the rows is CPU bound, keep it off the event loop
+        content = await sync_to_async(report_content)(products, dates.start, dates.end, cache_key)
+        return HttpResponse(content, content_type='application/json')
@@ -0,0 +1,99 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Sum, Window
+
+from product.cache import product_code_cache
+from product.models import Product, StockMovement
+from product.pagination import MovementPagination
+from .snapshots import rebuild_snapshots
+from .versions import bump_report_version
+
+QUANTITY_STEP = Decimal('0.01')
+# Wide enough for the sum of a whole chunk
+BALANCE_FIELD = DecimalField(max_digits=20, decimal_places=2)
+
+
+def _running_balances(product_id, chunk_size):
+    """
+    (movement, running balance) of every movement of the product in ledger order,
+    read `chunk_size` at a time so no query stays open while the caller writes.
+    """
+    movements = StockMovement.objects.filter(product_id=product_id).only('pk', 'created_at', 'quantity',
+                                                                         'all_quantity')
+    if connection.features.supports_over_clause:
+        movements = movements.annotate(chunk_balance=Window(Sum('quantity', output_field=BALANCE_FIELD),
+                                                            order_by=[F('created_at'), F('pk')]))
+    paginator = MovementPagination()
+    balance, position = Decimal(0), None
+    while True:
+        chunk = list(paginator.page_queryset(movements, position, False, chunk_size))
+        carried = balance
+        for movement in chunk:
+            if hasattr(movement, 'chunk_balance'):
+                balance = (carried + movement.chunk_balance).quantize(QUANTITY_STEP)
+            else:
+                balance += movement.quantity
+            yield movement, balance
+        if len(chunk) < chunk_size:
+            return
+        position = paginator.get_position(chunk[-1])
+
+
+def rebuild_product_balance(product_id, chunk_size=5000, batch_size=1000, dry_run=False):
+    """
+    Recompute the all_quantity of every movement of the product from the ledger, set the
+    product quantity to the final balance and rebuild the snapshots of a product whose
+    balances changed. Returns (movements, movements fixed, quantity fixed).
+    The product row is locked meanwhile, so a movement posted concurrently can't be left out
+    and can't record a snapshot between the deletion and the rebuild of the product's rows.
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().only('quantity').get(pk=product_id)
+        scanned, fixed, changed = 0, 0, []
+        balance = Decimal(0)
+        for movement, balance in _running_balances(product_id, chunk_size):
+            scanned += 1
+            if movement.all_quantity != balance:
+                movement.all_quantity = balance
+                changed.append(movement)
+            if len(changed) >= batch_size:
+                fixed += _save_balances(changed, dry_run)
+                changed = []
+        fixed += _save_balances(changed, dry_run)
+        if fixed and not dry_run:
+            rebuild_snapshots([product_id])
+
+        quantity_fixed = product.quantity != balance
+        if quantity_fixed and not dry_run:
+            Product.objects.filter(pk=product_id).update(quantity=balance)
+            transaction.on_commit(lambda: product_code_cache.invalidate_products([product_id]))
+    return scanned, fixed, quantity_fixed
+
+
+def _save_balances(movements, dry_run):
+    if movements and not dry_run:
+        StockMovement.objects.bulk_update(movements, ['all_quantity'])
+    return len(movements)
+
+
+def rebuild_balances(product_ids=None, chunk_size=5000, batch_size=1000, dry_run=False):
+    """
+    rebuild_product_balance() of the given products (all by default).
+    Returns the totals (products, movements, movements fixed, quantities fixed).
+    """
+    products = Product.objects.order_by('pk')
+    if product_ids:
+        products = products.filter(pk__in=product_ids)
+
+    totals = [0, 0, 0, 0]
+    for product_id in list(products.values_list('pk', flat=True)):
+        scanned, fixed, quantity_fixed = rebuild_product_balance(product_id, chunk_size, batch_size, dry_run)
+        totals[0] += 1
+        totals[1] += scanned
+        totals[2] += fixed
+        totals[3] += quantity_fixed
+
+    if not dry_run and (totals[2] or totals[3]):
+        bump_report_version()
+    return tuple(totals)
@@ -0,0 +1,159 @@
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+from product.cache import LRUCache
+from .parallel import encode_report
+from .report import ORDERING
+
+
+def report_key(start_date, end_date, movement_range, category_id, order_by, search):
+    """
+    Normalized report parameters. `end_date` is None for a report running up to now,
+    which only changes when a movement is added and so is covered by the ledger version.
+    """
+    return (
+        start_date.isoformat(),
+        end_date.isoformat() if end_date else None,
+        movement_range is not None,
+        int(category_id) if category_id and category_id.isdigit() else category_id or None,
+        order_by if order_by in ORDERING else None,
+        search or None,
+    )
+
+
+class ReportCache(LRUCache):
+    """Encoded reports by (parameters, ledger version), bounded by count and total size."""
+
+    def __init__(self, maxsize=32, maxbytes=64 * 1024 * 1024, timeout=None):
+        super().__init__(maxsize, timeout)
+        self.maxbytes = maxbytes
+        self._bytes = 0
+
+    def set(self, key, value):
+        if len(value) > self.maxbytes:
+            return
+        with self._lock:
+            self.delete(key)
+            while self._data and (len(self._data) >= self.maxsize or self._bytes + len(value) > self.maxbytes):
+                _, (evicted, _) = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+            super().set(key, value)
+            self._bytes += len(value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            value = super().get(key, default)
+            if entry is not None and key not in self._data:
+                # Expired
+                self._bytes -= len(entry[0])
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[0])
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._bytes = 0
+
+    def metrics(self):
+        with self._lock:
+            return {'entries': len(self._data), 'bytes': self._bytes}
+
+
+report_cache = ReportCache(
+    maxsize=getattr(settings, 'REPORT_CACHE_SIZE', 32),
+    maxbytes=getattr(settings, 'REPORT_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+    timeout=getattr(settings, 'REPORT_CACHE_TIMEOUT', None),
+)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time in this process: callers arriving while
+    a call with the same key is in flight wait for it and share its result (or error).
+    A caller that waited longer than the timeout stops waiting and makes its own call.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._metrics = Counter()
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            self._metrics['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._metrics['coalesced'] += 1
+
+        if not leader:
+            if call.done.wait(self.timeout if timeout is None else timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            with self._lock:
+                self._metrics['timeouts'] += 1
+            return fn()
+
+        try:
+            call.result = fn()
+        except Exception as error:
+            call.error = error
+            with self._lock:
+                self._metrics['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self._metrics['executed'] += 1
+            call.done.set()
+        return call.result
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'calls': self._metrics['calls'],
+                'executed': self._metrics['executed'],
+                'coalesced': self._metrics['coalesced'],
+                'timeouts': self._metrics['timeouts'],
+                'errors': self._metrics['errors'],
+                'in_flight': len(self._calls),
+            }
+
+
+report_flight = SingleFlight(timeout=getattr(settings, 'REPORT_COALESCE_TIMEOUT', 60))
+
+
+def report_content(products, start_date, end_date, key):
+    """
+    The report encoded as JSON, from the cache or computed once for every identical
+    request arriving while it is being computed.
+    """
+    content = report_cache.get(key)
+    if content is not None:
+        return content
+
+    def compute():
+        encoded = encode_report(products, start_date, end_date).encode()
+        report_cache.set(key, encoded)
+        return encoded
+
+    return report_flight.do(key, compute)
@@ -0,0 +1,22 @@
+from django.db.models import F
+from django.db.models.functions import Abs
+
+from product.models import StockMovement
+
+HISTORY_FIELDS = ('id', 'type', 'product_id', 'all_quantity', 'created_at', 'user_id')
+
+
+def history_queryset(product_id=None, start_date=None, end_date=None):
+    """
+    Inputs and outputs in time order as dicts of the history columns, read from the
+    ledger with a single index range scan.
+    """
+    movements = StockMovement.objects.all()
+    if product_id:
+        movements = movements.filter(product_id=product_id)
+    if start_date:
+        movements = movements.filter(created_at__gte=start_date)
+    if end_date:
+        movements = movements.filter(created_at__lte=end_date)
+    return movements.order_by('created_at', 'id').values(
+        *HISTORY_FIELDS, product_name=F('product__name'), moved_quantity=Abs('quantity'))
@@ -0,0 +1,75 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import ReportJob
+from .params import parse_date_range, report_movement_range
+from .report import filter_products, iter_report
+
+JOB_PARAMS = ('start_date', 'end_date', 'category', 'order_by', 'search')
+
+
+def create_report_job(user, params):
+    """Queue a report of `params` (the report endpoint's query parameters), raising InvalidParams if unusable."""
+    params = {name: str(params[name]) for name in JOB_PARAMS if params.get(name) not in (None, '')}
+    parse_date_range(params)
+    return ReportJob.objects.create(user=user, params=params)
+
+
+def claim_job():
+    """Mark the oldest pending job running and return it, None when there is none."""
+    while True:
+        pk = ReportJob.objects.filter(status=ReportJob.PENDING).order_by('created_at', 'pk') \
+            .values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        # Another worker may claim the same job meanwhile, only one update succeeds
+        claimed = ReportJob.objects.filter(pk=pk, status=ReportJob.PENDING) \
+            .update(status=ReportJob.RUNNING, started_at=timezone.now())
+        if claimed:
+            return ReportJob.objects.get(pk=pk)
+
+
+def run_job(job, chunk_size=500):
+    """
+    Compute the report of a claimed job a chunk of products at a time, recording the
+    progress between chunks. No query is left open while the progress is written,
+    which SQLite could not serve alongside the other workers' writes.
+    """
+    params = job.params
+    try:
+        dates = parse_date_range(params)
+        products = filter_products(category_id=params.get('category'), order_by=params.get('order_by'),
+                                   search=params.get('search'), movement_range=report_movement_range(dates))
+        if not products.ordered:
+            products = products.order_by('pk')
+        product_ids = list(products.values_list('pk', flat=True))
+        ReportJob.objects.filter(pk=job.pk).update(total=len(product_ids))
+
+        rows = []
+        for start in range(0, len(product_ids), chunk_size):
+            # A contiguous slice of the ordering, so the chunks follow each other in order
+            chunk = products.filter(pk__in=product_ids[start:start + chunk_size])
+            rows += iter_report(chunk, dates.start, dates.end, chunk_size=chunk_size)
+            ReportJob.objects.filter(pk=job.pk).update(processed=start + chunk_size)
+        result = json.dumps(rows, cls=DjangoJSONEncoder)
+    except Exception as error:
+        ReportJob.objects.filter(pk=job.pk).update(status=ReportJob.FAILED, error=repr(error),
+                                                   finished_at=timezone.now())
+        raise
+    ReportJob.objects.filter(pk=job.pk).update(status=ReportJob.DONE, processed=len(product_ids), result=result,
+                                               finished_at=timezone.now())
+
+
+def requeue_stale_jobs(older_than):
+    """Put back in the queue the jobs left running by a worker that stopped, returns their number."""
+    return ReportJob.objects.filter(status=ReportJob.RUNNING, started_at__lt=timezone.now() - older_than) \
+        .update(status=ReportJob.PENDING, processed=0, started_at=None)
+
+
+def delete_old_jobs(older_than):
+    """Delete the jobs finished longer than `older_than` ago, returns their number."""
+    deleted, _ = ReportJob.objects.filter(status__in=(ReportJob.DONE, ReportJob.FAILED),
+                                          finished_at__lt=timezone.now() - older_than).delete()
+    return deleted
@@ -0,0 +1,68 @@
+import json
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from stats.params import InvalidParams, parse_date_range, report_movement_range
+from stats.parallel import create_pool, encode_report_parallel
+from stats.report import build_report, filter_products
+
+
+class Command(BaseCommand):
+    help = "Time the report computed in the request and by process pools of several sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                            help="Pool sizes to time, 1 computes the report without a pool")
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--start-date', help="YYYY-MM-DD")
+        parser.add_argument('--end-date', help="YYYY-MM-DD")
+        parser.add_argument('--category', help="Category ID")
+        parser.add_argument('--order-by', choices=['category', 'name', 'price', 'quantity'])
+        parser.add_argument('--no-snapshots', action='store_true', help="Read every movement of the range")
+
+    def handle(self, *args, **options):
+        try:
+            dates = parse_date_range({'start_date': options['start_date'], 'end_date': options['end_date']})
+        except InvalidParams as error:
+            raise CommandError(error)
+        products = filter_products(category_id=options['category'], order_by=options['order_by'],
+                                   movement_range=report_movement_range(dates))
+        # Same tie breaking as the shards, so every run must produce the same bytes
+        products = products.order_by(*products.query.order_by, 'pk')
+        use_snapshots = not options['no_snapshots']
+        self.stdout.write(f"{products.count()} products, {os.cpu_count()} CPUs, "
+                          f"{dates.start:%Y-%m-%d} - {dates.end:%Y-%m-%d}")
+
+        def serial():
+            return json.dumps(build_report(products, dates.start, dates.end, use_snapshots), cls=DjangoJSONEncoder)
+
+        expected = serial()
+        baseline = None
+        for workers in options['workers']:
+            pool = create_pool(workers) if workers > 1 else None
+            if pool is None:
+                run = serial
+            else:
+                def run():
+                    return encode_report_parallel(products, dates.start, dates.end, pool, workers, use_snapshots)
+            try:
+                # Untimed first run, which starts the pool processes
+                if run() != expected:
+                    raise CommandError(f"The report computed by {workers} workers differs")
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - started)
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+
+            best = min(timings)
+            baseline = baseline or best
+            self.stdout.write(f"{workers} workers: best {best:.3f}s, mean {statistics.mean(timings):.3f}s, "
+                              f"speedup {baseline / best:.2f}x")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from stats.snapshots import rebuild_snapshots
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily stock snapshots (DailyStock) from the input/output history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products',
+                            help="Only rebuild this product, can be given several times")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        created = rebuild_snapshots(options['products'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{created} daily snapshots created"))
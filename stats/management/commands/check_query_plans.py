@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from stats.plans import FULL_SCAN_PATTERNS, explain, full_scans, query_shapes
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN every stats/report query shape and fail if any of them reads a whole table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help="Print the plan of every query")
+
+    def handle(self, *args, **options):
+        if connection.vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f"Query plans of {connection.vendor} are not supported")
+
+        failed = []
+        for name, queryset, allowed in query_shapes():
+            plan = explain(queryset)
+            scans = full_scans(plan, allowed)
+            if scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: full scan of {', '.join(scans)}"))
+            else:
+                self.stdout.write(f"{name}: OK")
+            if scans or options['verbose_plans']:
+                self.stdout.write(plan)
+
+        if failed:
+            raise CommandError(f"{len(failed)} query shapes fall back to a full scan")
+        self.stdout.write(self.style.SUCCESS("Every query shape uses an index"))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stats.balances import rebuild_balances
+
+
+class Command(BaseCommand):
+    help = "Recompute the running balance (all_quantity) of every movement and reconcile the product quantities"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products',
+                            help="Only rebuild this product, can be given several times")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Movements read at a time")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Movements written at a time")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be fixed")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        products, movements, fixed, quantities = rebuild_balances(
+            options['products'], chunk_size=options['chunk_size'], batch_size=options['batch_size'],
+            dry_run=options['dry_run'])
+        verb = "to fix" if options['dry_run'] else "fixed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{products} products, {movements} movements in {time.perf_counter() - started:.2f}s: "
+            f"{fixed} balances and {quantities} product quantities {verb}"))
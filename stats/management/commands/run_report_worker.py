@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from stats.jobs import claim_job, delete_old_jobs, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Compute the queued report jobs (ReportJob) with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Jobs computed at the same time")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Products read at a time, the progress is recorded after each chunk")
+        parser.add_argument('--poll-interval', type=float, default=1, help="Seconds between checks for new jobs")
+        parser.add_argument('--stale-after', type=int, default=3600,
+                            help="Seconds after which a running job is considered abandoned and queued again")
+        parser.add_argument('--keep-days', type=int, default=7, help="Days finished jobs are kept")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        requeued = requeue_stale_jobs(timedelta(seconds=options['stale_after']))
+        deleted = delete_old_jobs(timedelta(days=options['keep_days']))
+        self.stdout.write(f"{requeued} abandoned jobs queued again, {deleted} old jobs deleted")
+
+        running = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report-worker') as pool:
+            try:
+                while True:
+                    running = {future for future in running if not future.done()}
+                    job = claim_job() if len(running) < workers else None
+                    if job is not None:
+                        running.add(pool.submit(self.run, job, options['chunk_size']))
+                        continue
+                    if options['once'] and not running:
+                        break
+                    time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping, waiting for the running jobs to finish")
+
+    def run(self, job, chunk_size):
+        started = time.perf_counter()
+        try:
+            run_job(job, chunk_size)
+        except Exception as error:
+            self.stderr.write(f"Report job {job.pk} failed: {error!r}")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Report job {job.pk} done in {time.perf_counter() - started:.2f}s"))
+        finally:
+            # Each thread has its own connection
+            connection.close()
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('product', '0013_product_is_deleted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('opening_quantity', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('input_quantity', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('output_quantity', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('closing_quantity', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stocks', to='product.product')),
+            ],
+            options={
+                'verbose_name': 'Kunlik qoldiq',
+                'verbose_name_plural': 'Kunlik qoldiqlar',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailystock',
+            constraint=models.UniqueConstraint(fields=('product', 'date'), name='unique_daily_stock'),
+        ),
+    ]
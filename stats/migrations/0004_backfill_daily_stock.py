@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.utils.timezone import localdate
+
+
+def build_snapshots(apps, schema_editor):
+    """
+    Fill the snapshots of the movements posted before they existed, as the
+    build_stock_snapshots command does, otherwise the reports miss that history.
+    The fold is a copy of stats.snapshots at the time, so later changes to the app
+    code can't change what this migration does.
+    """
+    DailyStock = apps.get_model('stats', 'DailyStock')
+    StockMovement = apps.get_model('product', 'StockMovement')
+    DailyStock.objects.all().delete()
+    movements = StockMovement.objects.filter(product__isnull=False).order_by('product_id', 'created_at', 'pk') \
+        .values_list('product_id', 'created_at', 'type', 'quantity', 'all_quantity')
+
+    batch, snapshot = [], None
+    for product_id, created_at, movement_type, quantity, all_quantity in movements.iterator(chunk_size=2000):
+        input_quantity, output_quantity = (quantity, 0) if movement_type == 'input' else (0, -quantity)
+        day = localdate(created_at)
+        if snapshot is None or snapshot.product_id != product_id or snapshot.date != day:
+            if snapshot is not None:
+                batch.append(snapshot)
+            snapshot = DailyStock(product_id=product_id, date=day,
+                                  opening_quantity=all_quantity - input_quantity + output_quantity)
+        snapshot.input_quantity += input_quantity
+        snapshot.output_quantity += output_quantity
+        snapshot.closing_quantity = all_quantity
+        if len(batch) >= 1000:
+            DailyStock.objects.bulk_create(batch)
+            batch = []
+    if snapshot is not None:
+        batch.append(snapshot)
+    DailyStock.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0003_report_job'),
+        ('product', '0017_backfill_stockmovement'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_snapshots, migrations.RunPython.noop),
+    ]
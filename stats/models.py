@@ -1,3 +1,81 @@
 from django.db import models
 
-# Create your models here.
+from product.models import Product
+from users.models import User
+
+
+class DailyStock(models.Model):
+    """
+    Per-product balance of one day, maintained as movements are posted.
+    Reports read whole days from here instead of scanning every movement.
+    """
+    class Meta:
+        verbose_name = 'Kunlik qoldiq'
+        verbose_name_plural = 'Kunlik qoldiqlar'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='unique_daily_stock'),
+        ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_stocks')
+    date = models.DateField()
+    opening_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2)  # kun boshidagi qoldiq
+    input_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2)
+    output_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2)
+    closing_quantity = models.DecimalField(default=0, max_digits=8, decimal_places=2)  # kun oxiridagi qoldiq
+
+    def __str__(self):
+        return f'{self.product_id} - {self.date}'
+
+
+class ChangeCounter(models.Model):
+    """
+    Named counters bumped on every change the cached reports depend on but that
+    leaves no newer movement behind (product edits, deletions, snapshot rebuilds).
+    """
+    class Meta:
+        verbose_name = "O'zgarishlar hisoblagichi"
+        verbose_name_plural = "O'zgarishlar hisoblagichlari"
+
+    name = models.CharField(max_length=50, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} - {self.value}'
+
+
+class ReportJob(models.Model):
+    """
+    A report computed in the background by the run_report_worker command.
+    `params` holds the report parameters as they were requested, `result` the encoded report.
+    """
+    class Meta:
+        verbose_name = 'Hisobot vazifasi'
+        verbose_name_plural = 'Hisobot vazifalari'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='report_job_status_created'),
+        ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Navbatda'),
+        (RUNNING, 'Bajarilmoqda'),
+        (DONE, 'Tayyor'),
+        (FAILED, 'Xatolik'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='report_jobs')
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=7, choices=STATUSES, default=PENDING)
+    total = models.PositiveIntegerField(null=True, blank=True)  # products to report
+    processed = models.PositiveIntegerField(default=0)
+    result = models.TextField(null=True, blank=True, editable=False)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.pk} - {self.status}'
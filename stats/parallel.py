@@ -0,0 +1,93 @@
+"""
+Reports computed by a pool of processes, each building the rows of a shard of the products.
+The shards are contiguous slices of the products in report order, so the encoded shards
+only have to be joined back one after the other.
+"""
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .report import build_report, filter_products
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def create_pool(workers):
+    # Spawned rather than forked: a forked process would inherit the open database
+    # connection of the parent, the spawned ones load Django and connect by themselves
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=django.setup)
+
+
+def report_pool():
+    """The pool of REPORT_WORKERS processes, started on first use and kept for the life of the process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool(getattr(settings, 'REPORT_WORKERS', 1))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def encode_shard(product_ids, ordering, start_date, end_date, use_snapshots=True):
+    """The report of `product_ids` in `ordering`, encoded as a JSON array. Runs in a pool process."""
+    products = filter_products().filter(pk__in=product_ids).order_by(*ordering)
+    return json.dumps(build_report(products, start_date, end_date, use_snapshots), cls=DjangoJSONEncoder)
+
+
+def split(items, shards):
+    """`items` cut into `shards` contiguous slices of nearly the same length."""
+    size, extra = divmod(len(items), shards)
+    slices, start = [], 0
+    for i in range(shards):
+        end = start + size + (i < extra)
+        slices.append(items[start:end])
+        start = end
+    return slices
+
+
+def encode_report_parallel(products, start_date, end_date, executor, shards, use_snapshots=True):
+    """
+    The report of `products` encoded as JSON, identical to encoding build_report(),
+    computed as `shards` shards by `executor`.
+    """
+    # The pk breaks ties, so every shard sorts its products the way they were split
+    ordering = (*products.query.order_by, 'pk')
+    products = products.order_by(*ordering)
+    product_ids = list(products.values_list('pk', flat=True))
+    shards = max(1, min(shards, len(product_ids)))
+    futures = [executor.submit(encode_shard, shard, ordering, start_date, end_date, use_snapshots)
+               for shard in split(product_ids, shards)]
+    parts = [part[1:-1] for part in (future.result() for future in futures) if part != '[]']
+    return '[' + ', '.join(parts) + ']'
+
+
+def encode_report(products, start_date, end_date):
+    """
+    The report encoded as JSON, computed by the process pool when REPORT_WORKERS is
+    above 1 and there are at least REPORT_SHARD_MIN_PRODUCTS products per worker.
+    """
+    workers = getattr(settings, 'REPORT_WORKERS', 1)
+    if workers > 1:
+        shards = min(workers, products.count() // getattr(settings, 'REPORT_SHARD_MIN_PRODUCTS', 1000))
+        if shards > 1:
+            try:
+                return encode_report_parallel(products, start_date, end_date, report_pool(), shards)
+            except BrokenProcessPool:
+                # A pool process died, start a new pool next time and compute this one here
+                _reset_pool()
+    return json.dumps(build_report(products, start_date, end_date), cls=DjangoJSONEncoder)
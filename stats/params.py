@@ -0,0 +1,105 @@
+from datetime import datetime, time
+from typing import NamedTuple
+
+from django.utils.timezone import make_aware
+
+from product.models import StockMovement
+
+DATE_FORMAT = '%Y-%m-%d'
+FIRST_DATE = '2020-01-01'
+
+START_AFTER_END = 'Boshlanish sanasi yakuniy sanadan keyin bo\'lishi mumkin emas.'
+START_IN_FUTURE = 'Boshlanish sanasi bugungi sanadan keyin bo\'lishi mumkin emas.'
+INVALID_DATE = 'Invalid date format'
+
+MOVEMENT_ORDERING = {
+    'category': 'product__category__name',
+    'name': 'product__name',
+    'price': 'product__price',
+}
+
+
+class InvalidParams(Exception):
+    """A query parameter that can't be used, the message is shown to the user."""
+
+
+class DateRange(NamedTuple):
+    start: datetime
+    end: datetime
+    given: bool  # start_date and/or end_date were given
+    up_to_now: bool  # only start_date was given, the range ends now
+
+
+def _day_start(value):
+    return make_aware(datetime.strptime(value, DATE_FORMAT))
+
+
+def _day_end(value):
+    return make_aware(datetime.combine(datetime.strptime(value, DATE_FORMAT).date(), time.max))
+
+
+def parse_date_range(params):
+    """
+    The range of the start_date/end_date parameters of the report and movement lists:
+    both dates, from start_date until now, or from the first day until end_date,
+    and from the first day until the end of today when neither is given.
+    """
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    try:
+        if start_date and end_date:
+            if start_date > end_date:
+                raise InvalidParams(START_AFTER_END)
+            return DateRange(_day_start(start_date), _day_end(end_date), True, False)
+        if start_date:
+            if start_date > datetime.now().strftime(DATE_FORMAT):
+                raise InvalidParams(START_IN_FUTURE)
+            return DateRange(_day_start(start_date), make_aware(datetime.now()), True, True)
+        if end_date:
+            return DateRange(_day_start(FIRST_DATE), _day_end(end_date), True, False)
+    except ValueError:
+        raise InvalidParams(INVALID_DATE)
+    return DateRange(_day_start(FIRST_DATE), _day_end(datetime.now().strftime(DATE_FORMAT)), False, False)
+
+
+def parse_history_dates(params):
+    """(start, end) of the history, either one None when its parameter is missing."""
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    try:
+        start = _day_start(start_date) if start_date else None
+        end = _day_end(end_date) if end_date else None
+    except ValueError:
+        raise InvalidParams(INVALID_DATE)
+    if start and end and start > end:
+        raise InvalidParams(START_AFTER_END)
+    return start, end
+
+
+def report_movement_range(dates):
+    """Range in which the reported products must have moved; a report up to now lists every product."""
+    return (dates.start, dates.end) if dates.given and not dates.up_to_now else None
+
+
+def filter_movements(movements, params):
+    """Apply the product_id, category, date and order_by parameters of a movement list."""
+    product_id = params.get('product_id')
+    if product_id:
+        movements = movements.filter(product_id=product_id)
+
+    category_id = params.get('category')
+    if category_id:
+        movements = movements.filter(product__category_id=category_id)
+
+    dates = parse_date_range(params)
+    if dates.given:
+        movements = movements.filter(created_at__range=(dates.start, dates.end))
+
+    order_by = params.get('order_by')
+    if order_by in MOVEMENT_ORDERING:
+        movements = movements.order_by(MOVEMENT_ORDERING[order_by])
+    elif order_by == 'quantity':
+        # Outputs are stored negative
+        inputs = movements.model.movement_type == StockMovement.INPUT
+        movements = movements.order_by('quantity' if inputs else '-quantity')
+    return movements
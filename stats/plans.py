@@ -0,0 +1,92 @@
+import re
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.utils.timezone import localdate, now
+
+from product.models import Category, Product, ProductInput, ProductOutput
+from product.pagination import MovementPagination, ProductPagination
+from product.search import search_filter, uses_index
+from product.serializers import ProductInputGetSerializer, ProductOutputGetSerializer
+from .history import history_queryset
+from .report import annotate_movements, filter_products, report_segments
+from .snapshots import day_start
+
+# A table read from end to end, per database vendor. SQLite's "SCAN t USING INDEX"
+# walks an index in order and stops at the LIMIT and "SCAN t VIRTUAL TABLE INDEX" is
+# a lookup in the search index, so only a bare SCAN counts.
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (\w+)(?!\w| USING (?:COVERING )?INDEX| VIRTUAL TABLE)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+
+
+def _first_page(pagination, queryset, position=None):
+    paginator = pagination()
+    return paginator.page_queryset(queryset, position, False, paginator.page_size + 1)
+
+
+def query_shapes():
+    """
+    (name, queryset, tables allowed to be scanned) of every query the stats and
+    product endpoints run for a bounded result: a product, a category, a date
+    range or a page. Unbounded listings read every row by design and are left out.
+    """
+    end = now()
+    start = day_start(localdate(end) - timedelta(days=30))
+    movement_range = (start, end)
+    created_at = (end - timedelta(days=1)).isoformat()
+    active = Product.objects.filter(is_deleted=False)
+
+    shapes = [
+        ('report', annotate_movements(filter_products(), report_segments(start, end)),
+         {Product._meta.db_table}),
+        ('report by category and range',
+         annotate_movements(filter_products(category_id=1, movement_range=movement_range),
+                            report_segments(start, end)), set()),
+        ('report without snapshots',
+         annotate_movements(filter_products(category_id=1), report_segments(start, end, use_snapshots=False)),
+         set()),
+        ('product by code', Product.objects.filter(prod_code='4780000000001'), set()),
+        # Without the search table the words are looked up in the trigram index of each column,
+        # which can't be combined for an OR across the product and its category
+        ('product search', active.filter(search_filter('olma')),
+         set() if uses_index() else {Product._meta.db_table, Category._meta.db_table}),
+        ('product page', _first_page(ProductPagination, active), set()),
+        ('next product page', _first_page(ProductPagination, active, [50]), set()),
+    ]
+    for kind, model, serializer in (('inputs', ProductInput, ProductInputGetSerializer),
+                                    ('outputs', ProductOutput, ProductOutputGetSerializer)):
+        movements = serializer.setup_queryset(model.objects.all())
+        shapes += [
+            (f'{kind} of product', movements.filter(product_id=1, created_at__range=movement_range), set()),
+            (f'{kind} in range', movements.filter(created_at__range=movement_range), set()),
+            (f'{kind} page', _first_page(MovementPagination, movements), set()),
+            (f'next {kind} page', _first_page(MovementPagination, movements, [created_at, 1]), set()),
+        ]
+
+    for name, movements in (('history', history_queryset()),
+                            ('history of product', history_queryset(1, start, end))):
+        shapes += [
+            (f'{name} page', _first_page(MovementPagination, movements), set()),
+            (f'next {name} page', _first_page(MovementPagination, movements, [created_at, 1]), set()),
+        ]
+    return shapes
+
+
+def explain(queryset):
+    """The query plan of `queryset`; on PostgreSQL sequential scans are only used when unavoidable."""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Small tables are cheaper to read whole, judge the indexes instead
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+
+def full_scans(plan, allowed=()):
+    """Tables of the project that `plan` reads from end to end, apart from the `allowed` ones."""
+    pattern = FULL_SCAN_PATTERNS[connection.vendor]
+    tables = {model._meta.db_table for model in apps.get_models()}
+    return sorted({table for table in pattern.findall(plan) if table in tables and table not in allowed})
@@ -0,0 +1,205 @@
+from decimal import Decimal
+
+from django.db.models import DecimalField, Exists, F, OuterRef, Q, Subquery, Sum
+
+from product.models import Product, StockMovement
+from product.search import search_filter
+from product.serializers import ProductReportSerializer
+from .models import DailyStock
+from .snapshots import split_range
+
+QUANTITY_FIELD = DecimalField(max_digits=8, decimal_places=2)
+QUANTITY_STEP = Decimal('0.01')
+
+ORDERING = {
+    'category': 'category__name',
+    'name': 'name',
+    'price': 'price',
+    'quantity': 'quantity',
+}
+
+
+def filter_products(category_id=None, order_by=None, search=None, movement_range=None):
+    """
+    Products taking part in the report.
+    `movement_range` keeps only products that have both an input and an output in that range.
+    """
+    products = Product.objects.select_related('unit', 'category')
+
+    if category_id:
+        products = products.filter(category_id=category_id)
+
+    if order_by in ORDERING:
+        products = products.order_by(ORDERING[order_by])
+
+    if movement_range:
+        movements = StockMovement.objects.filter(product=OuterRef('pk'), created_at__range=movement_range)
+        products = products.filter(
+            Exists(movements.filter(type=StockMovement.INPUT)),
+            Exists(movements.filter(type=StockMovement.OUTPUT)),
+        )
+
+    if search:
+        products = products.filter(search_filter(search))
+    return products
+
+
+def _raw_annotations(prefix, movement_range):
+    """
+    Correlated subqueries giving, per product, the quantities received and shipped
+    in the range and the balances before its first and after its last movement,
+    each an index range scan of the product's movements.
+    """
+    movements = StockMovement.objects.filter(product=OuterRef('pk'), created_at__range=movement_range)
+    totals = movements.order_by().values('product')
+    first = movements.order_by('created_at', 'pk')
+    last = movements.order_by('-created_at', '-pk')
+    return {
+        f'{prefix}_in_quantity': Subquery(
+            totals.annotate(total=Sum('quantity', filter=Q(type=StockMovement.INPUT))).values('total'),
+            output_field=QUANTITY_FIELD,
+        ),
+        f'{prefix}_out_quantity': Subquery(
+            totals.annotate(total=Sum(-F('quantity'), filter=Q(type=StockMovement.OUTPUT),
+                                      output_field=QUANTITY_FIELD)).values('total'),
+            output_field=QUANTITY_FIELD,
+        ),
+        f'{prefix}_opening': Subquery(
+            first.annotate(opening=F('all_quantity') - F('quantity')).values('opening')[:1],
+            output_field=QUANTITY_FIELD,
+        ),
+        f'{prefix}_closing': Subquery(last.values('all_quantity')[:1], output_field=QUANTITY_FIELD),
+    }
+
+
+def _snapshot_annotations(prefix, days):
+    snapshots = DailyStock.objects.filter(product=OuterRef('pk'), date__range=days)
+    totals = snapshots.order_by().values('product')
+    return {
+        f'{prefix}_in_quantity': Subquery(
+            totals.annotate(total=Sum('input_quantity')).values('total'), output_field=QUANTITY_FIELD
+        ),
+        f'{prefix}_out_quantity': Subquery(
+            totals.annotate(total=Sum('output_quantity')).values('total'), output_field=QUANTITY_FIELD
+        ),
+        f'{prefix}_opening': Subquery(snapshots.order_by('date').values('opening_quantity')[:1]),
+        f'{prefix}_closing': Subquery(snapshots.order_by('-date').values('closing_quantity')[:1]),
+    }
+
+
+def report_segments(start_date, end_date, use_snapshots=True):
+    """
+    Chronological pieces of the range as (prefix, kind, range): whole days come
+    from DailyStock snapshots, partial edge days from the raw movements.
+    """
+    if not use_snapshots:
+        return [('range', 'raw', (start_date, end_date))]
+    head, days, tail = split_range(start_date, end_date)
+    segments = []
+    if head:
+        segments.append(('head', 'raw', head))
+    if days:
+        segments.append(('days', 'snapshot', days))
+    if tail:
+        segments.append(('tail', 'raw', tail))
+    return segments
+
+
+def annotate_movements(products, segments):
+    annotations = {}
+    for prefix, kind, segment_range in segments:
+        if kind == 'snapshot':
+            annotations.update(_snapshot_annotations(prefix, segment_range))
+        else:
+            annotations.update(_raw_annotations(prefix, segment_range))
+    return products.annotate(**annotations)
+
+
+def _quantity(value):
+    """SQLite hands computed decimals back unscaled, bring them to the field precision."""
+    return value.quantize(QUANTITY_STEP) if value is not None else None
+
+
+def _segment_totals(product, prefix):
+    """(input, output, opening, closing) of a segment, None when it has no movements."""
+    opening = getattr(product, f'{prefix}_opening')
+    if opening is None:
+        return None
+    return (_quantity(getattr(product, f'{prefix}_in_quantity')),
+            _quantity(getattr(product, f'{prefix}_out_quantity')),
+            _quantity(opening), _quantity(getattr(product, f'{prefix}_closing')))
+
+
+def report_row(product, segments, product_serializer):
+    """Report entry of an annotated product, or None when every figure is zero."""
+    totals = []
+    for prefix, _, _ in segments:
+        segment_totals = _segment_totals(product, prefix)
+        if segment_totals:
+            totals.append(segment_totals)
+
+    beginning_quantity = totals[0][2] if totals else 0
+    beginning_price = beginning_quantity * product.price if beginning_quantity else 0
+
+    goods_in_quantity = sum(t[0] for t in totals if t[0] is not None) or 0
+    goods_in_price = goods_in_quantity * product.price
+
+    goods_out_quantity = sum(t[1] for t in totals if t[1] is not None) or 0
+    goods_out_price = goods_out_quantity * product.price
+
+    last_quantity = totals[-1][3] if totals else 0
+    last_price = last_quantity * product.price if last_quantity else 0
+
+    if all(value == 0 for value in [
+        beginning_quantity, beginning_price, goods_in_quantity, goods_in_price,
+        goods_out_quantity, goods_out_price, last_quantity, last_price
+    ]):
+        return None
+    return {
+        'product': product_serializer.to_representation(product),
+        'beginning': {
+            "quantity": beginning_quantity,
+            'price': beginning_price
+        },
+        'input': {
+            'quantity': goods_in_quantity,
+            'price': goods_in_price,
+        },
+        'output': {
+            'quantity': goods_out_quantity,
+            'price': goods_out_price,
+        },
+        'last': {
+            'quantity': last_quantity,
+            'last_price': last_price
+        }
+    }
+
+
+def iter_report(products, start_date, end_date, use_snapshots=True, chunk_size=2000):
+    """
+    Report rows for `products` over the given range, produced while the products are
+    read `chunk_size` at a time.
+    The whole report is computed by a single query regardless of the number of products,
+    and reading whole days from snapshots keeps its cost independent of the history length.
+    """
+    segments = report_segments(start_date, end_date, use_snapshots)
+    product_serializer = ProductReportSerializer()
+    for product in annotate_movements(products, segments).iterator(chunk_size=chunk_size):
+        row = report_row(product, segments, product_serializer)
+        if row is not None:
+            yield row
+
+
+async def aiter_report(products, start_date, end_date, use_snapshots=True, chunk_size=2000):
+    """iter_report() reading the products with the async ORM."""
+    segments = report_segments(start_date, end_date, use_snapshots)
+    product_serializer = ProductReportSerializer()
+    async for product in annotate_movements(products, segments).aiterator(chunk_size=chunk_size):
+        row = report_row(product, segments, product_serializer)
+        if row is not None:
+            yield row
+
+
+def build_report(products, start_date, end_date, use_snapshots=True):
+    return list(iter_report(products, start_date, end_date, use_snapshots))
@@ -1,5 +1,9 @@
 from rest_framework import serializers
 
+from .models import ReportJob
+from .report import ORDERING
+
+
 class ReportSerializer(serializers.Serializer):
     product_name = serializers.CharField()
     product_code = serializers.CharField()
@@ -12,3 +16,28 @@ class ReportSerializer(serializers.Serializer):
     out_price = serializers.IntegerField()
     last_quantity = serializers.IntegerField()
     last_price = serializers.IntegerField()
+
+
+class ReportJobCreateSerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    category = serializers.IntegerField(required=False)
+    order_by = serializers.ChoiceField(choices=list(ORDERING), required=False)
+    search = serializers.CharField(required=False, allow_blank=True)
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'status', 'params', 'total', 'processed', 'progress', 'error', 'created_at', 'started_at',
+                  'finished_at']
+
+    def get_progress(self, obj):
+        """Percentage of the products reported so far."""
+        if obj.status == ReportJob.DONE:
+            return 100
+        if not obj.total:
+            return 0
+        return min(100, obj.processed * 100 // obj.total)
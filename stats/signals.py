@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+
+from product.models import Category, Product, ProductInput, ProductOutput, StockMovement, Unit
+from .versions import bump_report_version
+
+# New movements raise the ledger high-water mark by themselves, edits and deletions do not
+REPORTED_MODELS = (Category, Unit, Product, StockMovement, ProductInput, ProductOutput)
+
+
+def invalidate_reports(sender, raw=False, **kwargs):
+    if not raw:
+        bump_report_version()
+
+
+def connect():
+    for model in REPORTED_MODELS:
+        post_save.connect(invalidate_reports, sender=model, dispatch_uid=f'report-save-{model.__name__}')
+        post_delete.connect(invalidate_reports, sender=model, dispatch_uid=f'report-delete-{model.__name__}')
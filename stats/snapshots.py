@@ -0,0 +1,141 @@
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Round
+from django.utils.timezone import localdate, localtime, make_aware
+
+from product.models import StockMovement
+from .models import DailyStock
+from .versions import bump_report_version
+
+
+def record_movement(product_id, moved_at, all_quantity, input_quantity=0, output_quantity=0):
+    """
+    Add a posted movement to the snapshot of its day.
+    `all_quantity` is the product balance right after the movement.
+    """
+    day = localdate(moved_at)
+    snapshots = DailyStock.objects.filter(product_id=product_id, date=day)
+    # Round keeps SQLite's floating point arithmetic on exact cents
+    changes = {
+        'input_quantity': Round(F('input_quantity') + input_quantity, 2),
+        'output_quantity': Round(F('output_quantity') + output_quantity, 2),
+        'closing_quantity': Round(F('closing_quantity') + input_quantity - output_quantity, 2),
+    }
+    if snapshots.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            DailyStock.objects.create(
+                product_id=product_id,
+                date=day,
+                opening_quantity=all_quantity - input_quantity + output_quantity,
+                input_quantity=input_quantity,
+                output_quantity=output_quantity,
+                closing_quantity=all_quantity,
+            )
+    except IntegrityError:
+        # Another request created the day in the meantime
+        snapshots.update(**changes)
+
+
+def shift_snapshots(product_id, moved_at, all_quantity, input_quantity=0, output_quantity=0):
+    """
+    record_movement() of a movement inside the history rather than at its end, or taken back
+    with negative quantities: the balances of every later day change by the same amount.
+    """
+    day = localdate(moved_at)
+    record_movement(product_id, moved_at, all_quantity, input_quantity, output_quantity)
+    if input_quantity < 0 or output_quantity < 0:
+        # The day had no other movement, like the days without a snapshot
+        DailyStock.objects.filter(product_id=product_id, date=day, input_quantity=0, output_quantity=0).delete()
+    delta = input_quantity - output_quantity
+    DailyStock.objects.filter(product_id=product_id, date__gt=day).update(
+        opening_quantity=Round(F('opening_quantity') + delta, 2),
+        closing_quantity=Round(F('closing_quantity') + delta, 2),
+    )
+
+
+def movement_history(product_ids=None):
+    """
+    Every movement as (product_id, created_at, pk, input, output, all_quantity),
+    ordered by product and time.
+    """
+    movements = StockMovement.objects.filter(product__isnull=False)
+    if product_ids:
+        movements = movements.filter(product_id__in=product_ids)
+    movements = movements.order_by('product_id', 'created_at', 'pk').values_list(
+        'product_id', 'created_at', 'pk', 'type', 'quantity', 'all_quantity')
+    for product_id, created_at, pk, movement_type, quantity, all_quantity in movements.iterator(chunk_size=2000):
+        if movement_type == StockMovement.INPUT:
+            yield product_id, created_at, pk, quantity, 0, all_quantity
+        else:
+            yield product_id, created_at, pk, 0, -quantity, all_quantity
+
+
+def daily_snapshots(movements):
+    """Fold an ordered movement stream into unsaved DailyStock rows."""
+    snapshot = None
+    for product_id, created_at, _, input_quantity, output_quantity, all_quantity in movements:
+        day = localdate(created_at)
+        if snapshot is None or snapshot.product_id != product_id or snapshot.date != day:
+            if snapshot is not None:
+                yield snapshot
+            snapshot = DailyStock(
+                product_id=product_id,
+                date=day,
+                opening_quantity=all_quantity - input_quantity + output_quantity,
+            )
+        snapshot.input_quantity += input_quantity
+        snapshot.output_quantity += output_quantity
+        snapshot.closing_quantity = all_quantity
+    if snapshot is not None:
+        yield snapshot
+
+
+@transaction.atomic
+def rebuild_snapshots(product_ids=None, batch_size=1000):
+    """Recreate the snapshots of the given products (all by default) from their movements."""
+    snapshots = DailyStock.objects.all()
+    if product_ids:
+        snapshots = snapshots.filter(product_id__in=product_ids)
+    snapshots.delete()
+
+    created = 0
+    batch = []
+    for snapshot in daily_snapshots(movement_history(product_ids)):
+        batch.append(snapshot)
+        if len(batch) >= batch_size:
+            DailyStock.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+    DailyStock.objects.bulk_create(batch)
+    bump_report_version()
+    return created + len(batch)
+
+
+def day_start(day):
+    return make_aware(datetime.combine(day, time.min))
+
+
+def split_range(start_date, end_date):
+    """
+    Split a datetime range into the whole days it covers, answered from snapshots,
+    and the partial edge days before and after them, answered from raw movements.
+    Returns (head, days, tail); head and tail are inclusive datetime ranges and
+    days is (first_day, last_day), any of them may be None.
+    """
+    start = localtime(start_date)
+    end = localtime(end_date)
+
+    first_day = start.date() if start.time() == time.min else start.date() + timedelta(days=1)
+    last_day = end.date() if end.time() == time.max else end.date() - timedelta(days=1)
+    if first_day > last_day:
+        return (start_date, end_date), None, None
+
+    head_end = day_start(first_day) - timedelta(microseconds=1)
+    head = (start_date, head_end) if start_date <= head_end else None
+    tail_start = day_start(last_day + timedelta(days=1))
+    tail = (tail_start, end_date) if tail_start <= end_date else None
+    return head, (first_day, last_day), tail
@@ -0,0 +1,156 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from drf_yasg import openapi
+
+STREAM_FORMATS = ('json', 'csv')
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+stream_parameter = openapi.Parameter(
+    'stream', openapi.IN_QUERY, description="Stream the whole result as a JSON array or CSV file",
+    type=openapi.TYPE_STRING, enum=list(STREAM_FORMATS),
+)
+
+
+def iter_serialized(queryset, serializer_class, chunk_size=CHUNK_SIZE):
+    """Serialize a queryset row by row without loading it into memory."""
+    serializer = serializer_class()
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield serializer.to_representation(obj)
+
+
+async def aiter_serialized(queryset, serializer_class, chunk_size=CHUNK_SIZE):
+    """iter_serialized() reading the queryset with the async ORM."""
+    serializer = serializer_class()
+    async for obj in queryset.aiterator(chunk_size=chunk_size):
+        yield serializer.to_representation(obj)
+
+
+class _Buffer:
+    """Joins small pieces into chunks of about `size` characters."""
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.size = size
+        self.pieces = []
+        self.length = 0
+
+    def add(self, piece):
+        """Add a piece, returning the buffered chunk once it is large enough."""
+        self.pieces.append(piece)
+        self.length += len(piece)
+        if self.length >= self.size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        chunk = ''.join(self.pieces)
+        self.pieces = []
+        self.length = 0
+        return chunk
+
+
+def _buffered(pieces, size=BUFFER_SIZE):
+    buffer = _Buffer(size)
+    for piece in pieces:
+        chunk = buffer.add(piece)
+        if chunk:
+            yield chunk
+    chunk = buffer.flush()
+    if chunk:
+        yield chunk
+
+
+async def _abuffered(pieces, size=BUFFER_SIZE):
+    buffer = _Buffer(size)
+    async for piece in pieces:
+        chunk = buffer.add(piece)
+        if chunk:
+            yield chunk
+    chunk = buffer.flush()
+    if chunk:
+        yield chunk
+
+
+class _JSONArrayEncoder:
+    opening = '['
+    closing = ']'
+
+    def __init__(self):
+        self.encoder = DjangoJSONEncoder()
+        self.separator = ''
+
+    def encode(self, row):
+        piece = self.separator + self.encoder.encode(row)
+        self.separator = ', '
+        return piece
+
+
+def flatten(row, prefix=''):
+    """{'product': {'name': ...}} -> {'product_name': ...}"""
+    flat = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}_'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+class _Echo:
+    """File-like object handing back what csv.writer writes into it."""
+
+    def write(self, value):
+        return value
+
+
+class _CSVEncoder:
+    """Rows are flattened, the columns of the first row make the header."""
+    opening = ''
+    closing = ''
+
+    def __init__(self):
+        self.writer = csv.writer(_Echo())
+        self.header = None
+
+    def encode(self, row):
+        row = flatten(row)
+        piece = ''
+        if self.header is None:
+            self.header = list(row)
+            piece = self.writer.writerow(self.header)
+        return piece + self.writer.writerow([row.get(column) for column in self.header])
+
+
+def _encoded(rows, encoder):
+    yield encoder.opening
+    for row in rows:
+        yield encoder.encode(row)
+    yield encoder.closing
+
+
+async def _aencoded(rows, encoder):
+    yield encoder.opening
+    async for row in rows:
+        yield encoder.encode(row)
+    yield encoder.closing
+
+
+def streaming_response(rows, stream_format, filename):
+    """
+    Stream `rows` (an iterator, or an async iterator in async views, of dicts) as a
+    JSON array or a CSV file.
+    Rows are encoded as they are produced, so memory stays flat however large the result is.
+    """
+    encoder = _CSVEncoder() if stream_format == 'csv' else _JSONArrayEncoder()
+    if hasattr(rows, '__aiter__'):
+        content = _abuffered(_aencoded(rows, encoder))
+    else:
+        content = _buffered(_encoded(rows, encoder))
+
+    if stream_format == 'csv':
+        response = StreamingHttpResponse(content, content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+        return response
+    return StreamingHttpResponse(content, content_type='application/json')
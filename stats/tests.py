@@ -1,3 +1,518 @@
-from django.test import TestCase
+import base64
+import json
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from product.models import Category, Product, ProductInput, ProductOutput, StockMovement, Unit
+from product.services import add_input, backdate_movement
+from stats.balances import rebuild_product_balance
+from stats.cache import ReportCache, SingleFlight, report_cache
+from stats.jobs import claim_job, requeue_stale_jobs, run_job
+from stats.models import DailyStock, ReportJob
+from stats.parallel import encode_report_parallel, split
+from stats.report import build_report, filter_products, report_segments
+from stats.snapshots import rebuild_snapshots
+from users.models import User
+
+
+class MovementListQueryTests(APITestCase):
+    """Movement lists are read with one query whatever the number of rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('omborchi', password='secret', first_name='Ali', last_name='Valiyev')
+        unit = Unit.objects.create(name='dona')
+        category = Category.objects.create(name='Ichimliklar')
+        cls.products = [
+            Product.objects.create(name='Mahsulot %d' % i, price=1000 + i, prod_code='478000000%04d' % i,
+                                   unit=unit if i % 2 else None, category=category if i % 3 else None)
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def add_movements(self, count):
+        for i in range(count):
+            product = self.products[i % len(self.products)]
+            ProductInput.objects.create(product=product, input_quantity=5, user_id=self.user)
+            ProductOutput.objects.create(product=product, output_quantity=2, user_id=self.user if i % 2 else None)
+
+    def assert_single_query(self, url_name, **params):
+        for count in (1, 20):
+            self.add_movements(count)
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse(url_name), params)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200)
+
+    def test_input_list(self):
+        self.assert_single_query('input-list')
+
+    def test_output_list(self):
+        self.assert_single_query('output-list')
+
+    def test_filtered_and_ordered_list(self):
+        self.assert_single_query('input-list', category=Category.objects.get().pk, order_by='category')
+        self.assert_single_query('output-list', category=Category.objects.get().pk, order_by='name')
+
+    def test_paginated_list(self):
+        self.assert_single_query('input-list', page_size=10)
+        self.assert_single_query('output-list', page_size=10)
+
+    def test_streamed_list(self):
+        self.assert_single_query('input-list', stream='json')
+        self.assert_single_query('output-list', stream='csv')
+
+    def test_history_page(self):
+        self.add_movements(3)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('movement-history'), {'page_size': 4})
+        rows = response.data['results']
+        self.assertEqual([row['type'] for row in rows], ['input', 'output', 'input', 'output'])
+        self.assertEqual([row['quantity'] for row in rows], ['5.00', '2.00', '5.00', '2.00'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_list_content(self):
+        self.add_movements(2)
+        response = self.client.get(reverse('output-list'), {'order_by': 'quantity'})
+        users = sorted(row['user'] or '' for row in response.data)
+        self.assertEqual(users, ['', 'Ali Valiyev'])
+        self.assertEqual(response.data[0]['product']['name'], 'Mahsulot 0')
+        self.assertIsNone(response.data[0]['product']['unit'])
+        self.assertEqual(response.data[1]['product']['unit'], 'dona')
+
+
+def report_figures(report):
+    """{product name: (beginning, input, output, last quantity)} of the report rows."""
+    return {row['product']['name']: tuple(Decimal(str(row[part]['quantity']))
+                                          for part in ('beginning', 'input', 'output', 'last'))
+            for row in report}
+
+
+class ReportQueryTests(TestCase):
+    """The report of every product is computed by one query, with the figures of each product's movements."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('hisobchi', password='secret')
+        cls.now = timezone.now()
+        history = [('Olma', 10, 2), ('Olma', 3, 10), ('Olma', 2, -4), ('Nok', 3, 3), ('Behi', 10, 5)]
+        for name, days_ago, quantity in history:
+            product, _ = Product.objects.get_or_create(name=name, defaults={'price': 1000, 'prod_code': name})
+            model = ProductInput if quantity > 0 else ProductOutput
+            backdate_movement(model, product.pk, abs(quantity), cls.now - timedelta(days=days_ago), cls.user)
+
+    def report(self, **options):
+        return build_report(filter_products(), self.now - timedelta(days=5), self.now, **options)
+
+    def test_figures(self):
+        # Behi only moved before the range
+        expected = {'Olma': (2, 10, 4, 8), 'Nok': (0, 3, 0, 3)}
+        self.assertEqual(report_figures(self.report()), expected)
+        self.assertEqual(report_figures(self.report(use_snapshots=False)), expected)
+
+    def test_single_query(self):
+        for count in (0, 20):
+            for i in range(count):
+                product = Product.objects.create(name='Mahsulot %d' % i, price=1000, prod_code='478000000%04d' % i)
+                backdate_movement(ProductInput, product.pk, 5, self.now - timedelta(days=1), self.user)
+            for use_snapshots in (True, False):
+                with self.assertNumQueries(1):
+                    report = self.report(use_snapshots=use_snapshots)
+                self.assertEqual(len(report), 2 + count)
+
+
+class QueryPlanTests(TestCase):
+
+    def test_query_shapes_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('Every query shape uses an index', out.getvalue())
+
+
+class ReportCacheTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('hisobchi', password='secret')
+        cls.product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+
+    def setUp(self):
+        report_cache.clear()
+        self.client.force_authenticate(self.user)
+        add_input(self.product.pk, 10, self.user)
+
+    def get_report(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('report'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_identical_report_is_cached(self):
+        report, computed = self.get_report(start_date='2020-01-01')
+        cached_report, cached = self.get_report(start_date='2020-01-01')
+        self.assertEqual(report, cached_report)
+        self.assertLess(cached, computed)
+
+    def test_new_movement_invalidates(self):
+        self.get_report()
+        add_input(self.product.pk, 5, self.user)
+        report, _ = self.get_report()
+        self.assertEqual(report[0]['last']['quantity'], '15.00')
+
+    def test_product_edit_invalidates(self):
+        self.get_report()
+        self.product.name = 'Yangi nom'
+        self.product.save()
+        report, _ = self.get_report()
+        self.assertEqual(report[0]['product']['name'], 'Yangi nom')
+
+    def test_size_bound(self):
+        cache = ReportCache(maxsize=2, maxbytes=10)
+        cache.set('a', b'1234')
+        cache.set('b', b'1234')
+        cache.set('c', b'1234')
+        self.assertIsNone(cache.get('a'))
+        cache.set('d', b'12345678')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('d'), b'12345678')
+
+
+class AsyncViewTests(TestCase):
+    """The async endpoints answer like their sync counterparts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('kuzatuvchi', password='secret')
+        product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+        add_input(product.pk, 10, cls.user)
+        ProductOutput.objects.create(product=product, output_quantity=4, user_id=cls.user)
+        cls.headers = {'Authorization': f'Bearer {AccessToken.for_user(cls.user)}'}
+
+    def setUp(self):
+        report_cache.clear()
+
+    async def assert_same(self, url_name, **params):
+        expected = await sync_to_async(self.client.get)(reverse(url_name), params, headers=self.headers)
+        response = await self.async_client.get(reverse(f'async-{url_name}'), params, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected.json())
+
+    async def test_same_as_sync(self):
+        await self.assert_same('report', start_date='2020-01-01', end_date='2030-01-01')
+        await self.assert_same('input-list', order_by='quantity')
+        await self.assert_same('output-list')
+
+    async def test_stream(self):
+        response = await self.async_client.get(reverse('async-output-list'), {'stream': 'csv'}, headers=self.headers)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(content.splitlines()), 2)
+
+    async def test_errors(self):
+        response = await self.async_client.get(reverse('async-report'))
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(reverse('async-input-list'), {'start_date': '2024-13-01'},
+                                               headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Invalid date format'})
+
+
+class KeysetPaginationTests(APITestCase):
+    """Paginated lists follow their cursors and refuse bad ones or another ordering."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('hisobchi', password='secret')
+        product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+        for quantity in range(1, 6):
+            add_input(product.pk, quantity, cls.user)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_pages(self):
+        response = self.client.get(reverse('input-list'), {'page_size': 2})
+        quantities = [row['input_quantity'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            quantities += [row['input_quantity'] for row in response.data['results']]
+        self.assertEqual(quantities, ['1.00', '2.00', '3.00', '4.00', '5.00'])
+
+    def test_bad_parameters(self):
+        response = self.client.get(reverse('input-list'), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'cursor': ['Invalid cursor']})
+        response = self.client.get(reverse('input-list'), {'page_size': 2, 'order_by': 'quantity'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('order_by', response.data)
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        response = self.client.get(reverse('async-input-list'), {'cursor': 'nonsense'}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_values(self):
+        def cursor(position):
+            return base64.urlsafe_b64encode(json.dumps({'p': position, 'r': 0}).encode()).decode()
+
+        for url, position in (('/products/', ['abc']), ('/products/', [None]),
+                              (reverse('input-list'), ['zzz', 1]), (reverse('input-list'), [None, 1]),
+                              (reverse('input-list'), ['2024-01-01T00:00:00+00:00', [1]])):
+            with self.subTest(url=url, position=position):
+                response = self.client.get(url, {'cursor': cursor(position)})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data, {'cursor': ['Invalid cursor']})
+        response = self.client.get(reverse('input-list'), {'cursor': cursor(['2000-01-01T00:00:00+00:00', 0])})
+        self.assertEqual(len(response.data['results']), 5)
+
+
+class ReportJobTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('hisobchi', password='secret')
+        for i in range(3):
+            product = Product.objects.create(name='Mahsulot %d' % i, price=1000, prod_code='478000000000%d' % i)
+            add_input(product.pk, 10 + i, cls.user)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_job_is_computed_in_chunks(self):
+        params = {'start_date': '2020-01-01', 'order_by': 'name'}
+        response = self.client.post(reverse('report-job-list'), params)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['id']
+        result_url = reverse('report-job-result', args=[job_id])
+        self.assertEqual(self.client.get(result_url).status_code, 409)
+
+        run_job(claim_job(), chunk_size=2)
+        self.assertIsNone(claim_job())
+        job = self.client.get(reverse('report-job-detail', args=[job_id])).data
+        self.assertEqual((job['status'], job['processed'], job['total'], job['progress']), ('done', 3, 3, 100))
+        self.assertEqual(self.client.get(result_url).json(), self.client.get(reverse('report'), params).json())
+
+    def test_invalid_params(self):
+        response = self.client.post(reverse('report-job-list'), {'start_date': '2024-05-01', 'end_date': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReportJob.objects.exists())
+
+    def test_abandoned_job_is_queued_again(self):
+        job = ReportJob.objects.create(user=self.user)
+        claim_job()
+        self.assertEqual(requeue_stale_jobs(timedelta(hours=1)), 0)
+        ReportJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(requeue_stale_jobs(timedelta(hours=1)), 1)
+        self.assertEqual(claim_job(), job)
+
+
+class BalanceRebuildTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('hisobchi', password='secret')
+        cls.product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+        for quantity in (10, 5, 7):
+            add_input(cls.product.pk, quantity, user)
+        ProductOutput.objects.create(product=cls.product, output_quantity=4, user_id=user)
+
+    def test_balances_are_rebuilt(self):
+        StockMovement.objects.update(all_quantity=0)
+        Product.objects.update(quantity=100)
+        out = StringIO()
+        call_command('rebuild_balances', chunk_size=3, batch_size=2, stdout=out)
+        self.assertIn('4 balances and 1 product quantities fixed', out.getvalue())
+        balances = StockMovement.objects.order_by('created_at', 'pk').values_list('all_quantity', flat=True)
+        self.assertEqual(list(balances), [10, 15, 22, 18])
+        self.assertEqual(Product.objects.get().quantity, 18)
+        self.assertEqual(DailyStock.objects.get().closing_quantity, 18)
+
+        call_command('rebuild_balances', stdout=out)
+        self.assertIn('0 balances and 0 product quantities fixed', out.getvalue())
+
+    def test_snapshots_rebuilt_with_the_product(self):
+        StockMovement.objects.update(all_quantity=0)
+        DailyStock.objects.update(closing_quantity=0)
+        self.assertEqual(rebuild_product_balance(self.product.pk)[:2], (4, 4))
+        self.assertEqual(DailyStock.objects.get().closing_quantity, 18)
+
+
+class SnapshotBackfillTests(TestCase):
+    """The migration adding the snapshots builds them for the history already posted."""
+
+    def test_migration_builds_snapshots(self):
+        user = User.objects.create_user('hisobchi', password='secret')
+        product = Product.objects.create(name='Mahsulot', price=1000, prod_code='4780000000001')
+        add_input(product.pk, 10, user)
+        add_input(product.pk, 5, user)
+        StockMovement.objects.filter(quantity=10).update(created_at=timezone.now() - timedelta(days=3))
+        DailyStock.objects.all().delete()
+
+        migration = import_module('stats.migrations.0004_backfill_daily_stock')
+        migration.build_snapshots(apps, None)
+        snapshots = DailyStock.objects.order_by('date').values_list('opening_quantity', 'input_quantity',
+                                                                    'closing_quantity')
+        self.assertEqual(list(snapshots), [(0, 10, 10), (10, 5, 15)])
+
+
+class ReportSplitTests(APITestCase):
+    """
+    Reports add up the raw movements of the partial first and last days and the snapshots of
+    the whole days between them, with the same figures as the movements alone.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('hisobchi', password='secret')
+        cls.day = timezone.localdate() - timedelta(days=5)
+        cls.apple = Product.objects.create(name='Olma', price=1000, prod_code='4780000000001')
+        cls.pear = Product.objects.create(name='Nok', price=1000, prod_code='4780000000002')
+        cls.plum = Product.objects.create(name='Olxo\'ri', price=1000, prod_code='4780000000003')
+        history = [
+            (cls.apple, 0, 10, 10), (cls.pear, 0, 10, 7), (cls.apple, 1, 8, 5), (cls.plum, 1, 9, 6),
+            (cls.apple, 1, 18, -3), (cls.apple, 2, 12, -2), (cls.plum, 2, 10, -6), (cls.apple, 3, 9, 4),
+            (cls.apple, 3, 20, -1),
+        ]
+        for product, days, hour, quantity in history:
+            model = ProductInput if quantity > 0 else ProductOutput
+            backdate_movement(model, product.pk, abs(quantity), cls.at(days, hour), cls.user)
+
+    @classmethod
+    def at(cls, days, hour):
+        return timezone.make_aware(datetime.combine(cls.day + timedelta(days=days), datetime.min.time())
+                                   + timedelta(hours=hour))
+
+    def setUp(self):
+        report_cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_whole_days(self):
+        day = self.day + timedelta(days=1)
+        params = {'start_date': f'{day:%Y-%m-%d}', 'end_date': f'{day + timedelta(days=1):%Y-%m-%d}'}
+        expected = {'Olma': (10, 5, 5, 10), "Olxo'ri": (0, 6, 6, 0)}
+        response = self.client.get(reverse('report'), params)
+        self.assertEqual(report_figures(json.loads(response.content)), expected)
+
+        rebuild_snapshots()
+        report_cache.clear()
+        response = self.client.get(reverse('report'), params)
+        self.assertEqual(report_figures(json.loads(response.content)), expected)
+
+    def test_partial_days(self):
+        # From noon of the second day to noon of the fourth: the 08:00 input and the 20:00 output are outside
+        start, end = self.at(1, 12), self.at(3, 12)
+        self.assertEqual([kind for _, kind, _ in report_segments(start, end)], ['raw', 'snapshot', 'raw'])
+        expected = {'Olma': (15, 4, 5, 14), "Olxo'ri": (6, 0, 6, 0)}
+        self.assertEqual(report_figures(build_report(filter_products(), start, end)), expected)
+        self.assertEqual(report_figures(build_report(filter_products(), start, end, use_snapshots=False)), expected)
+        rebuild_snapshots()
+        self.assertEqual(report_figures(build_report(filter_products(), start, end)), expected)
+
+
+class InlineExecutor:
+    """Runs the submitted calls right away, in the test's own transaction."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class ParallelReportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('hisobchi', password='secret')
+        category = Category.objects.create(name='Ichimliklar')
+        for i in range(7):
+            product = Product.objects.create(name='Mahsulot %d' % (i % 3), price=1000 + i % 2,
+                                             prod_code='47800000%05d' % i, category=category if i % 2 else None)
+            add_input(product.pk, 10 + i, user)
+
+    def test_split(self):
+        self.assertEqual(split(list(range(7)), 3), [[0, 1, 2], [3, 4], [5, 6]])
+        self.assertEqual(split([1], 2), [[1], []])
+
+    def test_shards_are_joined_in_order(self):
+        end = timezone.now()
+        start = end - timedelta(days=1)
+        for order_by in (None, 'name', 'price', 'category'):
+            products = filter_products(order_by=order_by)
+            products = products.order_by(*products.query.order_by, 'pk')
+            expected = json.dumps(build_report(products, start, end), cls=DjangoJSONEncoder)
+            for shards in (1, 3, 10):
+                with self.subTest(order_by=order_by, shards=shards):
+                    self.assertEqual(encode_report_parallel(products, start, end, InlineExecutor(), shards), expected)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def run_concurrently(self, flight, fn, count, **kwargs):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', fn, **kwargs)))
+                   for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight(timeout=5)
+        release = threading.Event()
+        executions = []
+
+        def compute():
+            executions.append(1)
+            release.wait(5)
+            return 'report'
+
+        threads, results = self.run_concurrently(flight, compute, 5)
+        while flight.metrics()['calls'] < 5:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(results, ['report'] * 5)
+        self.assertEqual(flight.metrics(), {'calls': 5, 'executed': 1, 'coalesced': 4, 'timeouts': 0,
+                                            'errors': 0, 'in_flight': 0})
+
+    def test_waiting_times_out(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            return 'report'
+
+        threads, results = self.run_concurrently(flight, compute, 1)
+        while flight.metrics()['in_flight'] < 1:
+            time.sleep(0.01)
+        self.assertEqual(flight.do('key', lambda: 'own report', timeout=0.01), 'own report')
+        release.set()
+        threads[0].join()
+        self.assertEqual(flight.metrics()['timeouts'], 1)
+
+    def test_error_is_raised_and_not_kept(self):
+        flight = SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.do('key', lambda: 1 / 0)
+        self.assertEqual(flight.metrics()['errors'], 1)
+        self.assertEqual(flight.do('key', lambda: 'retried'), 'retried')
@@ -1,12 +1,24 @@
 from django.urls import path
 from .views import *
+from .async_views import *
 from product.views import *
 
 
 urlpatterns = [
     path('report/', ReportAPIView.as_view(), name='report'),
+    path('report/cache/', ReportCacheStatsAPIView.as_view(), name='report-cache-stats'),
+    path('report/jobs/', ReportJobListAPIView.as_view(), name='report-job-list'),
+    path('report/jobs/<int:pk>/', ReportJobDetailAPIView.as_view(), name='report-job-detail'),
+    path('report/jobs/<int:pk>/result/', ReportJobResultAPIView.as_view(), name='report-job-result'),
     # Input
     path('inputs/', ProductInputsListAPIView.as_view(), name='input-list'),
     # Output
     path('outputs/', ProductOutputsListAPIView.as_view(), name='output-list'),
+    # Inputs and outputs together
+    path('history/', CombinedProductListAPIView.as_view(), name='movement-history'),
+    # Async versions, for an ASGI server
+    path('async/report/', AsyncReportView.as_view(), name='async-report'),
+    path('async/inputs/', AsyncProductInputsListView.as_view(), name='async-input-list'),
+    path('async/outputs/', AsyncProductOutputsListView.as_view(), name='async-output-list'),
+    path('async/history/', AsyncCombinedProductListView.as_view(), name='async-movement-history'),
 ]
\ No newline at end of file
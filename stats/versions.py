@@ -0,0 +1,33 @@
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from product.models import StockMovement
+from .models import ChangeCounter
+
+REPORT_COUNTER = 'report'
+
+
+def bump_report_version():
+    """Invalidate every cached report, in this and the other worker processes."""
+    counters = ChangeCounter.objects.filter(name=REPORT_COUNTER)
+    if counters.update(value=F('value') + 1):
+        return
+    try:
+        with transaction.atomic():
+            ChangeCounter.objects.create(name=REPORT_COUNTER, value=1)
+    except IntegrityError:
+        # Another request created the counter in the meantime
+        counters.update(value=F('value') + 1)
+
+
+def ledger_version():
+    """
+    (last movement id, report counter): any new movement or change to the
+    reported data gives a different version. Read with a single query.
+    """
+    quote = connection.ops.quote_name
+    sql = (f'SELECT (SELECT MAX(id) FROM {quote(StockMovement._meta.db_table)}), '
+           f'(SELECT value FROM {quote(ChangeCounter._meta.db_table)} WHERE name = %s)')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [REPORT_COUNTER])
+        return tuple(cursor.fetchone())
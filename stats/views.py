@@ -3,9 +3,7 @@ from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
-from django.http import JsonResponse
-from django.utils.timezone import make_aware
-from datetime import datetime, time
+from django.http import HttpResponse
 from django.db.models import Sum, F
 from rest_framework.views import APIView
 from rest_framework import status
@@ -13,10 +11,20 @@ from django.db.models import Q
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
 from product.models import Product, ProductInput, ProductOutput
+from product.pagination import MovementPagination, pagination_parameters
 from product.serializers import ProductInputGetSerializer, ProductOutputGetSerializer, CombinedProductSerializer, \
     ProductReportSerializer
 from users.models import ReportCode
-from .serializers import ReportSerializer
+from users.permissions import IsStaffUser
+from .cache import report_cache, report_content, report_flight, report_key
+from .history import history_queryset
+from .jobs import create_report_job
+from .models import ReportJob
+from .params import InvalidParams, filter_movements, parse_date_range, parse_history_dates, report_movement_range
+from .report import filter_products, iter_report
+from .serializers import ReportJobCreateSerializer, ReportJobSerializer, ReportSerializer
+from .streaming import STREAM_FORMATS, iter_serialized, stream_parameter, streaming_response
+from .versions import ledger_version
 from rest_framework.response import Response
 
 
@@ -27,11 +35,6 @@ class ProductInputsListAPIView(APIView):
     """
     permission_classes = [IsAuthenticated, ]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.start_date = make_aware(datetime.strptime("2020-01-01", '%Y-%m-%d'))
-        self.end_date = make_aware(datetime.combine(datetime.now().date(), time.max))
-
     @swagger_auto_schema(tags=['Statistics'], manual_parameters=[
         openapi.Parameter('product_id', openapi.IN_QUERY, description="Filter by product ID",
                           type=openapi.TYPE_INTEGER),
@@ -42,66 +45,26 @@ class ProductInputsListAPIView(APIView):
         openapi.Parameter('category', openapi.IN_QUERY, description="Category ID", type=openapi.TYPE_INTEGER),
         openapi.Parameter('order_by', openapi.IN_QUERY, description="Order by field", type=openapi.TYPE_STRING,
                           enum=['category', 'name', 'price', 'quantity']),
+        *pagination_parameters,
+        stream_parameter,
     ])
     def get(self, request):
-        product_id = request.query_params.get('product_id')
-        if product_id:
-            product_inputs = ProductInput.objects.filter(product_id=product_id)
-        else:
-            product_inputs = ProductInput.objects.all()
-
-        category_id = request.query_params.get('category')
-        if category_id:
-            product_inputs = product_inputs.filter(category_id=category_id)
-
-        start_date_str = request.query_params.get('start_date')
-        end_date_str = request.query_params.get('end_date')
-        if start_date_str and end_date_str:
-            if start_date_str > end_date_str:
-                return Response({'error': 'Boshlanish sanasi yakuniy sanadan keyin bo\'lishi mumkin emas.'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            try:
-                self.start_date = make_aware(datetime.strptime(start_date_str, '%Y-%m-%d'))
-                self.end_date = make_aware(
-                    datetime.combine(datetime.strptime(end_date_str, '%Y-%m-%d').date(), time.max))
-                product_inputs = product_inputs.filter(
-                    created_at__range=(self.start_date, self.end_date)
-                )
-            except ValueError:
-                return {'error': 'Invalid date format'}
-        elif start_date_str or end_date_str:
-            if start_date_str:
-                if start_date_str > datetime.now().strftime('%Y-%m-%d'):
-                    return Response({'error': 'Boshlanish sanasi bugungi sanadan keyin bo\'lishi mumkin emas.'},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                try:
-                    self.start_date = make_aware(datetime.strptime(start_date_str, '%Y-%m-%d'))
-                    self.end_date = make_aware(datetime.now())
-
-                except ValueError:
-                    return {'error': 'Invalid date format'}
-            else:
-                try:
-                    self.start_date = make_aware(datetime.strptime("2020-01-01", '%Y-%m-%d'))
-                    self.end_date = make_aware(
-                        datetime.combine(datetime.strptime(end_date_str, '%Y-%m-%d').date(), time.max))
-                except ValueError:
-                    return {'error': 'Invalid date format'}
-
-            product_inputs = product_inputs.filter(
-                created_at__range=(self.start_date, self.end_date)
-            )
-
-        order_by = request.query_params.get('order_by')
-        if order_by:
-            if order_by == 'category':
-                product_inputs = product_inputs.order_by('category__name')
-            elif order_by == 'name':
-                product_inputs = product_inputs.order_by('name')
-            elif order_by == 'price':
-                product_inputs = product_inputs.order_by('price')
-            elif order_by == 'quantity':
-                product_inputs = product_inputs.order_by('quantity')
+        product_inputs = ProductInputGetSerializer.setup_queryset(ProductInput.objects.all())
+        try:
+            product_inputs = filter_movements(product_inputs, request.query_params)
+        except InvalidParams as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        stream_format = request.query_params.get('stream')
+        if stream_format in STREAM_FORMATS:
+            rows = iter_serialized(product_inputs, ProductInputGetSerializer)
+            return streaming_response(rows, stream_format, 'inputs')
+
+        paginator = MovementPagination()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(product_inputs, request, view=self)
+            serializer = ProductInputGetSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
 
         serializer = ProductInputGetSerializer(product_inputs, many=True)
         return Response(serializer.data)
@@ -114,11 +77,6 @@ class ProductOutputsListAPIView(APIView):
     """
     permission_classes = [IsAuthenticated, ]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.start_date = make_aware(datetime.strptime("2020-01-01", '%Y-%m-%d'))
-        self.end_date = make_aware(datetime.combine(datetime.now().date(), time.max))
-
     @swagger_auto_schema(tags=['Statistics'], manual_parameters=[
         openapi.Parameter('product_id', openapi.IN_QUERY, description="Filter by product ID",
                           type=openapi.TYPE_INTEGER),
@@ -129,66 +87,26 @@ class ProductOutputsListAPIView(APIView):
         openapi.Parameter('category', openapi.IN_QUERY, description="Category ID", type=openapi.TYPE_INTEGER),
         openapi.Parameter('order_by', openapi.IN_QUERY, description="Order by field", type=openapi.TYPE_STRING,
                           enum=['category', 'name', 'price', 'quantity']),
+        *pagination_parameters,
+        stream_parameter,
     ])
     def get(self, request):
-        product_id = request.query_params.get('product_id')
-        if product_id:
-            product_outputs = ProductOutput.objects.filter(product_id=product_id)
-        else:
-            product_outputs = ProductOutput.objects.all()
-
-        category_id = request.query_params.get('category')
-        if category_id:
-            product_outputs = product_outputs.filter(category_id=category_id)
-
-        start_date_str = request.query_params.get('start_date')
-        end_date_str = request.query_params.get('end_date')
-        if start_date_str and end_date_str:
-            if start_date_str > end_date_str:
-                return Response({'error': 'Boshlanish sanasi yakuniy sanadan keyin bo\'lishi mumkin emas.'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            try:
-                self.start_date = make_aware(datetime.strptime(start_date_str, '%Y-%m-%d'))
-                self.end_date = make_aware(
-                    datetime.combine(datetime.strptime(end_date_str, '%Y-%m-%d').date(), time.max))
-                product_outputs = product_outputs.filter(
-                    created_at__range=(self.start_date, self.end_date)
-                )
-            except ValueError:
-                return {'error': 'Invalid date format'}
-        elif start_date_str or end_date_str:
-            if start_date_str:
-                if start_date_str > datetime.now().strftime('%Y-%m-%d'):
-                    return Response({'error': 'Boshlanish sanasi bugungi sanadan keyin bo\'lishi mumkin emas.'},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                try:
-                    self.start_date = make_aware(datetime.strptime(start_date_str, '%Y-%m-%d'))
-                    self.end_date = make_aware(datetime.now())
-
-                except ValueError:
-                    return {'error': 'Invalid date format'}
-            else:
-                try:
-                    self.start_date = make_aware(datetime.strptime("2020-01-01", '%Y-%m-%d'))
-                    self.end_date = make_aware(
-                        datetime.combine(datetime.strptime(end_date_str, '%Y-%m-%d').date(), time.max))
-                except ValueError:
-                    return {'error': 'Invalid date format'}
-
-                product_outputs = product_outputs.filter(
-                    created_at__range=(self.start_date, self.end_date)
-                )
-
-        order_by = request.query_params.get('order_by')
-        if order_by:
-            if order_by == 'category':
-                product_outputs = product_outputs.order_by('category__name')
-            elif order_by == 'name':
-                product_outputs = product_outputs.order_by('name')
-            elif order_by == 'price':
-                product_outputs = product_outputs.order_by('price')
-            elif order_by == 'quantity':
-                product_outputs = product_outputs.order_by('quantity')
+        product_outputs = ProductOutputGetSerializer.setup_queryset(ProductOutput.objects.all())
+        try:
+            product_outputs = filter_movements(product_outputs, request.query_params)
+        except InvalidParams as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        stream_format = request.query_params.get('stream')
+        if stream_format in STREAM_FORMATS:
+            rows = iter_serialized(product_outputs, ProductOutputGetSerializer)
+            return streaming_response(rows, stream_format, 'outputs')
+
+        paginator = MovementPagination()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(product_outputs, request, view=self)
+            serializer = ProductOutputGetSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
 
         serializer = ProductOutputGetSerializer(product_outputs, many=True)
         return Response(serializer.data)
@@ -196,36 +114,38 @@ class ProductOutputsListAPIView(APIView):
 
 class CombinedProductListAPIView(APIView):
     """
-    List all product inputs and outputs, optionally filtered by product_id, ordered by datetime.
+    List all product inputs and outputs, optionally filtered by product_id and dates, ordered by datetime.
     """
     permission_classes = [IsAuthenticated, ]
 
     @swagger_auto_schema(tags=['Statistics'], manual_parameters=[
         openapi.Parameter('product_id', openapi.IN_QUERY, description="Filter by product ID",
                           type=openapi.TYPE_INTEGER),
+        openapi.Parameter('start_date', openapi.IN_QUERY, description="Start date in format 'YYYY-MM-DD'",
+                          type=openapi.TYPE_STRING),
+        openapi.Parameter('end_date', openapi.IN_QUERY, description="End date in format 'YYYY-MM-DD'",
+                          type=openapi.TYPE_STRING),
+        *pagination_parameters,
+        stream_parameter,
     ])
     def get(self, request):
         product_id = request.query_params.get('product_id')
+        try:
+            start_date, end_date = parse_history_dates(request.query_params)
+        except InvalidParams as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get all ProductInput and ProductOutput, optionally filtered by product_id
-        product_inputs = ProductInput.objects.all()
-        product_outputs = ProductOutput.objects.all()
+        movements = history_queryset(product_id, start_date, end_date)
 
-        if product_id:
-            product_inputs = product_inputs.filter(product_id=product_id)
-            product_outputs = product_outputs.filter(product_id=product_id)
+        stream_format = request.query_params.get('stream')
+        if stream_format in STREAM_FORMATS:
+            rows = iter_serialized(movements, CombinedProductSerializer)
+            return streaming_response(rows, stream_format, 'history')
 
-        # Annotate each queryset with a 'type' field to distinguish them
-        product_inputs = product_inputs.annotate(type=F('input_quantity'))
-        product_outputs = product_outputs.annotate(type=F('output_quantity'))
-
-        # Combine and order the querysets by created_at
-        combined_queryset = list(product_inputs) + list(product_outputs)
-        combined_queryset.sort(key=lambda x: x.created_at)
-
-        # Serialize the combined queryset
-        serializer = CombinedProductSerializer(combined_queryset, many=True)
-        return Response(serializer.data)
+        paginator = MovementPagination()
+        page = paginator.paginate_queryset(movements, request, view=self)
+        serializer = CombinedProductSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
 #### REPORT ####
@@ -233,12 +153,6 @@ class ReportAPIView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.start_date = make_aware(datetime.strptime("2020-01-01", '%Y-%m-%d'))
-        self.end_date = make_aware(
-            datetime.combine(datetime.now().date(), time.max))
-
     @swagger_auto_schema(
         tags=['Statistics'],
         manual_parameters=[
@@ -250,141 +164,89 @@ class ReportAPIView(APIView):
             openapi.Parameter('order_by', openapi.IN_QUERY, description="Order by field", type=openapi.TYPE_STRING,
                               enum=['category', 'name', 'price', 'quantity']),
             openapi.Parameter('search', openapi.IN_QUERY, description="Search query", type=openapi.TYPE_STRING),
+            stream_parameter,
         ]
     )
     def get(self, request, *args, **kwargs):
-        start_date_str = request.query_params.get('start_date')
-        end_date_str = request.query_params.get('end_date')
         category_id = request.query_params.get('category')
         order_by = request.query_params.get('order_by')
         search_query = request.query_params.get('search')
+        try:
+            dates = parse_date_range(request.query_params)
+        except InvalidParams as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        self.start_date, self.end_date = dates.start, dates.end
+        movement_range = report_movement_range(dates)
+
+        products = filter_products(category_id=category_id, order_by=order_by, search=search_query,
+                                   movement_range=movement_range)
+        stream_format = request.query_params.get('stream')
+        if stream_format in STREAM_FORMATS:
+            rows = iter_report(products, self.start_date, self.end_date)
+            return streaming_response(rows, stream_format, 'report')
+
+        # Read the version first, so a movement added meanwhile can't be missing from a cached report
+        cache_key = (report_key(self.start_date, None if dates.up_to_now else self.end_date, movement_range,
+                                category_id, order_by, search_query), ledger_version())
+        content = report_content(products, self.start_date, self.end_date, cache_key)
+        return HttpResponse(content, content_type='application/json')
+
+
+class ReportCacheStatsAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsStaffUser]
+
+    @swagger_auto_schema(tags=['Statistics'])
+    def get(self, request):
+        return Response({
+            'cache': report_cache.metrics(),
+            'coalescing': report_flight.metrics(),
+        })
+
+
+#### REPORT JOBS ####
+class ReportJobListAPIView(APIView):
+    """
+    Reports computed in the background by the run_report_worker command,
+    for ranges too long to be answered within a request.
+    """
+    permission_classes = [IsAuthenticated, ]
+
+    @swagger_auto_schema(tags=['Statistics'])
+    def get(self, request):
+        jobs = ReportJob.objects.defer('result').filter(user=request.user).order_by('-created_at')[:20]
+        serializer = ReportJobSerializer(jobs, many=True)
+        return Response(serializer.data)
+
+    @swagger_auto_schema(tags=['Statistics'], request_body=ReportJobCreateSerializer)
+    def post(self, request):
+        serializer = ReportJobCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = {name: value.isoformat() if hasattr(value, 'isoformat') else value
+                  for name, value in serializer.validated_data.items()}
+        try:
+            job = create_report_job(request.user, params)
+        except InvalidParams as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(ReportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ReportJobDetailAPIView(APIView):
+    permission_classes = [IsAuthenticated, ]
+
+    @swagger_auto_schema(tags=['Statistics'])
+    def get(self, request, pk):
+        job = get_object_or_404(ReportJob.objects.defer('result'), pk=pk, user=request.user)
+        return Response(ReportJobSerializer(job).data)
+
+
+class ReportJobResultAPIView(APIView):
+    permission_classes = [IsAuthenticated, ]
 
-        products = Product.objects.all()
-
-        if category_id:
-            products = products.filter(category_id=category_id)
-
-        if order_by:
-            if order_by == 'category':
-                products = products.order_by('category__name')
-            elif order_by == 'name':
-                products = products.order_by('name')
-            elif order_by == 'price':
-                products = products.order_by('price')
-            elif order_by == 'quantity':
-                products = products.order_by('quantity')
-
-        # Fetching report data based on date range
-        if start_date_str and end_date_str:
-            if start_date_str > end_date_str:
-                return Response({'error': 'Boshlanish sanasi yakuniy sanadan keyin bo\'lishi mumkin emas.'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            try:
-                self.start_date = make_aware(datetime.strptime(start_date_str, '%Y-%m-%d'))
-                self.end_date = make_aware(
-                    datetime.combine(datetime.strptime(end_date_str, '%Y-%m-%d').date(), time.max))
-                products = products.filter(
-                    productinput__created_at__range=(self.start_date, self.end_date),
-                    productoutput__created_at__range=(self.start_date, self.end_date)
-                ).distinct()
-            except ValueError:
-                return {'error': 'Invalid date format'}
-        elif start_date_str or end_date_str:
-            if start_date_str:
-                if start_date_str > datetime.now().strftime('%Y-%m-%d'):
-                    return Response({'error': 'Boshlanish sanasi bugungi sanadan keyin bo\'lishi mumkin emas.'},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                try:
-                    self.start_date = make_aware(datetime.strptime(start_date_str, '%Y-%m-%d'))
-                    self.end_date = make_aware(datetime.now())
-
-                except ValueError:
-                    return {'error': 'Invalid date format'}
-            else:
-                try:
-                    self.start_date = make_aware(datetime.strptime("2020-01-01", '%Y-%m-%d'))
-                    self.end_date = make_aware(
-                        datetime.combine(datetime.strptime(end_date_str, '%Y-%m-%d').date(), time.max))
-                    products = products.filter(
-                        productinput__created_at__range=(self.start_date, self.end_date),
-                        productoutput__created_at__range=(self.start_date, self.end_date)
-                    ).distinct()
-                except ValueError:
-                    return {'error': 'Invalid date format'}
-
-        if search_query:
-            products = products.filter(
-                Q(prod_code__icontains=search_query) |
-                Q(name__icontains=search_query) |
-                Q(category__name__icontains=search_query)
-            )
-        report_data = []
-
-        for product in products:
-            goods_in = ProductInput.objects.filter(product=product, created_at__range=(self.start_date, self.end_date))
-            goods_out = ProductOutput.objects.filter(product=product,
-                                                     created_at__range=(self.start_date, self.end_date))
-
-            goods_in_quantity = goods_in.aggregate(goods_in_quantity=Sum('input_quantity'))['goods_in_quantity'] or 0
-            goods_in_price = goods_in_quantity * product.price
-
-            goods_out_quantity = goods_out.aggregate(goods_out_quantity=Sum('output_quantity'))[
-                                     'goods_out_quantity'] or 0
-            goods_out_price = goods_out_quantity * product.price
-
-            if goods_in.first() and goods_out.first():
-                if goods_in.first().created_at <= goods_out.first().created_at:
-                    beginning_quantity = goods_in.first().all_quantity - goods_in.first().input_quantity
-                else:
-                    beginning_quantity = goods_out.first().all_quantity + goods_out.first().output_quantity
-            elif goods_in.first() or goods_out.first():
-                if goods_in.first():
-                    beginning_quantity = goods_in.first().all_quantity - goods_in.first().input_quantity
-
-                else:
-                    beginning_quantity = goods_out.first().all_quantity + goods_out.first().output_quantity
-            else:
-                beginning_quantity = 0
-            beginning_price = beginning_quantity * product.price if beginning_quantity else 0
-
-            if goods_in.last() and goods_out.last():
-                if goods_in.last().created_at >= goods_out.last().created_at:
-                    last_quantity = goods_in.last().all_quantity
-                else:
-                    last_quantity = goods_out.last().all_quantity
-            elif goods_in.last() or goods_out.last():
-                if goods_in.last():
-                    last_quantity = goods_in.last().all_quantity
-                else:
-                    last_quantity = goods_out.last().all_quantity
-            else:
-                last_quantity = 0
-            last_price = last_quantity * product.price if last_quantity else 0
-
-            if all(value == 0 for value in [
-                beginning_quantity, beginning_price, goods_in_quantity, goods_in_price,
-                goods_out_quantity, goods_out_price, last_quantity, last_price
-            ]):
-                continue
-            serializer = ProductReportSerializer(product)
-            product_report = {
-                'product': serializer.data,
-                'beginning': {
-                    "quantity": beginning_quantity,
-                    'price': beginning_price
-                },
-                'input': {
-                    'quantity': goods_in_quantity,
-                    'price': goods_in_price,
-                },
-                'output': {
-                    'quantity': goods_out_quantity,
-                    'price': goods_out_price,
-                },
-                'last': {
-                    'quantity': last_quantity,
-                    'last_price': last_price
-                }
-            }
-            report_data.append(product_report)
-        return JsonResponse(report_data, safe=False)
+    @swagger_auto_schema(tags=['Statistics'])
+    def get(self, request, pk):
+        job = get_object_or_404(ReportJob, pk=pk, user=request.user)
+        if job.status != ReportJob.DONE:
+            return Response({'error': 'Hisobot hali tayyor emas.', 'status': job.status},
+                            status=status.HTTP_409_CONFLICT)
+        return HttpResponse(job.result, content_type='application/json')